@@ -0,0 +1,89 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+
+class BackgroundCache:
+    def __init__(self, stack, callback=None):
+        """Computes a per-frame result once in a background thread and caches it.
+        Subclasses implement `compute`.
+
+        Args:
+            stack (numpy.ndarray or list): The image stack
+            callback (callable, optional): Called with the frame index
+                when a result is ready, from the worker thread. Defaults to None.
+        """
+        self.stack = stack
+        self.callback = callback
+        self.results = {}
+        self.pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def compute(self, im):
+        """Computes the result for a single frame
+
+        Args:
+            im (numpy.ndarray): The frame
+
+        Returns:
+            object: The result to be cached
+        """
+        raise NotImplementedError
+
+    def __contains__(self, i):
+        return i in self.results
+
+    def __getitem__(self, i):
+        return self.results[i]
+
+    def get(self, i):
+        """Returns the cached result of frame `i`, or requests it in the background.
+
+        Args:
+            i (int): Frame index
+
+        Returns:
+            object: The result, None if not computed yet
+        """
+        r = self.results.get(i)
+
+        if r is None:
+            self.request(i)
+
+        return r
+
+    def request(self, *ids):
+        """Computes results of the given frames in the background"""
+        with self._lock:
+            ids = [i for i in ids if 0 <= i < len(self.stack) and i not in self.results and i not in self.pending]
+            self.pending.update(ids)
+
+        for i in ids:
+            self._executor.submit(self._compute, i)
+
+    def _compute(self, i):
+        try:
+            self.results[i] = self.compute(self.stack[i])
+
+        except Exception as e:
+            print(f"Could not compute {type(self).__name__} result of frame {i}: \n{e!r}")
+            return
+
+        finally:
+            # Failed frames can be requested again
+            with self._lock:
+                self.pending.discard(i)
+
+        if self.callback is not None:
+            self.callback(i)
+
+    def submit(self, fn, *args):
+        """Runs a function on the worker thread
+
+        Returns:
+            concurrent.futures.Future: The result
+        """
+        return self._executor.submit(fn, *args)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
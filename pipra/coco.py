@@ -0,0 +1,298 @@
+import json
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+import cv2
+from .masks import decode, RaggedMasks
+from .session import frame_shape
+
+# Frames sent to a worker process at once
+CHUNK_FRAMES = 16
+
+# Segmentation of every object, see `objects`
+FORMATS = ('polygon', 'rle')
+
+# All masks are annotations of a single category
+CATEGORY = {'id': 1, 'name': 'foreground', 'supercategory': 'pipra'}
+
+
+def frame_code(masks, i):
+    """Encoded mask of frame `i`, sent to worker processes instead of the decoded mask
+
+    Args:
+        masks (MaskVolume or RaggedMasks): The masks
+        i (int): Frame index
+
+    Returns:
+        tuple: Encoded mask, see `pipra.masks.encode`, and its shape (y, x)
+    """
+    if isinstance(masks, RaggedMasks):
+        bits = masks.packed(i)
+        return ('bits', bits) if bits.any() else None, frame_shape(masks, i)
+
+    return masks.frames[i], frame_shape(masks, i)
+
+
+def rle_string(counts):
+    """Compresses RLE counts to a string like the COCO API (`pycocotools.mask.encode`)
+
+    Args:
+        counts (numpy.ndarray): Alternating lengths of background and foreground runs
+
+    Returns:
+        str: The compressed counts
+    """
+    s = []
+    counts = [int(c) for c in counts]
+
+    for i, x in enumerate(counts):
+        # Counts are stored relative to the count of the same kind before
+        if i > 2:
+            x -= counts[i-2]
+
+        more = True
+
+        while more:
+            c = x & 0x1f
+            x >>= 5
+            more = x != -1 if c & 0x10 else x != 0
+
+            if more:
+                c |= 0x20
+
+            s.append(chr(c + 48))
+
+    return "".join(s)
+
+
+def rle(crop, offset, shape):
+    """COCO run-length encoding of an object, computed on its bounding box only.
+    Runs are counted in column-major order, starting with background.
+
+    Args:
+        crop (numpy.ndarray): Mask of the bounding box
+        offset (tuple): Offset (y, x) of the bounding box
+        shape (tuple): Frame shape (y, x)
+
+    Returns:
+        dict: `size` and compressed `counts`
+    """
+    h, w = crop.shape
+    y, x = offset
+
+    # An empty row below the crop ends every run within its column
+    padded = np.zeros((w, h+1), dtype=np.int8)
+    padded[:, :h] = crop.T
+    changes = np.flatnonzero(np.diff(padded.ravel(), prepend=0))
+    col, row = np.divmod(changes, h+1)
+    index = (x + col) * shape[0] + y + row
+
+    # Runs continuing in the next column of the frame are merged
+    starts, ends = index[::2], index[1::2]
+    merged = ends[:-1] == starts[1:]
+    starts, ends = starts[np.r_[True, ~merged]], ends[np.r_[~merged, True]]
+
+    bounds = np.empty(2 * len(starts), dtype=np.int64)
+    bounds[::2], bounds[1::2] = starts, ends
+    counts = np.diff(bounds, prepend=0, append=shape[0] * shape[1])
+
+    return {'size': [int(shape[0]), int(shape[1])], 'counts': rle_string(counts)}
+
+
+def polygons(crop, offset, tolerance=0):
+    """Outer contours of an object as COCO polygons, holes are not represented.
+
+    Args:
+        crop (numpy.ndarray): Mask of the bounding box
+        offset (tuple): Offset (y, x) of the bounding box
+        tolerance (float, optional): Maximum distance of the simplified polygon to the contour in px,
+            no simplification if 0. Defaults to 0.
+
+    Returns:
+        list: Polygons as flat lists [x0, y0, x1, y1, ...]
+    """
+    contours, _ = cv2.findContours(crop.view(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE,
+                                   offset=(int(offset[1]), int(offset[0])))
+    out = []
+
+    for c in contours:
+        if tolerance > 0:
+            c = cv2.approxPolyDP(c, tolerance, True)
+
+        # COCO polygons need three points, thin objects are outlined by their pixel edges
+        if len(c) < 3:
+            y, x = offset
+            h, w = crop.shape
+            c = np.array([[x, y], [x+w, y], [x+w, y+h], [x, y+h]])
+
+        out.append([int(v) for v in np.ravel(c)])
+
+    return out
+
+
+def objects(mask, fmt='polygon', tolerance=0):
+    """Segmentation, area and bounding box of every connected component of a mask
+
+    Args:
+        mask (numpy.ndarray): 2D boolean mask
+        fmt (str, optional): One of FORMATS. Defaults to 'polygon'.
+        tolerance (float, optional): Polygon simplification in px, see `polygons`. Defaults to 0.
+
+    Returns:
+        list: One dict per object with `segmentation`, `area` and `bbox` (x, y, width, height)
+    """
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(mask.view(np.uint8), connectivity=8)
+    out = []
+
+    for l in range(1, n):
+        x, y, w, h, area = (int(v) for v in stats[l])
+        crop = labels[y:y+h, x:x+w] == l
+
+        if fmt == 'rle':
+            segmentation = rle(crop, (y, x), mask.shape)
+
+        else:
+            segmentation = polygons(crop, (y, x), tolerance)
+
+        out.append({'segmentation': segmentation, 'area': area, 'bbox': [x, y, w, h]})
+
+    return out
+
+
+def _objects(frames, fmt, tolerance):
+    """Objects of a chunk of encoded frames, run in a worker process"""
+    return [objects(np.ascontiguousarray(decode(code, shape)), fmt, tolerance) for code, shape in frames]
+
+
+def to_coco(masks, files=None, name=None, fmt='polygon', tolerance=0, executor=None, progress=None):
+    """COCO annotations of all masks, one image per frame and one annotation per connected component.
+    Frames are processed in chunks in worker processes, empty frames are skipped.
+
+    Args:
+        masks (MaskVolume or RaggedMasks): The masks
+        files (list, optional): Image file of every frame, e.g. of a folder. Defaults to None.
+        name (str, optional): File name of a stack, frames are referenced by `frame_index`. Defaults to None.
+        fmt (str, optional): One of FORMATS. Defaults to 'polygon'.
+        tolerance (float, optional): Polygon simplification in px, see `polygons`. Defaults to 0.
+        executor (concurrent.futures.Executor, optional): Processes the chunks, a process pool is used if None.
+            Defaults to None.
+        progress (callable, optional): Called with (done, total) frames, cancels if it returns False. Defaults to None.
+
+    Returns:
+        dict or None: The COCO dataset, None if cancelled
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt}, use one of {FORMATS}")
+
+    n = len(masks)
+    images, annotations = [], []
+
+    for i in range(n):
+        h, w = frame_shape(masks, i)
+        image = {'id': i + 1, 'width': int(w), 'height': int(h)}
+
+        if files is not None:
+            image['file_name'] = str(files[i])
+
+        else:
+            image['file_name'] = name
+            image['frame_index'] = i
+
+        images.append(image)
+
+    def collect(frames, result):
+        for i, objs in zip(frames, result):
+            for o in objs:
+                annotations.append({'id': len(annotations) + 1, 'image_id': i + 1, 'category_id': CATEGORY['id'],
+                                    'iscrowd': 0, **o})
+
+    own = executor is None
+
+    if own:
+        # Workers are spawned, forking a process with running threads may deadlock
+        executor = ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'))
+
+    pending = deque()
+
+    try:
+        occupied = [i for i in range(n) if frame_code(masks, i)[0] is not None]
+        chunks = [occupied[k:k+CHUNK_FRAMES] for k in range(0, len(occupied), CHUNK_FRAMES)]
+        max_pending = 2 * getattr(executor, '_max_workers', 1)
+        done = 0
+
+        for frames in chunks:
+            pending.append((frames, executor.submit(_objects, [frame_code(masks, i) for i in frames], fmt, tolerance)))
+
+            while len(pending) > max_pending:
+                frames, f = pending.popleft()
+                collect(frames, f.result())
+                done += len(frames)
+
+                if progress is not None and progress(done, len(occupied)) is False:
+                    return None
+
+        while pending:
+            frames, f = pending.popleft()
+            collect(frames, f.result())
+            done += len(frames)
+
+            if progress is not None and progress(done, len(occupied)) is False:
+                return None
+
+    finally:
+        # Chunks not started yet are dropped when cancelled or on errors
+        for _, f in pending:
+            f.cancel()
+
+        if own:
+            executor.shutdown()
+
+    return {'info': {'description': f"pipra masks ({fmt})", 'date_created': datetime.now().isoformat(timespec='seconds')},
+            'images': images,
+            'annotations': annotations,
+            'categories': [CATEGORY]}
+
+
+def export_coco(fn, masks, files=None, name=None, fmt='polygon', tolerance=0, executor=None, progress=None):
+    """Writes the COCO annotations of all masks to a compact JSON file, see `to_coco`
+
+    Returns:
+        int or None: Number of annotations, None if cancelled
+    """
+    coco = to_coco(masks, files, name, fmt, tolerance, executor, progress)
+
+    if coco is None:
+        return None
+
+    with open(fn, "w") as fp:
+        json.dump(coco, fp, separators=(',', ':'))
+
+    return len(coco['annotations'])
+
+
+if __name__ == '__main__':
+    import argparse
+    import flammkuchen as fl
+    from .masks import load_masks
+
+    # Worker processes import the functions from the package, not from __main__
+    from .coco import export_coco
+
+    parser = argparse.ArgumentParser(description="Exports the masks of a .mask file as COCO annotations")
+    parser.add_argument("mask", help="Path to .mask file")
+    parser.add_argument("-o", "--output", required=True, help="Output .json file")
+    parser.add_argument("--format", choices=FORMATS, default='polygon', help="Segmentation format, defaults to polygon")
+    parser.add_argument("--tolerance", type=float, default=0, help="Polygon simplification in px, defaults to 0")
+    parser.add_argument("--name", help="Image file of a stack, defaults to the .mask file name")
+    args = parser.parse_args()
+
+    masks = load_masks(args.mask)
+    files = fl.load(args.mask, "/files")
+    name = args.name or os.path.splitext(os.path.basename(args.mask))[0]
+
+    count = export_coco(args.output, masks, None if files is None else list(files), name, args.format, args.tolerance,
+                        progress=lambda done, total: print(f"\r{done}/{total} frames", end=""))
+    print(f"\n{count} annotations written to {args.output}")
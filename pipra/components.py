@@ -0,0 +1,237 @@
+import numpy as np
+from scipy import ndimage
+
+# Pixels are connected to their 4 direct neighbours, like flood fill and morphological operations,
+#  voxels of volumes to their 6 direct neighbours, see `scipy.ndimage.generate_binary_structure`
+CONNECTIVITY = 1
+STRUCTURE = ndimage.generate_binary_structure(2, CONNECTIVITY)
+
+
+class ComponentIndex:
+    def __init__(self, mask):
+        """Connected components of a mask, updated incrementally while editing.
+
+        The frame is labeled once. Added pixels are labeled in a window around them and merge
+        the components they touch (union-find). Removed pixels only mark their component as possibly split,
+        it is relabeled within its bounding box when it is queried next.
+
+        Args:
+            mask (numpy.ndarray): 2D boolean mask
+        """
+        mask = np.asarray(mask, dtype=bool)
+        self.shape = mask.shape
+        self.labels, n = ndimage.label(mask, STRUCTURE)
+
+        # Label 0 is the background, every label points to its parent label
+        self.n = n + 1
+        self.parent = np.arange(self.n)
+        self.bbox = np.zeros((self.n, 4), dtype=np.int64)
+        self.dirty = np.zeros(self.n, dtype=bool)
+
+        for l, sl in enumerate(ndimage.find_objects(self.labels), 1):
+            self.bbox[l] = sl[0].start, sl[1].start, sl[0].stop, sl[1].stop
+
+    @property
+    def nbytes(self):
+        return self.labels.nbytes + self.parent.nbytes + self.bbox.nbytes + self.dirty.nbytes
+
+    def _allocate(self, count):
+        """New labels, the arrays grow by doubling"""
+        if self.n + count > len(self.parent):
+            size = max(2 * len(self.parent), self.n + count)
+            self.parent = np.resize(self.parent, size)
+            self.bbox = np.resize(self.bbox, (size, 4))
+            self.dirty = np.resize(self.dirty, size)
+
+        labels = np.arange(self.n, self.n + count)
+        self.parent[labels] = labels
+        self.dirty[labels] = False
+        self.n += count
+
+        return labels
+
+    def _find(self, l):
+        while self.parent[l] != l:
+            self.parent[l] = self.parent[self.parent[l]]
+            l = self.parent[l]
+
+        return l
+
+    def _union(self, a, b):
+        a, b = self._find(a), self._find(b)
+
+        if a == b:
+            return a
+
+        a, b = min(a, b), max(a, b)
+        self.parent[b] = a
+        self.bbox[a, :2] = np.minimum(self.bbox[a, :2], self.bbox[b, :2])
+        self.bbox[a, 2:] = np.maximum(self.bbox[a, 2:], self.bbox[b, 2:])
+        self.dirty[a] |= self.dirty[b]
+
+        return a
+
+    def _roots(self):
+        """Root label of every label, the paths are compressed completely"""
+        p = self.parent[:self.n]
+
+        while True:
+            q = p[p]
+
+            if np.array_equal(q, p):
+                break
+
+            p = q
+
+        self.parent[:self.n] = p
+        return p
+
+    def update(self, rr, cc, before, value):
+        """Updates the components from changed pixels, see `PipraImageView.setMaskPixels`
+
+        Args:
+            rr (numpy.ndarray): Row coordinates of painted pixels
+            cc (numpy.ndarray): Column coordinates of painted pixels
+            before (numpy.ndarray): Values of the pixels before painting
+            value (bool): New value of the pixels
+        """
+        changed = np.asarray(before) != value
+        rr, cc = np.asarray(rr)[changed], np.asarray(cc)[changed]
+
+        if rr.size == 0:
+            return
+
+        # Removed pixels may split their components
+        if not value:
+            self.dirty[self._roots()[np.unique(self.labels[rr, cc])]] = True
+            self.dirty[0] = False
+            self.labels[rr, cc] = 0
+            return
+
+        # Added pixels are labeled within a window, including their neighbours
+        i0, j0 = max(rr.min()-1, 0), max(cc.min()-1, 0)
+        i1, j1 = min(rr.max()+2, self.shape[0]), min(cc.max()+2, self.shape[1])
+        sub = self.labels[i0:i1, j0:j1]
+        roots = self._roots()[sub]
+
+        new = np.zeros(sub.shape, dtype=bool)
+        new[rr-i0, cc-j0] = True
+        local, k = ndimage.label(new | (sub != 0), STRUCTURE)
+
+        # Components of the window with added pixels merge all components they touch
+        touched = np.zeros(k+1, dtype=bool)
+        touched[local[new]] = True
+        existing = (roots != 0) & touched[local]
+        pairs = np.unique(np.stack([local[existing], roots[existing]]), axis=1)
+
+        target = np.zeros(k+1, dtype=np.int64)
+
+        for c, r in pairs.T:
+            target[c] = r if target[c] == 0 else self._union(target[c], r)
+
+        # Components of only added pixels get new labels
+        isolated = np.flatnonzero(touched & (target == 0))
+        target[isolated] = self._allocate(len(isolated))
+        self.bbox[target[isolated]] = [self.shape[0], self.shape[1], 0, 0]
+
+        target = self._roots()[target]
+        labels = target[local[rr-i0, cc-j0]]
+        self.labels[rr, cc] = labels
+
+        # Bounding boxes are extended by the added pixels
+        np.minimum.at(self.bbox[:, 0], labels, rr)
+        np.minimum.at(self.bbox[:, 1], labels, cc)
+        np.maximum.at(self.bbox[:, 2], labels, rr+1)
+        np.maximum.at(self.bbox[:, 3], labels, cc+1)
+
+    def _resolve(self, r):
+        """Relabels a component that may be split within its bounding box"""
+        y0, x0, y1, x1 = self.bbox[r]
+        sub = self.labels[y0:y1, x0:x1]
+        sel = self._roots()[sub] == r
+        local, k = ndimage.label(sel, STRUCTURE)
+        self.dirty[r] = False
+
+        # All pixels were removed, the bounding box is empty
+        if k == 0:
+            self.bbox[r] = 0
+            return
+
+        # The first part keeps the label
+        labels = np.r_[0, r, self._allocate(k-1)]
+        sub[sel] = labels[local[sel]]
+
+        for l, sl in zip(labels[1:], ndimage.find_objects(local)):
+            self.bbox[l] = y0 + sl[0].start, x0 + sl[1].start, y0 + sl[0].stop, x0 + sl[1].stop
+
+    def summary(self):
+        """Number of components and bounding box of all components, possibly split components are relabeled
+
+        Returns:
+            tuple: Number of components and bounding box (y0, x0, y1, x1), (-1, -1, -1, -1) if empty
+        """
+        for r in np.flatnonzero(self.dirty[:self.n]):
+            if self._find(r) == r:
+                self._resolve(r)
+
+        # Every root except the background and removed components has pixels
+        roots = np.flatnonzero(self._roots() == np.arange(self.n))[1:]
+        box = self.bbox[roots]
+        box = box[box[:, 2] > box[:, 0]]
+
+        if len(box) == 0:
+            return 0, (-1, -1, -1, -1)
+
+        return len(box), (*box[:, :2].min(axis=0), *box[:, 2:].max(axis=0))
+
+    def root(self, i, j):
+        """Label of the component at a position, resolving splits
+
+        Args:
+            i (int): Position along first image axis
+            j (int): Position along second image axis
+
+        Returns:
+            int: Component label, 0 for background
+        """
+        r = self._find(self.labels[i, j])
+
+        if self.dirty[r]:
+            self._resolve(r)
+            r = self._find(self.labels[i, j])
+
+        return r
+
+    def component(self, i, j):
+        """Pixels of the connected component at a position
+
+        Args:
+            i (int): Position along first image axis
+            j (int): Position along second image axis
+
+        Returns:
+            tuple: The px indices (rr, cc), empty for background
+        """
+        r = self.root(i, j)
+
+        if r == 0:
+            return np.array([], dtype=int), np.array([], dtype=int)
+
+        y0, x0, y1, x1 = self.bbox[r]
+        rr, cc = np.nonzero(self._roots()[self.labels[y0:y1, x0:x1]] == r)
+
+        return rr + y0, cc + x0
+
+    def others(self, i, j):
+        """Pixels of all components except the one at a position
+
+        Args:
+            i (int): Position along first image axis
+            j (int): Position along second image axis
+
+        Returns:
+            tuple: The px indices (rr, cc)
+        """
+        r = self.root(i, j)
+
+        return np.nonzero((self.labels != 0) & (self._roots()[self.labels] != r))
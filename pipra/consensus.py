@@ -0,0 +1,354 @@
+import numpy as np
+import flammkuchen as fl
+import tables
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .masks import load_masks, MaskVolume, RaggedMasks
+
+# Number of px of all annotators processed at once
+CHUNK_PX = 2**25
+
+# Available consensus methods
+METHODS = ('majority', 'staple')
+
+# STAPLE counts the voxels of every vote pattern, i.e. 2**n bins for n annotators
+MAX_STAPLE_ANNOTATORS = 20
+
+# Columns of the agreement table
+AGREEMENT_COLUMNS = ('frame', 'dice', 'iou')
+
+
+def mask_reader(fn):
+    """Reads frames of a `.mask` file on demand.
+
+    Args:
+        fn (str): Path to `.mask` file
+
+    Returns:
+        tuple: Mask shape (y, x) of every frame, a function returning frames `i0` to `i1` (exclusive)
+            as (z, y, x) array and whether the file contains masks of a folder.
+            Frames read at once must have the same shape.
+    """
+    with tables.open_file(fn, "r") as f:
+        stack = "/mask_shapes" not in f and isinstance(f.root.mask, tables.Array)
+        shape = f.root.mask.shape if stack else None
+
+    # Stacks are read as slices of the (z, x, y) dataset
+    if stack:
+        def read(i0, i1):
+            return fl.load(fn, "/mask", sel=fl.aslice[i0:i1]).transpose(0, 2, 1)
+
+        return [(shape[2], shape[1])] * shape[0], read, False
+
+    # Packed masks of folders are read lazily
+    masks = load_masks(fn)
+
+    def read(i0, i1):
+        return np.stack([masks[i] for i in range(i0, i1)])
+
+    return [tuple(int(s) for s in masks.shapes[i]) for i in range(len(masks))], read, True
+
+
+def majority(votes):
+    """Majority vote, pixels annotated by more than half of the annotators
+
+    Args:
+        votes (numpy.ndarray): Masks of all annotators as (n, ...) boolean array
+
+    Returns:
+        numpy.ndarray: Consensus mask
+    """
+    return 2 * np.count_nonzero(votes, axis=0) > len(votes)
+
+
+def vote_patterns(votes):
+    """Encodes the votes of every pixel as integer, bit `j` is the vote of annotator `j`
+
+    Args:
+        votes (numpy.ndarray): Masks of all annotators as (n, ...) boolean array
+
+    Returns:
+        numpy.ndarray: The vote patterns
+    """
+    patterns = np.zeros(votes.shape[1:], dtype=np.uint32)
+
+    for j, v in enumerate(votes):
+        patterns |= v.astype(np.uint32) << j
+
+    return patterns
+
+
+def staple(counts, n, max_iter=100, tol=1e-7):
+    """STAPLE (Warfield et al., 2004), estimates the sensitivity and specificity of every annotator,
+    the foreground prior and the probability of every pixel to be foreground by expectation maximization.
+
+    As votes are binary, the probability only depends on the vote pattern of a pixel,
+    such that the estimation runs on the number of pixels per vote pattern instead of on all pixels.
+
+    Args:
+        counts (numpy.ndarray): Number of pixels of every vote pattern, see `vote_patterns`
+        n (int): Number of annotators
+        max_iter (int, optional): Maximum number of iterations. Defaults to 100.
+        tol (float, optional): Stops when the parameters change less. Defaults to 1e-7.
+
+    Returns:
+        tuple: Foreground probability of every vote pattern, sensitivity and specificity of every annotator
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    d = (np.arange(len(counts))[:, None] >> np.arange(n)) & 1
+
+    # Starts with the mean vote as foreground prior
+    prior = np.clip((counts @ d).sum() / max(n * counts.sum(), 1), 1e-12, 1 - 1e-12)
+    p = np.full(n, 0.99)
+    q = np.full(n, 0.99)
+
+    for _ in range(max_iter):
+        # E-step in log space, many annotators would underflow the products
+        a = np.log(prior) + d @ np.log(p) + (1 - d) @ np.log(1 - p)
+        b = np.log(1 - prior) + (1 - d) @ np.log(q) + d @ np.log(1 - q)
+        w = 1 / (1 + np.exp(np.clip(b - a, -700, 700)))
+
+        # M-step
+        fg, bg = counts * w, counts * (1 - w)
+        p1 = np.clip(fg @ d / max(fg.sum(), 1e-12), 1e-6, 1 - 1e-6)
+        q1 = np.clip(bg @ (1 - d) / max(bg.sum(), 1e-12), 1e-6, 1 - 1e-6)
+        prior = np.clip(fg.sum() / max(counts.sum(), 1), 1e-12, 1 - 1e-12)
+
+        converged = max(np.abs(p1 - p).max(), np.abs(q1 - q).max()) < tol
+        p, q = p1, q1
+
+        if converged:
+            break
+
+    return w, p, q
+
+
+def agreement(votes):
+    """Mean pairwise Dice and IoU of the annotators per frame, frames empty for both annotators agree.
+
+    Args:
+        votes (numpy.ndarray): Masks of all annotators as (n, z, y, x) boolean array
+
+    Returns:
+        tuple: Dice and IoU of every frame
+    """
+    n, z = votes.shape[:2]
+
+    if n < 2:
+        return np.ones(z), np.ones(z)
+
+    # Intersections of all pairs of annotators per frame
+    v = votes.reshape(n, z, -1).transpose(1, 0, 2).astype(np.float32)
+    inter = np.matmul(v, v.transpose(0, 2, 1)).astype(np.float64)
+    area = np.diagonal(inter, axis1=1, axis2=2)
+
+    a, b = np.triu_indices(n, 1)
+    i = inter[:, a, b]
+    s = area[:, a] + area[:, b]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dice = np.where(s > 0, 2 * i / s, 1)
+        iou = np.where(s > 0, i / (s - i), 1)
+
+    return dice.mean(1), iou.mean(1)
+
+
+def _chunks(shapes, n):
+    """Ranges of consecutive frames of equal shape, with up to CHUNK_PX px of all annotators"""
+    chunks = []
+
+    for i, shape in enumerate(shapes):
+        if chunks:
+            i0, i1 = chunks[-1]
+
+            if shapes[i0] == shape and (i1 - i0 + 1) * n * shape[0] * shape[1] <= CHUNK_PX:
+                chunks[-1] = i0, i + 1
+                continue
+
+        chunks.append((i, i + 1))
+
+    return chunks
+
+
+def _stream(readers, chunks, run, collect, executor, progress):
+    """Reads chunks of all files in the calling thread, as HDF5 is not thread-safe, and processes them in the executor.
+    Results are passed to `collect` in order while reading, such that only a few chunks are kept in memory.
+
+    Returns:
+        bool: False if cancelled
+    """
+    pending = deque()
+    max_pending = 2 * getattr(executor, '_max_workers', 1)
+
+    def drain(limit):
+        while len(pending) > limit:
+            k, f = pending.popleft()
+            collect(k, f.result())
+
+    try:
+        for k, (i0, i1) in enumerate(chunks):
+            votes = np.stack([read(i0, i1) for read in readers]).astype(bool, copy=False)
+            pending.append((k, executor.submit(run, votes)))
+            drain(max_pending)
+
+            if progress is not None and progress(k+1, len(chunks)) is False:
+                return False
+
+        drain(0)
+        return True
+
+    finally:
+        # Chunks not started yet are dropped when cancelled or on errors
+        for _, f in pending:
+            f.cancel()
+
+
+def consensus(fns, method='majority', executor=None, progress=None):
+    """Consensus masks and per-frame agreement of several annotators of the same stack.
+
+    Frames of all files are read in chunks and processed in parallel, vectorized across annotators.
+    STAPLE reads the files twice, first to estimate the performance of every annotator
+    from the number of pixels of every vote pattern, then to label the pixels.
+
+    Args:
+        fns (list): Paths to `.mask` files with masks of the same shape
+        method (str, optional): One of METHODS. Defaults to 'majority'.
+        executor (concurrent.futures.Executor, optional): Processes the chunks, a thread pool is used if None. Defaults to None.
+        progress (callable, optional): Called with (done, total) chunks, cancels if it returns False. Defaults to None.
+
+    Returns:
+        tuple or None: Consensus masks (MaskVolume or RaggedMasks), agreement table (dict, see AGREEMENT_COLUMNS)
+            and the sensitivity and specificity of every annotator (None for majority vote). None if cancelled.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method {method}, use one of {METHODS}")
+
+    n = len(fns)
+
+    if method == 'staple' and n > MAX_STAPLE_ANNOTATORS:
+        raise ValueError(f"STAPLE supports up to {MAX_STAPLE_ANNOTATORS} annotators")
+
+    shapes, readers, ragged = zip(*(mask_reader(fn) for fn in fns))
+
+    if any(s != shapes[0] for s in shapes):
+        raise ValueError("All mask files must have the same number of frames and frame shapes")
+
+    shapes = shapes[0]
+    chunks = _chunks(shapes, n)
+
+    # Consensus masks are compressed as soon as a chunk is done
+    masks = RaggedMasks(shapes) if ragged[0] else MaskVolume((len(shapes), *shapes[0]))
+    dice, iou = np.ones(len(shapes)), np.ones(len(shapes))
+
+    def collect(k, result):
+        i0, i1 = chunks[k]
+        m, (dice[i0:i1], iou[i0:i1]) = result
+
+        for i in range(i0, i1):
+            masks[i] = m[i - i0]
+
+    own = executor is None
+
+    if own:
+        executor = ThreadPoolExecutor()
+
+    try:
+        performance = None
+        chunk_progress = progress
+
+        if method == 'staple':
+            counts = np.zeros(2**n, dtype=np.int64)
+
+            def count(k, c):
+                counts[:] += c
+
+            def count_progress(done, total):
+                return progress is None or progress(done, 2 * total)
+
+            if not _stream(readers, chunks, lambda v: np.bincount(vote_patterns(v).ravel(), minlength=2**n),
+                           count, executor, count_progress):
+                return None
+
+            w, p, q = staple(counts, n)
+            lut = w > 0.5
+            performance = {'sensitivity': p, 'specificity': q}
+
+            def run(votes):
+                return lut[vote_patterns(votes)], agreement(votes)
+
+            def chunk_progress(done, total):
+                return progress is None or progress(total + done, 2 * total)
+
+        else:
+            def run(votes):
+                return majority(votes), agreement(votes)
+
+        if not _stream(readers, chunks, run, collect, executor, chunk_progress):
+            return None
+
+    finally:
+        if own:
+            executor.shutdown(wait=False)
+
+    return masks, dict(zip(AGREEMENT_COLUMNS, (np.arange(len(shapes)), dice, iou))), performance
+
+
+def disagreement(table, threshold=0.8, metric='dice'):
+    """Frames with an agreement below `threshold`, e.g. for review
+
+    Args:
+        table (dict): Agreement table, see `consensus`
+        threshold (float, optional): Minimum agreement. Defaults to 0.8.
+        metric (str, optional): `dice` or `iou`. Defaults to 'dice'.
+
+    Returns:
+        numpy.ndarray: Frame indices
+    """
+    return table['frame'][table[metric] < threshold]
+
+
+def save_frames(fn, frames):
+    """Writes a list of frames, one index per line, see `load_frames`"""
+    np.savetxt(fn, np.asarray(frames, dtype=int), fmt='%d')
+
+
+def load_frames(fn):
+    """Reads a list of frames written by `save_frames`
+
+    Returns:
+        numpy.ndarray: Frame indices
+    """
+    return np.atleast_1d(np.loadtxt(fn, dtype=int, ndmin=1))
+
+
+if __name__ == '__main__':
+    import argparse
+    from .masks import save_masks
+    from .stats import export
+
+    parser = argparse.ArgumentParser(description="Consensus masks and per-frame agreement of several .mask files")
+    parser.add_argument("masks", nargs="+", help="Paths to .mask files of the same stack")
+    parser.add_argument("-o", "--output", required=True, help="Output .mask file with the consensus masks")
+    parser.add_argument("--method", choices=METHODS, default='majority', help="Consensus method, defaults to majority")
+    parser.add_argument("--agreement", help="Export the per-frame Dice and IoU as .csv or .parquet")
+    parser.add_argument("--review", help="Export frames with a Dice below --threshold, one per line")
+    parser.add_argument("--threshold", type=float, default=0.8, help="Minimum Dice of frames without review, defaults to 0.8")
+    args = parser.parse_args()
+
+    masks, table, performance = consensus(args.masks, args.method,
+                                          progress=lambda done, total: print(f"\r{done}/{total} chunks", end=""))
+    print()
+
+    save_masks(args.output, masks)
+
+    if args.agreement:
+        export(table, args.agreement)
+
+    if args.review:
+        save_frames(args.review, disagreement(table, args.threshold))
+
+    if performance is not None:
+        for fn, p, q in zip(args.masks, performance['sensitivity'], performance['specificity']):
+            print(f"{fn}: sensitivity {p:.3f}, specificity {q:.3f}")
+
+    print(f"Mean Dice {table['dice'].mean():.3f}, {len(disagreement(table, args.threshold))} frames below {args.threshold}")
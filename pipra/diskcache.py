@@ -0,0 +1,185 @@
+import numpy as np
+import hashlib
+import os
+import time
+
+# Default location and size of the decoded file cache
+CACHE_DIR = os.environ.get("PIPRA_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "pipra"))
+CACHE_BYTES = 10 * 2**30
+
+# Unfinished entries are left behind by interrupted writes, they are removed when not written for this long
+STALE_SECONDS = 60 * 60
+
+
+def file_key(fn, block=2**20):
+    """Cache key of a file from its path, identity, size, modification and change time and content.
+
+    The content hash uses the first, middle and last block of the file,
+    such that computing the key does not depend on the file size. Changes elsewhere in the file
+    are detected by the change time, which is updated by every write and cannot be set by other programs.
+
+    Args:
+        fn (str): Path to file
+        block (int, optional): Size of hashed content blocks in bytes. Defaults to 1 MB.
+
+    Returns:
+        str: The cache key
+    """
+    st = os.stat(fn)
+    h = hashlib.sha1()
+    h.update(os.path.abspath(fn).encode("utf-8"))
+    h.update(f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}:{st.st_ctime_ns}".encode("utf-8"))
+
+    with open(fn, "rb") as fp:
+        for offset in (0, st.st_size // 2, st.st_size - block):
+            fp.seek(max(offset, 0))
+            h.update(fp.read(block))
+
+    return h.hexdigest()
+
+
+class DiskCache:
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_BYTES):
+        """Cache for decoded image stacks as uncompressed `.npy` files,
+        that are memory-mapped when opening the same file again.
+        Least recently used entries are evicted when exceeding `max_bytes`.
+
+        Args:
+            directory (str, optional): Cache directory. Defaults to CACHE_DIR.
+            max_bytes (int, optional): Maximum cache size in bytes. Defaults to CACHE_BYTES.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        # Unfinished entries of previous sessions
+        self.evict()
+
+    def path(self, fn):
+        return os.path.join(self.directory, file_key(fn) + ".npy")
+
+    def load(self, fn):
+        """Memory-maps the decoded stack of a file, if cached.
+
+        Args:
+            fn (str): Path to source file
+
+        Returns:
+            numpy.memmap or None: The read-only stack, None if not cached
+        """
+        p = self.path(fn)
+
+        if not os.path.isfile(p):
+            return None
+
+        try:
+            s = np.load(p, mmap_mode="r")
+
+        except Exception as e:
+            print(f"Could not load cached stack: \n{e}")
+            return None
+
+        # Mark as recently used
+        os.utime(p)
+        return s
+
+    def create(self, fn, shape, dtype):
+        """Creates a writable, memory-mapped cache entry that is filled by the caller,
+        e.g. while decoding a file frame by frame. Call `commit` when done.
+
+        Args:
+            fn (str): Path to source file
+            shape (tuple): Shape of the decoded stack
+            dtype (numpy.dtype): Data type of the decoded stack
+
+        Returns:
+            numpy.memmap: The writable stack
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.evict(int(np.prod(shape)) * np.dtype(dtype).itemsize)
+
+        return np.lib.format.open_memmap(self.path(fn) + ".tmp", mode="w+", dtype=dtype, shape=shape)
+
+    def commit(self, fn, s):
+        """Finishes a cache entry created with `create`.
+
+        Args:
+            fn (str): Path to source file
+            s (numpy.memmap): The filled stack
+
+        Returns:
+            numpy.memmap: The read-only stack
+        """
+        s.flush()
+        del s
+
+        p = self.path(fn)
+        os.replace(p + ".tmp", p)
+
+        return np.load(p, mmap_mode="r")
+
+    def store(self, fn, s):
+        """Writes a decoded stack to the cache.
+
+        Args:
+            fn (str): Path to source file
+            s (numpy.ndarray): The decoded stack
+
+        Returns:
+            numpy.memmap: The read-only, memory-mapped stack
+        """
+        m = self.create(fn, s.shape, s.dtype)
+        m[:] = s
+
+        return self.commit(fn, m)
+
+    def evict(self, nbytes=0):
+        """Removes unfinished entries that are no longer written, see `STALE_SECONDS`,
+        and least recently used entries until `nbytes` additional bytes fit into the cache.
+        Unfinished entries that are still written count towards the cache size.
+
+        Args:
+            nbytes (int, optional): Bytes that are about to be added. Defaults to 0.
+        """
+        if not os.path.isdir(self.directory):
+            return
+
+        def remove(p):
+            try:
+                os.remove(p)
+                return True
+
+            # File may be memory-mapped (e.g. on Windows), keep it
+            except OSError:
+                return False
+
+        entries, total = [], nbytes
+        stale = time.time() - STALE_SECONDS
+
+        for f in os.listdir(self.directory):
+            p = os.path.join(self.directory, f)
+
+            try:
+                st = os.stat(p)
+
+            # Removed by another process
+            except OSError:
+                continue
+
+            if f.endswith(".npy.tmp"):
+                if st.st_mtime < stale and remove(p):
+                    continue
+
+            elif f.endswith(".npy"):
+                entries.append((st.st_mtime, st.st_size, p))
+
+            else:
+                continue
+
+            total += st.st_size
+
+        for _, size, p in sorted(entries):
+            if total <= self.max_bytes:
+                break
+
+            if remove(p):
+                total -= size
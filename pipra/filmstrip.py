@@ -0,0 +1,105 @@
+from PyQt5.QtWidgets import QListView, QAbstractItemView
+from PyQt5.QtGui import QImage, QPixmap, QColor
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QSize
+import numpy as np
+from .thumbnails import THUMBNAIL_SIZE
+
+
+def toQImage(im, levels):
+    """Converts an image to an 8 bit QImage using the given levels
+
+    Args:
+        im (numpy.ndarray): 2D image, optionally RGB(A)
+        levels (tuple): (min, max) levels
+
+    Returns:
+        QImage: The image
+    """
+    lo, hi = np.ravel(levels)[0], np.ravel(levels)[-1]
+    im = np.clip((im.astype(np.float32) - lo) * (255 / max(hi - lo, 1e-12)), 0, 255).astype(np.uint8)
+
+    if im.ndim == 2:
+        im = np.ascontiguousarray(im)
+        fmt = QImage.Format_Grayscale8
+
+    else:
+        im = np.ascontiguousarray(im[..., :3])
+        fmt = QImage.Format_RGB888
+
+    return QImage(im.data, im.shape[1], im.shape[0], im.strides[0], fmt).copy()
+
+
+class FilmstripModel(QAbstractListModel):
+    def __init__(self, thumbnails, occupancy, levels, keyframes=(), parent=None):
+        """List model providing a thumbnail and an annotated/empty mark per frame
+
+        Args:
+            thumbnails (ThumbnailCache): The thumbnail cache of the stack
+            occupancy (numpy.ndarray): Boolean array, True if a frame's mask is not empty
+            levels (callable): Returns the current (min, max) levels
+            keyframes (set, optional): Indices of keyframes, marked in the strip. Defaults to ().
+            parent (QObject, optional): Parent object. Defaults to None.
+        """
+        super().__init__(parent)
+        self.thumbnails = thumbnails
+        self.occupancy = occupancy
+        self.levels = levels
+        self.keyframes = keyframes
+        self.colorAnnotated = QColor(20, 240, 92)
+
+    def rowCount(self, parent=QModelIndex()):
+        return len(self.occupancy)
+
+    def data(self, index, role=Qt.DisplayRole):
+        i = index.row()
+
+        if role == Qt.DisplayRole:
+            return f"{i} (key)" if i in self.keyframes else str(i)
+
+        elif role == Qt.DecorationRole:
+            # Only visible frames are requested, thumbnails are computed in background
+            t = self.thumbnails.get(i)
+
+            if t is not None:
+                return QPixmap.fromImage(toQImage(t[0], self.levels()))
+
+        elif role == Qt.BackgroundRole:
+            if self.occupancy[i]:
+                return self.colorAnnotated
+
+        elif role == Qt.ToolTipRole:
+            return f"Frame {i}: " + ("annotated" if self.occupancy[i] else "empty") + \
+                (", keyframe" if i in self.keyframes else "")
+
+    def updateFrame(self, i):
+        """Repaints frame `i`, e.g. if its thumbnail or mask changed"""
+        self.dataChanged.emit(self.index(i), self.index(i))
+
+
+class Filmstrip(QListView):
+    def __init__(self, model, size=THUMBNAIL_SIZE, parent=None):
+        """Horizontal overview strip with thumbnails of all frames.
+        Only the visible thumbnails are drawn.
+
+        Args:
+            model (FilmstripModel): The filmstrip model
+            size (int, optional): Thumbnail size. Defaults to THUMBNAIL_SIZE.
+            parent (QWidget, optional): Parent widget. Defaults to None.
+        """
+        super().__init__(parent)
+        self.setModel(model)
+        self.setViewMode(QListView.IconMode)
+        self.setFlow(QListView.LeftToRight)
+        self.setWrapping(False)
+        self.setUniformItemSizes(True)
+        self.setMovement(QListView.Static)
+        self.setIconSize(QSize(size, size))
+        self.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOn)
+        self.setFixedHeight(size + 50)
+
+    def setCurrentFrame(self, i):
+        """Selects frame `i` and scrolls to it"""
+        index = self.model().index(i)
+        self.setCurrentIndex(index)
+        self.scrollTo(index, QAbstractItemView.PositionAtCenter)
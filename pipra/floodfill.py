@@ -1,9 +1,15 @@
 from numba import njit
+from concurrent.futures import ThreadPoolExecutor, wait
 import numpy as np
+import threading
 import time
+from .masks import EncodedMasks
 
+# Luminance weights of RGB channels, as in skimage.color.rgb2gray
+RGB_WEIGHTS = np.array([0.2125, 0.7154, 0.0721])
 
-@njit
+
+@njit(nogil=True)
 def _neighbours_4d(x, y, h, w):
     '''
     Find neighbours of given pixel with border detection
@@ -16,63 +22,132 @@ def _neighbours_4d(x, y, h, w):
     r = []
     if x-1 >= 0:
         r.append((x-1, y))
-    if y+1 < w-1:
+    if y+1 < w:
         r.append((x, y+1))
-    if x+1 < h-1:
+    if x+1 < h:
         r.append((x+1, y))
     if y-1 >= 0:
         r.append((x, y-1))
     yield r
 
-@njit
-def _floodfill(im, seed, tolerance=5, only_darker_px=True):
+
+@njit(nogil=True)
+def _intensity(im, x, y, weights):
+    '''
+    Weighted intensity of a pixel across channels, computed on the fly
+    :param im: 3D image (h, w, channels) of any numeric dtype
+    :param x: x
+    :param y: y
+    :param weights: channel weights
+    :return: intensity as float
     '''
-    Floodfill algorithm that uses both, absolute gray threshold and edge
-    :param im: 2D image to be segmented
-    :param edge: 2D image with pronounced edges, e.g. sobel
+    v = 0.
+    for c in range(weights.shape[0]):
+        v += weights[c] * im[x, y, c]
+    return v
+
+
+@njit(nogil=True)
+def _floodfill(im, weights, seed, tolerance=5., only_darker_px=True):
+    '''
+    Floodfill algorithm using an intensity threshold relative to the seed,
+    compiled once per image dtype (e.g. uint8, uint16, float32)
+    :param im: 3D image (h, w, channels) to be segmented, gray images have a single channel
+    :param weights: channel weights to compute the intensity of a pixel
     :param seed: First starting point for flood filling
-    :param edge_thres: Edge threshold
-    :param gray_thres_factor: Gray threshold factor (factor times seed gray value)
+    :param tolerance: Intensity tolerance in image units
     :param only_darker_px: Floodfill only intensities lower than seed+tolerance
     :return: Segmented image with -1 for not segmented, 0 contour, 1 fill
     '''
     p = [seed]
-    h, w = im.shape
-    segmented = np.zeros_like(im, dtype=np.int8) - 1
-    gray_thres = im[seed]+tolerance
-    seed_intensity = im[seed]
+    h, w = im.shape[0], im.shape[1]
+    segmented = np.zeros((h, w), dtype=np.int8) - 1
+    seed_intensity = _intensity(im, seed[0], seed[1], weights)
+    gray_thres = seed_intensity + tolerance
 
     while len(p):
         pi = p.pop()
 
         if segmented[pi] < 0:
-            
-            if only_darker_px and im[pi] <= gray_thres:
+            v = _intensity(im, pi[0], pi[1], weights)
+
+            if only_darker_px and v <= gray_thres:
                 segmented[pi] = 1
 
                 for i in _neighbours_4d(pi[0], pi[1], h, w):
                     p.extend(i)
 
-            elif not only_darker_px and abs(im[pi]-seed_intensity) <= gray_thres:
+            elif not only_darker_px and abs(v-seed_intensity) <= tolerance:
                 segmented[pi] = 1
 
                 for i in _neighbours_4d(pi[0], pi[1], h, w):
                     p.extend(i)
-            
+
             else:
                 segmented[pi] = 0
 
     return segmented
 
-def floodfill(im, seed, time_it=False, tolerance=5, only_darker_px=True):
-    """Floodfill with four neighbours, speed-enhanced using numba.
+
+@njit(nogil=True)
+def _threshold(im, weights, seed, tolerance=5., only_darker_px=True):
+    '''
+    Threshold relative to the seed intensity, without connectivity
+    :param im: 3D image (h, w, channels), gray images have a single channel
+    :param weights: channel weights to compute the intensity of a pixel
+    :param seed: Pixel providing the reference intensity
+    :param tolerance: Intensity tolerance in image units
+    :param only_darker_px: Threshold intensities lower than seed+tolerance
+    :return: Segmented image with 0 for not segmented, 1 fill
+    '''
+    h, w = im.shape[0], im.shape[1]
+    segmented = np.zeros((h, w), dtype=np.int8)
+    seed_intensity = _intensity(im, seed[0], seed[1], weights)
+
+    for x in range(h):
+        for y in range(w):
+            v = _intensity(im, x, y, weights)
+
+            if (only_darker_px and v <= seed_intensity + tolerance) or \
+                    (not only_darker_px and abs(v-seed_intensity) <= tolerance):
+                segmented[x, y] = 1
+
+    return segmented
+
+
+def tolerance_scale(im, levels=None):
+    """Image intensity units per 8 bit grayscale step of the displayed image,
+    such that the same tolerance works for any image dtype and bit depth, e.g. 12 bit data stored as uint16.
 
     Args:
         im (numpy.ndarray): The input image
+        levels (tuple, optional): (min, max) display levels, the image's range if None. Defaults to None.
+
+    Returns:
+        float: Scale factor, 1 for uint8 images
+    """
+    if im.dtype == np.uint8:
+        return 1.
+
+    if levels is None:
+        levels = np.nanmin(im), np.nanmax(im)
+
+    return max(float(levels[1]) - float(levels[0]), 1e-12) / 255
+
+
+def floodfill(im, seed, time_it=False, tolerance=5, only_darker_px=True, levels=None, connected=True):
+    """Floodfill with four neighbours, speed-enhanced using numba.
+    The image is used in its native dtype, intensities of RGB(A) images are computed per visited pixel.
+
+    Args:
+        im (numpy.ndarray): The input image, gray or RGB(A)
         seed (tuple): The (y,x) coordinates of the seeding pixel
         time_it (bool, optional): Times the floodfill procedure. Defaults to False.
-        tolerance (int, optional): Intensity tolerance to seed intensity. Defaults to 5.
+        tolerance (float, optional): Intensity tolerance to seed intensity in 8 bit grayscale steps,
+            see `tolerance_scale`. Defaults to 5.
         only_darker_px (bool, optional): Floodfill for intensities [0, seed intensity + tolerance]. Defaults to True.
+        levels (tuple, optional): (min, max) display levels to scale the tolerance, see `tolerance_scale`. Defaults to None.
+        connected (bool, optional): Only pixels connected to the seed, otherwise a threshold. Defaults to True.
 
     Returns:
         numpy.ndarray: The floodfilled mask
@@ -80,9 +155,122 @@ def floodfill(im, seed, time_it=False, tolerance=5, only_darker_px=True):
     if time_it:
         t0 = time.time()
 
-    f = _floodfill(im, seed, tolerance=tolerance, only_darker_px=only_darker_px)
+    if im.ndim == 2:
+        im = im[..., None]
+        weights = np.ones(1)
+
+    else:
+        weights = RGB_WEIGHTS
+
+    # numba only supports native byte order, e.g. for big endian NRRD files
+    if not im.dtype.isnative:
+        im = im.astype(im.dtype.newbyteorder('='))
+
+    tolerance = float(tolerance) * tolerance_scale(im, levels)
+
+    f = (_floodfill if connected else _threshold)(im, weights, (int(seed[0]), int(seed[1])),
+                                                  tolerance=tolerance, only_darker_px=only_darker_px)
 
     if time_it:
         print("Flood fill took {:.2f} s".format(time.time()-t0))
 
     return f
+
+
+def centroid_seed(region):
+    """Pixel of a region closest to its centroid, e.g. to follow a moving object.
+
+    Args:
+        region (numpy.ndarray): 2D boolean mask, not empty
+
+    Returns:
+        tuple: The (y,x) coordinates of the pixel
+    """
+    rr, cc = np.nonzero(region)
+    k = np.argmin((rr - rr.mean())**2 + (cc - cc.mean())**2)
+    return int(rr[k]), int(cc[k])
+
+
+def floodfill_frames(stack, frames, seed, seed_frame=None, recenter=False, executor=None, progress=None, **kwargs):
+    """Floodfill with the same seed and settings in a range of frames, in parallel.
+
+    If the seed is re-centered, the frames are filled sequentially starting at the seed frame,
+    forward and backward in parallel, using the centroid of the previous frame's region as seed.
+
+    Args:
+        stack (numpy.ndarray or list): The image stack
+        frames (iterable): Indices of frames to fill
+        seed (tuple): The (y,x) coordinates of the seeding pixel
+        seed_frame (int, optional): Frame of the seed, used when re-centering. Defaults to the first frame.
+        recenter (bool, optional): Re-center the seed on the previous frame's region. Defaults to False.
+        executor (concurrent.futures.Executor, optional): Runs the fills, a thread pool is used if None. Defaults to None.
+        progress (callable, optional): Called with (done, total) frames, cancels if it returns False. Defaults to None.
+        **kwargs: Passed to `floodfill`, e.g. tolerance, only_darker_px, levels and connected
+
+    Returns:
+        EncodedMasks or None: Filled regions by frame index, None if cancelled
+    """
+    frames = sorted(set(int(i) for i in frames))
+    seed_frame = frames[0] if seed_frame is None else min(max(seed_frame, frames[0]), frames[-1])
+    cancel = threading.Event()
+    result = EncodedMasks()
+
+    def fill(i, s):
+        h, w = stack[i].shape[:2]
+        s = min(max(s[0], 0), h-1), min(max(s[1], 0), w-1)
+        region = floodfill(stack[i], s, **kwargs) == 1
+        result[i] = region
+        return region
+
+    def chain(ids):
+        s = seed
+
+        for i in ids:
+            if cancel.is_set():
+                return
+
+            region = fill(i, s)
+
+            if region.any():
+                s = centroid_seed(region)
+
+    if recenter:
+        chains = [[i for i in frames if i >= seed_frame], [i for i in frames[::-1] if i < seed_frame]]
+        tasks = [(chain, ids) for ids in chains if ids]
+
+    else:
+        tasks = [(fill, i, seed) for i in frames]
+
+    own = executor is None
+
+    if own:
+        executor = ThreadPoolExecutor()
+
+    futures = []
+
+    try:
+        futures = [executor.submit(*t) for t in tasks]
+
+        while True:
+            done, pending = wait(futures, timeout=0.1)
+
+            for f in done:
+                f.result()
+
+            if progress is not None and progress(len(result), len(frames)) is False:
+                return None
+
+            if not pending:
+                break
+
+    finally:
+        # Frames not started yet are dropped and running chains stop when cancelled or on errors
+        cancel.set()
+
+        for f in futures:
+            f.cancel()
+
+        if own:
+            executor.shutdown(wait=False)
+
+    return result
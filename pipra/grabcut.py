@@ -1,13 +1,36 @@
 import numpy as np
 import cv2 
 
-def GrabCut(im, r, iterations=1):
+def to_uint8(im, levels=None):
+    """Scales an image to uint8 using the given levels
+
+    Args:
+        im (numpy.ndarray): The image data, e.g. uint16 or float
+        levels (tuple, optional): (min, max) levels, defaults to the image's range. Defaults to None.
+
+    Returns:
+        numpy.ndarray: The uint8 image
+    """
+    if im.dtype == np.uint8:
+        return im
+
+    if levels is None:
+        levels = np.nanmin(im), np.nanmax(im)
+
+    lo, hi = float(levels[0]), float(levels[1])
+    im = (im.astype(np.float32) - lo) * (255 / max(hi - lo, 1e-12))
+
+    return np.clip(np.nan_to_num(im), 0, 255).astype(np.uint8)
+
+
+def GrabCut(im, r, iterations=1, levels=None):
     """GrabCut Algorithm for fast foreground annotation
 
     Args:
         im (numpy.ndarray): The image data that should be analyzed
         r (tuple): The rectangle coordinates of foreground (x0, y0, x1, y1)
         iterations (int, optional): GrabCut iterations. Defaults to 1.
+        levels (tuple, optional): (min, max) levels to scale non-uint8 images to uint8. Defaults to None.
 
     Returns:
         numpy.ndarray: The estimated foreground mask from GrabCut
@@ -21,10 +44,12 @@ def GrabCut(im, r, iterations=1):
     fgModel = np.zeros((1, 65), dtype=np.float64)
     bgModel = np.zeros((1, 65), dtype=np.float64)   
 
+    im = to_uint8(im, levels)
+
     if len(im.shape) == 2:
         im = cv2.cvtColor(im.copy(), cv2.COLOR_GRAY2BGR)
 
-    mask, _, _ = cv2.grabCut(im.astype(np.uint8).copy(), # Original image
+    mask, _, _ = cv2.grabCut(np.ascontiguousarray(im[..., :3]), # Original image
         mask, # Mask
         r,  # Rectangle from pipra
         bgModel, # Internal background model vector
@@ -36,4 +61,37 @@ def GrabCut(im, r, iterations=1):
     finalMask = (mask == cv2.GC_BGD) | (mask == cv2.GC_PR_BGD)
 
     # Return inverted to provide foreground
-    return ~finalMask
\ No newline at end of file
+    return ~finalMask
+
+def GrabCutMask(im, mask, iterations=1, levels=None):
+    """GrabCut Algorithm initialized with a mask, e.g. to refine a coarse segmentation
+
+    Args:
+        im (numpy.ndarray): The image data that should be analyzed
+        mask (numpy.ndarray): Initial labels of the pixels (cv2.GC_BGD, cv2.GC_FGD, cv2.GC_PR_BGD or cv2.GC_PR_FGD)
+        iterations (int, optional): GrabCut iterations. Defaults to 1.
+        levels (tuple, optional): (min, max) levels to scale non-uint8 images to uint8. Defaults to None.
+
+    Returns:
+        numpy.ndarray: The estimated foreground mask from GrabCut
+    """
+    mask = mask.copy()
+
+    fgModel = np.zeros((1, 65), dtype=np.float64)
+    bgModel = np.zeros((1, 65), dtype=np.float64)
+
+    im = to_uint8(im, levels)
+
+    if len(im.shape) == 2:
+        im = cv2.cvtColor(im.copy(), cv2.COLOR_GRAY2BGR)
+
+    # Without foreground or background samples, GrabCut cannot estimate its models
+    if not ((mask == cv2.GC_FGD) | (mask == cv2.GC_PR_FGD)).any() or \
+            not ((mask == cv2.GC_BGD) | (mask == cv2.GC_PR_BGD)).any():
+        return (mask == cv2.GC_FGD) | (mask == cv2.GC_PR_FGD)
+
+    mask, _, _ = cv2.grabCut(np.ascontiguousarray(im[..., :3]), mask, None, bgModel, fgModel,
+        iterCount=iterations,
+        mode=cv2.GC_INIT_WITH_MASK)
+
+    return (mask == cv2.GC_FGD) | (mask == cv2.GC_PR_FGD)
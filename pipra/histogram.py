@@ -0,0 +1,79 @@
+import numpy as np
+from .background import BackgroundCache
+
+# Number of px used to estimate a histogram
+HISTOGRAM_PX = 2**16
+
+
+def subsample(im, max_px=HISTOGRAM_PX):
+    """Strided view on an image with roughly `max_px` pixels, no data is copied.
+
+    Args:
+        im (numpy.ndarray): 2D image, optionally with channels
+        max_px (int, optional): Number of px. Defaults to HISTOGRAM_PX.
+
+    Returns:
+        numpy.ndarray: The subsampled image
+    """
+    step = max(int(np.ceil(np.sqrt(im.shape[0] * im.shape[1] / max_px))), 1)
+    return im[::step, ::step]
+
+
+def histogram(im, bins=256, max_px=HISTOGRAM_PX):
+    """Intensity histogram from subsampled pixels, all channels combined.
+
+    Args:
+        im (numpy.ndarray): 2D image, optionally with channels
+        bins (int, optional): Number of bins for non-uint8 images. Defaults to 256.
+        max_px (int, optional): Number of px used for the estimate. Defaults to HISTOGRAM_PX.
+
+    Returns:
+        tuple: Bin positions and counts, as used by pyqtgraph's histogram
+    """
+    px = np.asarray(subsample(im, max_px)).ravel()
+
+    if px.dtype == np.uint8:
+        return np.arange(256), np.bincount(px, minlength=256)
+
+    px = px[np.isfinite(px)]
+
+    if px.size == 0:
+        return np.zeros(1), np.zeros(1)
+
+    counts, edges = np.histogram(px, bins=bins)
+    return edges[:-1], counts
+
+
+def stack_levels(stack, percentiles=(0.5, 99.5), frames=64, max_px=HISTOGRAM_PX):
+    """Estimates levels for the whole stack from percentiles of subsampled frames.
+
+    Args:
+        stack (numpy.ndarray or list): The image stack
+        percentiles (tuple, optional): Lower and upper percentile. Defaults to (0.5, 99.5).
+        frames (int, optional): Maximum number of frames used for the estimate. Defaults to 64.
+        max_px (int, optional): Number of px used per frame. Defaults to HISTOGRAM_PX.
+
+    Returns:
+        tuple: (min, max) levels
+    """
+    ids = np.unique(np.linspace(0, len(stack)-1, min(frames, len(stack))).astype(int))
+    px = np.concatenate([np.asarray(subsample(stack[i], max_px), dtype=np.float32).ravel() for i in ids])
+    lo, hi = np.nanpercentile(px, percentiles)
+
+    return float(lo), float(hi)
+
+
+class HistogramCache(BackgroundCache):
+    """Computes per-frame histograms once in a background thread and caches them,
+    see `BackgroundCache`.
+    """
+    def compute(self, im):
+        return histogram(im)
+
+    def levels(self, percentiles=(0.5, 99.5)):
+        """Stack-wide levels computed in the background, see `stack_levels`.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the (min, max) levels
+        """
+        return self.submit(stack_levels, self.stack, percentiles)
@@ -0,0 +1,126 @@
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from scipy.ndimage import distance_transform_edt
+from .masks import EncodedMasks
+
+# Number of interpolated px computed at once
+CHUNK_PX = 2**24
+
+
+def signed_distance(mask):
+    """Signed distance transform, positive inside and negative outside of the mask.
+
+    Args:
+        mask (numpy.ndarray): 2D boolean mask, not empty
+
+    Returns:
+        numpy.ndarray: The signed distance in px as float32
+    """
+    mask = np.asarray(mask, dtype=bool)
+    inside = distance_transform_edt(mask)
+    outside = distance_transform_edt(~mask) if not mask.all() else np.zeros(mask.shape)
+
+    return (inside - outside).astype(np.float32)
+
+
+def _blend(d0, d1, t):
+    return (d0 + t[:, None, None] * (d1 - d0)) > 0
+
+
+def interpolate(m0, m1, n, executor=None, chunk_px=CHUNK_PX):
+    """Interpolates the shape between two masks by blending their signed distance transforms.
+
+    Frames are computed vectorized in chunks of `chunk_px`, long gaps are computed in parallel.
+    Only a few chunks are kept at once, such that long gaps are never allocated as a whole.
+
+    Args:
+        m0 (numpy.ndarray): 2D mask of the first keyframe
+        m1 (numpy.ndarray): 2D mask of the second keyframe
+        n (int): Number of frames between the keyframes
+        executor (concurrent.futures.Executor, optional): Computes the chunks,
+            a thread pool is used if None. Defaults to None.
+        chunk_px (int, optional): Number of px per chunk. Defaults to CHUNK_PX.
+
+    Yields:
+        numpy.ndarray: The n interpolated 2D masks in order
+    """
+    e0, e1 = not m0.any(), not m1.any()
+
+    if n == 0:
+        return
+
+    if e0 and e1:
+        for _ in range(n):
+            yield np.zeros(m0.shape, dtype=bool)
+
+        return
+
+    d0 = signed_distance(m0) if not e0 else None
+    d1 = signed_distance(m1) if not e1 else None
+
+    # Empty keyframes shrink the shape of the other keyframe to nothing
+    if e0:
+        d0 = d1 - d1.max() - 1
+
+    if e1:
+        d1 = d0 - d0.max() - 1
+
+    t = np.arange(1, n+1, dtype=np.float32) / (n+1)
+    step = max(chunk_px // max(m0.size, 1), 1)
+
+    if n <= step:
+        yield from _blend(d0, d1, t)
+        return
+
+    own = executor is None
+
+    if own:
+        executor = ThreadPoolExecutor()
+
+    pending = deque()
+    max_pending = 2 * getattr(executor, '_max_workers', 1)
+
+    try:
+        for i in range(0, n, step):
+            pending.append(executor.submit(_blend, d0, d1, t[i:i+step]))
+
+            while len(pending) > max_pending:
+                yield from pending.popleft().result()
+
+        while pending:
+            yield from pending.popleft().result()
+
+    finally:
+        # Chunks not started yet are dropped if the frames are not needed anymore
+        for f in pending:
+            f.cancel()
+
+        if own:
+            executor.shutdown(wait=False)
+
+
+def interpolate_keyframes(masks, keyframes, executor=None):
+    """Interpolates the masks of all frames between consecutive keyframes.
+
+    Args:
+        masks (MaskVolume, RaggedMasks or numpy.ndarray): The masks of the stack
+        keyframes (iterable): Indices of keyframes
+        executor (concurrent.futures.Executor, optional): Computes chunks of long gaps. Defaults to None.
+
+    Returns:
+        EncodedMasks: Interpolated masks by frame index, gaps between differently sized frames are skipped
+    """
+    keyframes = sorted(set(int(k) for k in keyframes))
+    result = EncodedMasks()
+
+    for k0, k1 in zip(keyframes[:-1], keyframes[1:]):
+        m0, m1 = masks[k0], masks[k1]
+
+        if k1 - k0 < 2 or m0.shape != m1.shape:
+            continue
+
+        for i, m in enumerate(interpolate(m0, m1, k1-k0-1, executor), k0+1):
+            result[i] = m
+
+    return result
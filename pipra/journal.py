@@ -0,0 +1,328 @@
+import os
+import struct
+import threading
+import zlib
+import numpy as np
+from .masks import encode, decode, MaskVolume
+
+# Start of every journal, followed by the snapshot it applies to, see `snapshot_id`
+MAGIC = b"PIPRAJNL"
+HEADER = struct.Struct("<8sqq")
+
+# Every record is its kind, frame and payload size, the payload and a checksum
+RECORD = struct.Struct("<BII")
+CHECKSUM = struct.Struct("<I")
+
+# Record kinds: pixels of a frame set to a value, or a whole frame replaced
+DELTA, SET = 1, 2
+
+# Encodings of replaced frames, see `pipra.masks.encode`
+KINDS = (None, 'bits', 'runs')
+
+# The journal is compacted into the `.mask` file when it grows larger
+COMPACT_BYTES = 64 * 2**20
+
+# Decoded frames kept while replaying strokes, before they are compressed again
+REPLAY_FRAMES = 64
+
+
+def snapshot_id(fn):
+    """Identifies a `.mask` file by its modification time and size, (0, 0) if it does not exist"""
+    if fn is None:
+        return 0, 0
+
+    try:
+        s = os.stat(fn)
+        return s.st_mtime_ns, s.st_size
+
+    except OSError:
+        return 0, 0
+
+
+def runs(idx):
+    """Start and end (exclusive) of runs of consecutive sorted flat indices, e.g. of a brush stroke"""
+    breaks = np.flatnonzero(np.diff(idx) != 1) + 1
+    starts = idx[np.r_[0, breaks]]
+    ends = idx[np.r_[breaks - 1, len(idx) - 1]] + 1
+
+    return np.stack([starts, ends], axis=1).astype(np.uint32).ravel()
+
+
+def expand(r):
+    """Flat indices of runs written by `runs`"""
+    r = r.reshape(-1, 2).astype(np.int64)
+    lengths = r[:, 1] - r[:, 0]
+
+    return np.repeat(r[:, 0] - np.r_[0, np.cumsum(lengths)[:-1]], lengths) + np.arange(lengths.sum())
+
+
+def _complete(fp):
+    """Reads the complete records of an open journal, see `records`
+
+    Yields:
+        tuple: Kind, frame, payload and the offset after the record
+    """
+    fp.seek(HEADER.size)
+
+    while True:
+        head = fp.read(RECORD.size)
+
+        if len(head) < RECORD.size:
+            if head:
+                print(f"Journal {fp.name} ends with an incomplete record, it is ignored")
+
+            return
+
+        kind, i, n = RECORD.unpack(head)
+        payload = fp.read(n)
+        check = fp.read(CHECKSUM.size)
+
+        if len(payload) < n or len(check) < CHECKSUM.size or \
+                CHECKSUM.unpack(check)[0] != zlib.crc32(head + payload):
+            print(f"Journal {fp.name} ends with an incomplete record, it is ignored")
+            return
+
+        yield kind, i, payload, fp.tell()
+
+
+def records(fn):
+    """Reads the records of a journal, up to the first incomplete or damaged record, e.g. after a crash
+
+    Args:
+        fn (str): Path to journal
+
+    Yields:
+        tuple: `(DELTA, frame, idx, value)` or `(SET, frame, code, shape)`
+    """
+    with open(fn, "rb") as fp:
+        for kind, i, payload, _ in _complete(fp):
+            if kind == DELTA:
+                yield DELTA, i, expand(np.frombuffer(payload, dtype=np.uint32, offset=1)), bool(payload[0])
+
+            elif kind == SET:
+                h, w, k = struct.unpack_from("<IIB", payload)
+                data = np.frombuffer(payload, dtype=np.uint8, offset=9)
+                code = None if KINDS[k] is None else (KINDS[k], data if KINDS[k] == 'bits' else data.view(np.uint32))
+
+                yield SET, i, code, (h, w)
+
+
+def replay(fn, masks, snapshot=None):
+    """Applies the edits of a journal to the masks of its snapshot
+
+    Args:
+        fn (str): Path to journal
+        masks (MaskVolume or RaggedMasks): Masks read from the snapshot, changed in place
+        snapshot (str, optional): The `.mask` file the masks were read from. Defaults to None.
+
+    Returns:
+        int or None: Number of replayed records, None if there is no journal of this snapshot
+    """
+    if not os.path.isfile(fn):
+        return None
+
+    with open(fn, "rb") as fp:
+        header = fp.read(HEADER.size)
+
+    if len(header) < HEADER.size or HEADER.unpack(header) != (MAGIC, *snapshot_id(snapshot)):
+        return None
+
+    # Strokes are applied to decoded frames, compressed again when too many frames are decoded
+    frames = {}
+    count = 0
+
+    def store():
+        for i, m in frames.items():
+            masks[i] = m
+
+        frames.clear()
+
+    for record in records(fn):
+        if record[0] == DELTA:
+            _, i, idx, value = record
+
+            if i not in frames:
+                if len(frames) >= REPLAY_FRAMES:
+                    store()
+
+                frames[i] = np.array(masks[i])
+
+            frames[i].flat[idx] = value
+
+        else:
+            _, i, code, shape = record
+            frames.pop(i, None)
+            masks[i] = decode(code, shape)
+
+        count += 1
+
+    store()
+
+    return count
+
+
+class Journal:
+    def __init__(self, fn, snapshot=None):
+        """Append-only journal of mask edits, written next to the `.mask` file.
+
+        Strokes are buffered as changed pixels and written with `flush` as runs of flat indices,
+        replaced frames are written compressed. Every record has a checksum, such that after a crash
+        the masks are rebuilt from the `.mask` file and the complete records, see `replay`.
+        The journal is started over when the masks are saved, see `reset`.
+
+        Args:
+            fn (str): Path to journal
+            snapshot (str, optional): The `.mask` file the edits apply to. An existing journal
+                of another snapshot, e.g. of an older version of the file, is started over. Defaults to None.
+        """
+        self.fn = fn
+        self.snapshot = snapshot
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._fp = None
+
+        try:
+            with open(fn, "rb") as fp:
+                header = fp.read(HEADER.size)
+
+        except OSError:
+            header = b""
+
+        if len(header) < HEADER.size or HEADER.unpack(header) != (MAGIC, *snapshot_id(snapshot)):
+            self.reset(snapshot)
+
+        else:
+            # Edits are appended after the last complete record, a damaged record of a crash is cut off
+            self._fp = open(fn, "r+b")
+            end = HEADER.size
+
+            for *_, end in _complete(self._fp):
+                pass
+
+            self._fp.truncate(end)
+            self._fp.seek(end)
+
+    @property
+    def nbytes(self):
+        """Size of the journal in bytes"""
+        return self._fp.tell()
+
+    def reset(self, snapshot=None):
+        """Starts the journal over, e.g. after the masks were saved to the `.mask` file
+
+        Args:
+            snapshot (str, optional): The `.mask` file the following edits apply to. Defaults to None.
+        """
+        with self._lock:
+            self._buffer = []
+            self.snapshot = snapshot
+
+            if self._fp is not None:
+                self._fp.close()
+
+            self._fp = open(self.fn, "wb")
+            self._fp.write(HEADER.pack(MAGIC, *snapshot_id(snapshot)))
+            self._fp.flush()
+
+    def _write(self, kind, i, payload):
+        head = RECORD.pack(kind, i, len(payload))
+        self._fp.write(head + payload + CHECKSUM.pack(zlib.crc32(head + payload)))
+
+    def stroke(self, i, shape, rr, cc, before, value):
+        """Buffers pixels changed by a stroke, see `flush`
+
+        Args:
+            i (int): Frame index
+            shape (tuple): Frame shape (y, x)
+            rr (numpy.ndarray): Row coordinates of painted pixels
+            cc (numpy.ndarray): Column coordinates of painted pixels
+            before (numpy.ndarray): Values of the pixels before painting
+            value (bool): New value of the pixels
+        """
+        changed = np.asarray(before) != value
+        idx = np.ravel_multi_index((np.asarray(rr)[changed], np.asarray(cc)[changed]), shape)
+
+        if idx.size == 0:
+            return
+
+        with self._lock:
+            # Consecutive strokes with the same value are merged, the order of other strokes is kept
+            if self._buffer and self._buffer[-1][:2] == (i, value):
+                self._buffer[-1][2].append(idx)
+
+            else:
+                self._buffer.append((i, value, [idx]))
+
+    def flush(self):
+        """Writes the buffered strokes, they are passed to the operating system but not synced to disk"""
+        with self._lock:
+            buffer, self._buffer = self._buffer, []
+
+            for i, value, idx in buffer:
+                self._write(DELTA, i, bytes([value]) + runs(np.unique(np.concatenate(idx))).tobytes())
+
+            self._fp.flush()
+
+    def set_frame(self, i, mask):
+        """Writes a replaced frame, e.g. after undo or a change across frames
+
+        Args:
+            i (int): Frame index
+            mask (numpy.ndarray): The new mask
+        """
+        self.flush()
+        self._set(i, encode(mask), mask.shape[:2])
+
+        with self._lock:
+            self._fp.flush()
+
+    def _set(self, i, code, shape):
+        data = b"" if code is None else np.ascontiguousarray(code[1]).tobytes()
+
+        with self._lock:
+            self._write(SET, i, struct.pack("<IIB", *shape, KINDS.index(None if code is None else code[0])) + data)
+
+    def rewrite(self, masks):
+        """Starts the journal over with every frame of `masks`, e.g. after changes that were not journaled.
+        The journal applies to the current version of its `.mask` file.
+
+        Args:
+            masks (MaskVolume or RaggedMasks): All masks
+        """
+        self.reset(self.snapshot)
+
+        for i in range(len(masks)):
+            # Frames of a volume are already encoded
+            if isinstance(masks, MaskVolume):
+                self._set(i, masks.frames[i], masks.shape[1:])
+
+            else:
+                m = masks[i]
+                self._set(i, encode(m), m.shape)
+
+        self.sync()
+
+    def sync(self):
+        """Writes the buffered strokes and syncs the journal to disk"""
+        self.flush()
+
+        with self._lock:
+            os.fsync(self._fp.fileno())
+
+    def close(self):
+        self.flush()
+
+        with self._lock:
+            self._fp.close()
+
+    def discard(self):
+        """Closes and deletes the journal, e.g. when the user discards unsaved edits"""
+        with self._lock:
+            self._buffer = []
+            self._fp.close()
+
+        try:
+            os.remove(self.fn)
+
+        except OSError as e:
+            print(f"Could not delete journal: \n{e}")
@@ -0,0 +1,279 @@
+import os
+import threading
+import time
+import numpy as np
+import imageio as io
+from PIL import Image
+from .masks import load_masks, MaskVolume, RaggedMasks
+from .journal import replay
+from .nrrdio import read_nrrd
+from .video import VideoStack, VIDEO_EXTENSIONS
+
+# Progress is reported at most this often, in seconds
+PROGRESS_INTERVAL = 0.1
+
+
+class LoadingCancelled(Exception):
+    pass
+
+
+def image_shape(fn):
+    """Shape (y, x) of an image, read from its header if possible
+
+    Args:
+        fn (str): Path to image
+
+    Returns:
+        tuple: The shape
+    """
+    try:
+        with Image.open(fn) as im:
+            return im.size[::-1]
+
+    # Formats PIL cannot read are decoded
+    except Exception:
+        return io.imread(fn).shape[:2]
+
+
+def is_stack(im):
+    """True if a single image read from a file is a whole stack, e.g. a TIFF series, like `imageio.mimread`"""
+    return im.ndim > 3 or (im.ndim == 3 and im.shape[2] >= 5)
+
+
+class StackLoader:
+    def __init__(self, fn, fn_mask=None, files=None, cache=None, random_access=True, callback=None, fn_journal=None):
+        """Opens an image stack and its masks in a background thread.
+
+        Frames are decoded into a preallocated stack, such that the first frame can be shown
+        while the others are decoded. Events are passed to `callback` from the background thread:
+
+        - `('first', stack, masks)`: the stack with the decoded frames so far and the masks of all frames
+        - `('progress', stack, total)`: the stack with the decoded frames so far and the number of frames,
+          0 if unknown. The stack contains the same arrays as before and further frames.
+        - `('done', stack)`: the complete stack, e.g. memory-mapped from the decoded file cache
+        - `('failed', error)`: the exception
+        - `('cancelled',)`: loading was cancelled, see `cancel`
+
+        Args:
+            fn (str): Path to file or folder
+            fn_mask (str, optional): Path to `.mask` file, loaded if it exists. Defaults to None.
+            files (list, optional): Image files of a folder, opened as list of frames. Defaults to None.
+            cache (DiskCache, optional): Cache of decoded files, used and filled if provided. Defaults to None.
+            random_access (bool, optional): Decode compressed videos on demand, see `VideoStack`. Defaults to True.
+            callback (callable, optional): Called with loading events. Defaults to None.
+            fn_journal (str, optional): Path to journal of edits since the `.mask` file was saved,
+                replayed on the masks if it exists, see `pipra.journal`. Defaults to None.
+        """
+        self.fn = fn
+        self.fn_mask = fn_mask
+        self.files = files
+        self.cache = cache
+        self.random_access = random_access
+        self.callback = callback
+        self.fn_journal = fn_journal
+
+        # Number of edits recovered from the journal
+        self.recovered = 0
+
+        self._cancelled = threading.Event()
+        self._thread = None
+        self._reported = 0
+
+    def start(self):
+        """Loads the stack in a background thread"""
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """Stops decoding after the current frame"""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _emit(self, *event):
+        if self.callback is not None:
+            self.callback(event)
+
+    def _check(self):
+        if self.cancelled:
+            raise LoadingCancelled
+
+    def _progress(self, stack, total, force=False):
+        # Progress is throttled, the GUI extends the stack on every event
+        now = time.monotonic()
+
+        if force or now - self._reported >= PROGRESS_INTERVAL:
+            self._reported = now
+            self._emit('progress', stack, total)
+
+    def masks(self, shapes):
+        """Masks of the `.mask` file if it exists, otherwise empty masks,
+        with the edits of the journal replayed, e.g. after a crash
+
+        Args:
+            shapes (callable): Returns the stack shape (z, y, x), or the frame shapes of a folder
+
+        Returns:
+            MaskVolume or RaggedMasks: The masks
+        """
+        if self.fn_mask is not None and os.path.isfile(self.fn_mask):
+            masks = load_masks(self.fn_mask)
+            print("Mask shape:  ", masks.shape)
+
+        elif self.files is not None:
+            masks = RaggedMasks(shapes())
+
+        else:
+            masks = MaskVolume(tuple(shapes()))
+
+        if self.fn_journal is not None:
+            try:
+                self.recovered = replay(self.fn_journal, masks, self.fn_mask) or 0
+
+            except (OSError, ValueError, IndexError) as e:
+                print(f"Could not replay journal: \n{e}")
+
+            if self.recovered:
+                print("Recovered:   ", self.recovered, "edits")
+
+        return masks
+
+    def run(self):
+        try:
+            if self.files is not None:
+                self.read_folder()
+
+            else:
+                self.read_file()
+
+        except LoadingCancelled:
+            self._emit('cancelled')
+
+        except Exception as e:
+            self._emit('failed', e)
+
+    def read_folder(self):
+        """Decodes the images of a folder in order, the frame shapes are read from the headers first"""
+        n = len(self.files)
+
+        if n == 0:
+            raise ValueError(f"No images found in {self.fn}")
+
+        masks = self.masks(lambda: [image_shape(fn) for fn in self.files])
+        ims = []
+
+        for i, fn in enumerate(self.files):
+            self._check()
+            ims.append(io.imread(fn))
+
+            if i == 0:
+                self._emit('first', list(ims), masks)
+
+            self._progress(list(ims), n, force=i == n-1)
+
+        print("Stack shape: ", len(ims))
+        self._emit('done', ims)
+
+    def read_file(self):
+        """Opens a stack like `PipraMain.open`, only data decoded with imageio is streamed"""
+        s = None
+
+        # NRRD files from ImageJ or CMTK
+        # typically confocal or 2p image data
+        if self.fn.endswith("nrrd"):
+            s = read_nrrd(self.fn, cache=self.cache)
+            print("Stack shape: ", s.shape)
+
+        # Compressed videos are decoded on demand using a keyframe index
+        elif self.random_access and self.fn.lower().endswith(VIDEO_EXTENSIONS):
+            try:
+                s = VideoStack(self.fn)
+                print("Stack shape: ", s.shape, "(random access)")
+            except ImportError:
+                print("Install PyAV for random access to videos, decoding whole video...")
+
+        # Decoded data from previous sessions
+        if s is None and self.cache is not None:
+            s = self.cache.load(self.fn)
+
+            if s is not None:
+                print("Stack shape: ", s.shape, "(cached)")
+
+        if s is not None:
+            self._check()
+            self._emit('first', s, self.masks(lambda: s.shape[:3]))
+            self._progress(s, len(s), force=True)
+            self._emit('done', s)
+            return
+
+        s = self.decode()
+
+        # Store decoded data for next time, continue with memory-mapped stack
+        if self.cache is not None:
+            try:
+                s = self.cache.store(self.fn, s)
+            except OSError as e:
+                print(f"Could not cache decoded data: \n{e}")
+
+        self._emit('done', s)
+
+    def decode(self):
+        """Decodes all frames with imageio into a preallocated stack
+
+        Returns:
+            numpy.ndarray: The stack
+        """
+        with io.get_reader(self.fn) as reader:
+            n = reader.get_length()
+            frames = iter(reader)
+            first = np.asarray(next(frames))
+
+            # Frames of streams without known length are collected first,
+            #  series are read at once
+            if not np.isfinite(n) or (n == 1 and is_stack(first)):
+                s = [first]
+
+                for im in frames:
+                    self._check()
+                    s.append(im)
+
+                s = first if n == 1 else np.asarray(s, dtype=first.dtype)
+                print("Stack shape: ", s.shape)
+
+                self._emit('first', s, self.masks(lambda: s.shape[:3]))
+                self._progress(s, len(s), force=True)
+                return s
+
+            s = np.empty((n, *first.shape), dtype=first.dtype)
+            s[0] = first
+            masks = self.masks(lambda: s.shape[:3])
+            self._emit('first', s[:1], masks)
+            i = 0
+
+            for i, im in enumerate(frames, 1):
+                self._check()
+
+                if i >= n:
+                    break
+
+                s[i] = im
+                self._progress(s[:i+1], n)
+
+        # Some readers report more frames than they decode,
+        #  the masks created for the reported frames are shortened to the decoded frames
+        s = s[:i+1]
+
+        if len(masks) > len(s):
+            masks.truncate(len(s))
+
+        print("Stack shape: ", s.shape)
+        self._progress(s, n, force=True)
+
+        return s
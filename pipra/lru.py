@@ -0,0 +1,112 @@
+from collections import OrderedDict
+import threading
+
+
+def nbytes(value):
+    """Estimates the memory footprint of a cached value.
+
+    Args:
+        value (object): numpy array, or tuple/list/dict of numpy arrays
+
+    Returns:
+        int: Size in bytes
+    """
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes(v) for v in value)
+
+    if isinstance(value, dict):
+        return sum(nbytes(v) for v in value.values())
+
+    return getattr(value, 'nbytes', 0)
+
+
+class LRUCache:
+    def __init__(self, max_bytes=256 * 2**20):
+        """Thread-safe least-recently-used cache bounded by memory size.
+
+        Args:
+            max_bytes (int, optional): Maximum size of all cached values in bytes. Defaults to 256 MB.
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def keys(self):
+        """Cached keys, from least to most recently used"""
+        with self._lock:
+            return list(self._items)
+
+    def get(self, key, default=None):
+        """Returns cached value and marks it as recently used.
+
+        Args:
+            key (hashable): Cache key
+            default (object, optional): Returned if key is not cached. Defaults to None.
+
+        Returns:
+            object: The cached value
+        """
+        with self._lock:
+            if key not in self._items:
+                return default
+
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        """Adds value to the cache, evicting least recently used values if needed.
+
+        Args:
+            key (hashable): Cache key
+            value (object): Value to be cached
+        """
+        with self._lock:
+            self.pop(key)
+            self._items[key] = value
+            self.nbytes += nbytes(value)
+            self.shrink(self.max_bytes)
+
+    __getitem__ = get
+    __setitem__ = put
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+
+            value = self._items.pop(key)
+            self.nbytes -= nbytes(value)
+            return value
+
+    def shrink(self, max_bytes):
+        """Evicts least recently used values until the cache is below `max_bytes`.
+        The most recent value is always kept.
+
+        Args:
+            max_bytes (int): Target size in bytes
+
+        Returns:
+            int: Freed bytes
+        """
+        freed = 0
+
+        with self._lock:
+            while self.nbytes > max_bytes and len(self._items) > 1:
+                _, value = self._items.popitem(last=False)
+                self.nbytes -= nbytes(value)
+                freed += nbytes(value)
+
+        return freed
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
@@ -0,0 +1,402 @@
+from collections.abc import Mapping
+import numpy as np
+import flammkuchen as fl
+import tables
+from .lru import LRUCache
+
+# pipra shows images in row-major order, i.e. (y, x),
+# while masks are stored in files as (z, x, y) to be compatible with older versions.
+
+# Bytes of packed masks read at once when loading lazily
+CHUNK_BYTES = 2**23
+
+# Size of decoded frames kept by MaskVolume
+HOT_BYTES = 64 * 2**20
+
+# Layout of `.mask` files: version 1 stores the masks of folders as one node per frame (`/mask`),
+#  version 2 as packed buffer (`/mask_bits`, `/mask_offsets`, `/mask_shapes`). Stacks are stored alike.
+FORMAT_VERSION = 2
+
+
+def encode(mask):
+    """Compresses a 2D mask, either bit-packed or run-length encoded, whatever is smaller.
+
+    Args:
+        mask (numpy.ndarray): 2D boolean mask
+
+    Returns:
+        tuple or None: Encoding (`'bits'` or `'runs'`) and data, None for empty masks
+    """
+    flat = np.ravel(mask).view(np.uint8) if mask.dtype == bool else np.ravel(mask).astype(bool).view(np.uint8)
+
+    if not flat.any():
+        return None
+
+    # Positions where foreground runs start and end
+    runs = np.flatnonzero(np.diff(flat, prepend=0, append=0))
+
+    if runs.size * 4 < flat.size // 8:
+        return 'runs', runs.astype(np.uint32)
+
+    return 'bits', np.packbits(flat)
+
+
+def decode(code, shape):
+    """Decompresses a mask encoded with `encode`.
+
+    Args:
+        code (tuple or None): The encoded mask
+        shape (tuple): Shape of the mask
+
+    Returns:
+        numpy.ndarray: 2D boolean mask
+    """
+    n = int(np.prod(shape))
+
+    if code is None:
+        return np.zeros(shape, dtype=bool)
+
+    kind, data = code
+
+    if kind == 'bits':
+        return np.unpackbits(data, count=n).view(bool).reshape(shape)
+
+    toggle = np.zeros(n+1, dtype=bool)
+    toggle[data] = True
+    return np.logical_xor.accumulate(toggle)[:n].reshape(shape)
+
+
+class MaskVolume:
+    def __init__(self, shape, hot_bytes=HOT_BYTES):
+        """Compressed masks of an image stack. Empty frames take no memory,
+        other frames are bit-packed or run-length encoded, see `encode`.
+
+        Frames are decoded on access and recently decoded frames are kept in a small cache.
+        Decoded frames are read-only, assign a new mask to change a frame.
+
+        Args:
+            shape (tuple): Shape of the stack (z, y, x)
+            hot_bytes (int, optional): Size of the cache for decoded frames. Defaults to HOT_BYTES.
+        """
+        self.shape = tuple(int(i) for i in shape[:3])
+        self.frames = [None] * self.shape[0]
+        self.hot = LRUCache(hot_bytes)
+
+    @classmethod
+    def from_array(cls, masks):
+        """Compresses masks frame by frame
+
+        Args:
+            masks (numpy.ndarray): The masks as (z, y, x) array
+
+        Returns:
+            MaskVolume: The compressed masks
+        """
+        v = cls(masks.shape)
+
+        for i, m in enumerate(masks):
+            v[i] = m
+
+        return v
+
+    @property
+    def nbytes(self):
+        """Memory of all compressed frames in bytes"""
+        return sum(f[1].nbytes for f in self.frames if f is not None)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def truncate(self, n):
+        """Drops the masks of all frames from `n` on, e.g. of frames a reader reported but did not decode
+
+        Args:
+            n (int): The new number of frames
+        """
+        n = min(int(n), self.shape[0])
+
+        for i in range(n, self.shape[0]):
+            self.hot.pop(i)
+
+        del self.frames[n:]
+        self.shape = (n, *self.shape[1:])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, i):
+        i = int(i)
+        m = self.hot.get(i)
+
+        if m is None:
+            m = decode(self.frames[i], self.shape[1:])
+            m.flags.writeable = False
+            self.hot.put(i, m)
+
+        return m
+
+    def __setitem__(self, i, mask):
+        i = int(i)
+
+        if tuple(mask.shape) != self.shape[1:]:
+            raise ValueError(f"Mask shape {mask.shape} does not match stack with shape {self.shape[1:]}")
+
+        self.frames[i] = encode(mask)
+        self.hot.pop(i)
+
+    def occupancy(self):
+        """True for every frame with a non-empty mask
+
+        Returns:
+            numpy.ndarray: Boolean array with one entry per frame
+        """
+        return np.array([f is not None for f in self.frames], dtype=bool)
+
+    def to_array(self, i0=0, i1=None):
+        """Decodes a range of frames
+
+        Args:
+            i0 (int, optional): First frame. Defaults to 0.
+            i1 (int, optional): Last frame (exclusive), all frames if None. Defaults to None.
+
+        Returns:
+            numpy.ndarray: The masks as (z, y, x) array
+        """
+        i1 = len(self) if i1 is None else i1
+        out = np.zeros((max(i1-i0, 0),) + self.shape[1:], dtype=bool)
+
+        for i in range(i0, i1):
+            if self.frames[i] is not None:
+                out[i-i0] = self[i]
+
+        return out
+
+    def copy(self):
+        v = MaskVolume(self.shape, self.hot.max_bytes)
+        v.frames = list(self.frames)
+        return v
+
+
+class RaggedMasks:
+    def __init__(self, shapes, bits=None, fn=None):
+        """Masks of differently sized frames, e.g. images in a folder, bit-packed into
+        one contiguous buffer with an offset and shape index.
+
+        Frames are unpacked on access and packed on assignment. If a `.mask` file is given,
+        the packed frames are read from it in chunks on first access.
+
+        Args:
+            shapes (numpy.ndarray or list): (height, width) of every frame
+            bits (numpy.ndarray, optional): The packed buffer, all masks empty if None. Defaults to None.
+            fn (str, optional): `.mask` file to lazily read the packed buffer from. Defaults to None.
+        """
+        self.shapes = np.asarray(shapes, dtype=np.int64).reshape(-1, 2)
+        self.offsets = np.zeros(len(self.shapes)+1, dtype=np.int64)
+        np.cumsum(-(-self.shapes.prod(1) // 8), out=self.offsets[1:])
+
+        # Zeroed memory is only allocated by the OS when it is written to
+        self.bits = np.zeros(self.offsets[-1], dtype=np.uint8) if bits is None else bits
+        self.fn = fn
+        self.loaded = np.full(len(self.shapes), fn is None)
+
+    @classmethod
+    def from_list(cls, masks):
+        """Packs a list of 2D masks
+
+        Args:
+            masks (list): The masks as (y, x) arrays
+
+        Returns:
+            RaggedMasks: The packed masks
+        """
+        r = cls([m.shape[:2] for m in masks])
+
+        for i, m in enumerate(masks):
+            r[i] = m
+
+        return r
+
+    def __len__(self):
+        return len(self.shapes)
+
+    @property
+    def nbytes(self):
+        """Memory of the packed buffer and index in bytes"""
+        return self.bits.nbytes + self.offsets.nbytes + self.shapes.nbytes
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def packed(self, i):
+        """View on the packed bits of frame `i`"""
+        self.load(i)
+        return self.bits[self.offsets[i]:self.offsets[i+1]]
+
+    def __getitem__(self, i):
+        h, w = self.shapes[i]
+        return np.unpackbits(self.packed(i), count=h*w).view(bool).reshape(h, w)
+
+    def __setitem__(self, i, mask):
+        if tuple(mask.shape) != tuple(self.shapes[i]):
+            raise ValueError(f"Mask shape {mask.shape} does not match frame {i} with shape {tuple(self.shapes[i])}")
+
+        self.load(i)
+        self.bits[self.offsets[i]:self.offsets[i+1]] = np.packbits(mask, axis=None)
+        self.loaded[i] = True
+
+    def occupancy(self):
+        """True for every frame with a non-empty mask, computed on the packed bits
+
+        Returns:
+            numpy.ndarray: Boolean array with one entry per frame
+        """
+        self.load()
+        occupancy = np.zeros(len(self), dtype=bool)
+
+        # Frames without px have no bits, their offset repeats the offset of the next frame
+        nonempty = np.diff(self.offsets) > 0
+
+        if nonempty.any():
+            occupancy[nonempty] = np.maximum.reduceat(self.bits, self.offsets[:-1][nonempty]) > 0
+
+        return occupancy
+
+    def load(self, i=None):
+        """Reads the packed bits of a chunk of frames around frame `i`
+        from the `.mask` file, or of all frames if `i` is None.
+
+        Args:
+            i (int, optional): Frame index. Defaults to None.
+        """
+        if self.loaded.all():
+            return
+
+        if i is not None and self.loaded[i]:
+            return
+
+        if i is None:
+            j0, j1 = 0, len(self)
+
+        else:
+            # Frames that fit into a chunk, starting at the chunk boundary of `i`
+            n = max(int(CHUNK_BYTES * len(self) // max(self.offsets[-1], 1)), 1)
+            j0 = i - i % n
+            j1 = min(j0 + n, len(self))
+
+        o0, o1 = self.offsets[j0], self.offsets[j1]
+        bits = fl.load(self.fn, "/mask_bits", sel=fl.aslice[o0:o1])
+
+        # Keep frames that were changed after loading
+        keep = np.repeat(self.loaded[j0:j1], np.diff(self.offsets[j0:j1+1]))
+        self.bits[o0:o1][~keep] = bits[~keep]
+        self.loaded[j0:j1] = True
+
+    def copy(self):
+        self.load()
+        return RaggedMasks(self.shapes.copy(), self.bits.copy())
+
+    def to_dict(self):
+        """Index and packed buffer as stored in `.mask` files,
+        the bits of every frame are packed in row-major (y, x) order.
+
+        Returns:
+            dict: The packed buffer `mask_bits`, `mask_offsets` and `mask_shapes` as (height, width)
+        """
+        self.load()
+        return {'mask_bits': self.bits, 'mask_offsets': self.offsets, 'mask_shapes': self.shapes}
+
+
+class EncodedMasks(Mapping):
+    def __init__(self):
+        """Masks of some frames by frame index, kept compressed and decoded when accessed,
+        e.g. masks computed across many frames before they replace the masks of the stack.
+        """
+        self.frames = {}
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def __getitem__(self, i):
+        return decode(*self.frames[i])
+
+    def __setitem__(self, i, mask):
+        self.frames[i] = encode(mask), mask.shape
+
+    def update(self, other):
+        """Adds the masks of another `EncodedMasks` without decoding them"""
+        self.frames.update(other.frames)
+
+
+def load_masks(fn):
+    """Loads masks from a `.mask` file in row-major order.
+
+    Args:
+        fn (str): Path to `.mask` file
+
+    Returns:
+        MaskVolume or RaggedMasks: The compressed masks of a stack, or ragged masks for folders
+    """
+    with tables.open_file(fn, "r") as f:
+        version = getattr(f.root._v_attrs, 'format_version', 1)
+        ragged = "/mask_shapes" in f
+        shape = f.root.mask.shape if not ragged and isinstance(f.root.mask, tables.Array) else None
+
+    if version > FORMAT_VERSION:
+        raise ValueError(f"{fn} was written by a newer version of pipra (format {version}), please update")
+
+    # Packed masks are read lazily
+    if ragged:
+        return RaggedMasks(fl.load(fn, "/mask_shapes"), fn=fn)
+
+    # Folders stored by older versions as list of arrays
+    if shape is None:
+        return RaggedMasks.from_list([m.T for m in fl.load(fn, "/mask")])
+
+    # Stacks are read and compressed in chunks of frames
+    v = MaskVolume((shape[0], shape[2], shape[1]))
+    n = max(CHUNK_BYTES // max(shape[1] * shape[2], 1), 1)
+
+    for i0 in range(0, shape[0], n):
+        for i, m in enumerate(fl.load(fn, "/mask", sel=fl.aslice[i0:i0+n]), i0):
+            v[i] = m.T
+
+    return v
+
+
+def save_masks(fn, masks, files=None):
+    """Saves masks to a `.mask` file, stored as (z, x, y).
+
+    Files are written in the layout FORMAT_VERSION, masks of folders cannot be read by versions before.
+
+    Args:
+        fn (str): Path to `.mask` file
+        masks (numpy.ndarray, MaskVolume, list or RaggedMasks): The masks as (z, y, x) array or volume,
+            or ragged masks for folders, stored as packed buffer, see `RaggedMasks.to_dict`
+        files (list, optional): Image file names when annotating a folder. Defaults to None.
+    """
+    if isinstance(masks, (list, tuple)):
+        masks = RaggedMasks.from_list(masks)
+
+    d = masks.to_dict() if isinstance(masks, RaggedMasks) else {}
+    d['files'] = list(files) if files is not None else None
+    d['format_version'] = FORMAT_VERSION
+    fl.save(fn, d, compression='blosc')
+
+    if isinstance(masks, RaggedMasks):
+        return
+
+    # Stacks are written frame by frame, empty frames are skipped
+    with tables.open_file(fn, "a") as f:
+        z, h, w = masks.shape
+        node = f.create_carray(f.root, "mask", tables.BoolAtom(), shape=(z, w, h),
+                               filters=tables.Filters(complevel=5, complib="blosc"),
+                               chunkshape=(1, w, h))
+
+        for i in range(z):
+            if isinstance(masks, np.ndarray) or masks.frames[i] is not None:
+                node[i] = masks[i].T
@@ -0,0 +1,125 @@
+import os
+import threading
+from .lru import nbytes
+
+
+def physical_memory():
+    """Size of the physical memory in bytes, 8 GB if unknown (e.g. on Windows)"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+    except (AttributeError, ValueError, OSError):
+        return 8 * 2**30
+
+
+# Default memory budget, half of the physical memory
+MEMORY_BUDGET = physical_memory() // 2
+
+# Eviction priorities, lower priorities are evicted first
+PRIORITY_CACHE = 0
+PRIORITY_EXPENSIVE_CACHE = 1
+PRIORITY_HISTORY = 2
+PRIORITY_DATA = 3
+
+
+def shrink_list(items, max_bytes):
+    """Drops the oldest entries of a list, e.g. an undo history, until it is below `max_bytes`.
+
+    Args:
+        items (list): The list, oldest entries first
+        max_bytes (int): Target size in bytes
+
+    Returns:
+        int: Freed bytes
+    """
+    freed = 0
+    total = nbytes(items)
+
+    while items and total > max_bytes:
+        b = nbytes(items.pop(0))
+        total -= b
+        freed += b
+
+    return freed
+
+
+class MemoryManager:
+    def __init__(self, budget=MEMORY_BUDGET):
+        """Accounts the memory of registered stores and caches against a single budget.
+
+        Every consumer reports its size and optionally how to shrink it.
+        When the budget is exceeded, consumers are shrunk in order of their priority,
+        e.g. caches are evicted before undo histories are truncated and image data is spilled to disk.
+
+        Args:
+            budget (int, optional): Memory budget in bytes. Defaults to MEMORY_BUDGET.
+        """
+        self.budget = budget
+        self.consumers = {}
+        self._lock = threading.RLock()
+
+    def register(self, name, size, shrink=None, priority=PRIORITY_CACHE):
+        """Registers a consumer, replacing a consumer with the same name.
+
+        Args:
+            name (str): Name shown in the usage readout
+            size (callable): Returns the current size in bytes
+            shrink (callable, optional): Called with a target size in bytes, returns the freed bytes.
+                Consumers without are only accounted. Defaults to None.
+            priority (int, optional): Eviction priority, lower is evicted first. Defaults to PRIORITY_CACHE.
+        """
+        with self._lock:
+            self.consumers[name] = size, shrink, priority
+
+    def register_cache(self, name, cache, priority=PRIORITY_CACHE):
+        """Registers an `LRUCache`
+
+        Args:
+            name (str): Name shown in the usage readout
+            cache (LRUCache): The cache
+            priority (int, optional): Eviction priority. Defaults to PRIORITY_CACHE.
+        """
+        self.register(name, lambda: cache.nbytes, cache.shrink, priority)
+
+    def unregister(self, prefix):
+        """Removes all consumers whose name starts with `prefix`"""
+        with self._lock:
+            for name in [n for n in self.consumers if n.startswith(prefix)]:
+                del self.consumers[name]
+
+    def usage(self):
+        """Current size of every consumer
+
+        Returns:
+            dict: Size in bytes by consumer name
+        """
+        with self._lock:
+            return {name: int(size()) for name, (size, _, _) in self.consumers.items()}
+
+    @property
+    def total(self):
+        return sum(self.usage().values())
+
+    def enforce(self):
+        """Shrinks consumers by priority until the total is within the budget.
+
+        Returns:
+            int: Freed bytes
+        """
+        with self._lock:
+            usage = self.usage()
+            excess = sum(usage.values()) - self.budget
+            freed = 0
+
+            for name, (_, shrink, _) in sorted(self.consumers.items(), key=lambda c: c[1][2]):
+                if excess <= 0:
+                    break
+
+                if shrink is None or usage[name] == 0:
+                    continue
+
+                f = shrink(max(usage[name] - excess, 0))
+                excess -= f
+                freed += f
+
+            return freed
@@ -0,0 +1,343 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from scipy import ndimage
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from skimage.morphology import disk, ball
+from .masks import EncodedMasks
+from .components import STRUCTURE, CONNECTIVITY
+
+# Number of px processed at once
+CHUNK_PX = 2**26
+
+# Available operations, the size is ignored by operations without structuring element
+OPERATIONS = ('dilate', 'erode', 'open', 'close', 'fill holes', 'remove small objects', 'keep largest component')
+
+# Operations that only depend on a neighbourhood of `size` px
+LOCAL_OPERATIONS = ('dilate', 'erode', 'open', 'close')
+
+
+def _structure(three_d, size=1):
+    """Structuring element, 2D elements are applied to every frame of a volume.
+
+    Args:
+        three_d (bool): Connects neighbouring frames
+        size (int, optional): Radius in px. Defaults to 1.
+
+    Returns:
+        numpy.ndarray: 3D structuring element
+    """
+    if three_d:
+        return ball(size).astype(bool)
+
+    # Only the center plane, as `scipy.ndimage.label` requires a size of 3 along each axis
+    return np.pad(disk(size).astype(bool)[None], ((1, 1), (0, 0), (0, 0)))
+
+
+def _connectivity(three_d):
+    """Connectivity of components, the same as of the component index, see `pipra.components.STRUCTURE`
+
+    Args:
+        three_d (bool): Connects neighbouring frames
+
+    Returns:
+        numpy.ndarray: 3D structuring element
+    """
+    if three_d:
+        return ndimage.generate_binary_structure(3, CONNECTIVITY)
+
+    return np.pad(STRUCTURE[None], ((1, 1), (0, 0), (0, 0)))
+
+
+def _keep_largest(masks, structure):
+    lab, n = ndimage.label(masks, structure)
+
+    if n == 0:
+        return masks
+
+    sizes = np.bincount(lab.ravel())
+    sizes[0] = 0
+
+    # Largest component per frame, or of the whole volume in 3D
+    if not structure[0].any():
+        frame = np.array([sl[0].start for sl in ndimage.find_objects(lab)])
+        labels = np.arange(1, n+1)
+        order = np.lexsort((-sizes[1:], frame))
+        first = np.r_[True, frame[order][1:] != frame[order][:-1]]
+        keep = labels[order][first]
+
+    else:
+        keep = [np.argmax(sizes)]
+
+    return np.isin(lab, keep)
+
+
+def _components(parts):
+    """Merges the components of chunks of consecutive frames, labeled individually, see `_label_chunk`.
+    Components are 6-connected in 3D, such that only px at the same position of neighbouring frames connect.
+
+    Args:
+        parts (list): Number of labels, px per label, border contact per label
+            and labels of the first and last frame of every chunk, in order
+
+    Returns:
+        tuple: Label offset of every chunk, component of every label (0 is the background),
+            px per component and border contact per component, including the first and last frame of the volume
+    """
+    counts = np.array([p[0] for p in parts], dtype=np.int64)
+    offsets = np.r_[0, np.cumsum(counts)[:-1]]
+    n = counts.sum() + 1
+
+    sizes = np.zeros(n, dtype=np.int64)
+    border = np.zeros(n, dtype=bool)
+
+    for o, (k, s, b, first, last) in zip(offsets, parts):
+        sizes[o+1:o+k+1] = s[1:]
+        border[o+1:o+k+1] = b[1:]
+
+    def shift(lab, o):
+        return np.where(lab > 0, lab + o, 0)
+
+    border[shift(parts[0][3], offsets[0])] = True
+    border[shift(parts[-1][4], offsets[-1])] = True
+    border[0] = False
+
+    # Components touching across the faces of neighbouring chunks are merged
+    a, b = [], []
+
+    for k in range(len(parts)-1):
+        last, first = shift(parts[k][4], offsets[k]), shift(parts[k+1][3], offsets[k+1])
+        touching = (last > 0) & (first > 0)
+        a.append(last[touching])
+        b.append(first[touching])
+
+    a, b = np.concatenate([[0], *a]), np.concatenate([[0], *b])
+    _, component = connected_components(coo_matrix((np.ones(len(a)), (a, b)), shape=(n, n)), directed=False)
+
+    return offsets, component, np.bincount(component, weights=sizes).astype(np.int64), \
+        np.bincount(component, weights=border) > 0
+
+
+def _label_chunk(masks, i0, i1, structure, background=False):
+    """Labels the components, or the background, of frames `i0` to `i1` of a volume"""
+    dense = masks.to_array(i0, i1) if hasattr(masks, 'to_array') else np.asarray(masks[i0:i1], dtype=bool)
+    lab, n = ndimage.label(~dense if background else dense, structure)
+
+    return dense, lab, n
+
+
+def morphology(masks, operation, size=1, three_d=False):
+    """Applies a morphological operation to a chunk of frames at once.
+
+    Args:
+        masks (numpy.ndarray): The masks as (z, y, x) array
+        operation (str): One of OPERATIONS
+        size (int, optional): Radius of the structuring element in px,
+            minimum object size in px for `remove small objects`. Defaults to 1.
+        three_d (bool, optional): True 3D operation, otherwise every frame is processed individually. Defaults to False.
+
+    Returns:
+        numpy.ndarray: The processed masks
+    """
+    masks = np.asarray(masks, dtype=bool)
+    connectivity = _connectivity(three_d)
+
+    if operation in LOCAL_OPERATIONS:
+        structure = _structure(three_d, size)
+
+        # Pixels outside of the image count as foreground when eroding,
+        #  such that masks touching the image border are not eroded from there
+        def erode(m):
+            return ndimage.binary_erosion(m, structure, border_value=1)
+
+        def dilate(m):
+            return ndimage.binary_dilation(m, structure)
+
+        if operation == 'dilate':
+            return dilate(masks)
+
+        elif operation == 'erode':
+            return erode(masks)
+
+        elif operation == 'open':
+            return dilate(erode(masks))
+
+        return erode(dilate(masks))
+
+    elif operation == 'fill holes':
+        # Frames at the ends of the chunk would be part of the border
+        if not three_d:
+            padded = np.pad(masks, ((1, 1), (0, 0), (0, 0)))
+            return ndimage.binary_fill_holes(padded, connectivity)[1:-1]
+
+        return ndimage.binary_fill_holes(masks, connectivity)
+
+    elif operation == 'remove small objects':
+        lab, _ = ndimage.label(masks, connectivity)
+        sizes = np.bincount(lab.ravel())
+        sizes[0] = 0
+        return sizes[lab] >= size
+
+    elif operation == 'keep largest component':
+        return _keep_largest(masks, connectivity)
+
+    raise ValueError(f"Unknown operation {operation}, use one of {OPERATIONS}")
+
+
+def apply(masks, operation, size=1, three_d=False, frames=None, executor=None, progress=None):
+    """Applies a morphological operation to a stack in chunks of frames, processed in parallel.
+
+    Local 3D operations use overlapping chunks. All other 3D operations label the components of every chunk,
+    merge them across the faces of neighbouring chunks and then process the chunks again with the merged labels,
+    such that the whole stack is never decoded at once.
+
+    Args:
+        masks (MaskVolume, RaggedMasks or numpy.ndarray): The masks of the stack
+        operation (str): One of OPERATIONS
+        size (int, optional): Size of the operation, see `morphology`. Defaults to 1.
+        three_d (bool, optional): True 3D operation, frames of folders are always processed individually. Defaults to False.
+        frames (iterable, optional): Frames to process, all frames if None. In 3D, all frames are processed. Defaults to None.
+        executor (concurrent.futures.Executor, optional): Processes the chunks, a thread pool is used if None. Defaults to None.
+        progress (callable, optional): Called with (done, total) chunks, cancels if it returns False. Defaults to None.
+
+    Returns:
+        EncodedMasks or None: Changed masks by frame index, None if cancelled
+    """
+    # Folders are always processed frame by frame
+    three_d = three_d and hasattr(masks, 'shape')
+
+    if three_d:
+        frames = np.arange(len(masks))
+
+    else:
+        frames = np.arange(len(masks)) if frames is None else np.unique(np.asarray(list(frames), dtype=int))
+
+        # Empty masks stay empty with every operation
+        occupancy = masks.occupancy() if hasattr(masks, 'occupancy') else np.array([m.any() for m in masks])
+        frames = frames[occupancy[frames]]
+
+    # Chunks of consecutive frames with a halo of neighbouring frames in 3D
+    if three_d:
+        h, w = masks.shape[1:3]
+        step = max(CHUNK_PX // max(h * w, 1), 1)
+        halo = 2 * size if operation in LOCAL_OPERATIONS else 0
+        chunks = [(i0, min(i0+step, len(frames))) for i0 in range(0, len(frames), step)]
+
+    else:
+        halo = 0
+        chunks = []
+
+        # Frames of equal shape are processed together
+        for i in frames:
+            c = chunks[-1] if chunks else None
+
+            if c is not None and len(c) * masks[c[0]].size < CHUNK_PX and masks[c[0]].shape == masks[i].shape:
+                c.append(i)
+
+            else:
+                chunks.append([i])
+
+    # Components of the whole volume, see `_components`
+    connectivity = _connectivity(True)
+    background = operation == 'fill holes'
+    merged = None
+
+    def label(chunk):
+        _, lab, n = _label_chunk(masks, *chunk, connectivity, background)
+        sides = np.zeros(n+1, dtype=bool)
+
+        for side in (lab[:, 0], lab[:, -1], lab[:, :, 0], lab[:, :, -1]):
+            sides[side] = True
+
+        return n, np.bincount(lab.ravel(), minlength=n+1), sides, lab[0].copy(), lab[-1].copy()
+
+    def run(chunk):
+        if merged is not None:
+            offsets, select = merged
+            i0, i1 = chunk
+            dense, lab, _ = _label_chunk(masks, i0, i1, connectivity, background)
+            lab = select[np.where(lab > 0, lab + offsets[chunk], 0)]
+            result = dense | lab if background else lab
+            ids = range(i0, i1)
+
+        elif three_d:
+            i0, i1 = chunk
+            j0, j1 = max(i0-halo, 0), min(i1+halo, len(masks))
+            dense = masks.to_array(j0, j1) if hasattr(masks, 'to_array') else np.asarray(masks[j0:j1])
+            result = morphology(dense, operation, size, True)[i0-j0:i1-j0]
+            ids = range(i0, i1)
+
+        else:
+            result = morphology(np.stack([masks[i] for i in chunk]), operation, size, False)
+            ids = chunk
+
+        # Changed frames are compressed by the workers
+        changed = EncodedMasks()
+
+        for i, m in zip(ids, result):
+            if not np.array_equal(m, masks[i]):
+                changed[i] = m
+
+        return changed
+
+    own = executor is None
+
+    if own:
+        executor = ThreadPoolExecutor()
+
+    changed = EncodedMasks()
+    futures = []
+    total = 2 * len(chunks) if three_d and operation not in LOCAL_OPERATIONS else len(chunks)
+
+    def results(fn):
+        nonlocal futures
+        futures = [executor.submit(fn, c) for c in chunks]
+
+        for f in futures:
+            yield f.result()
+
+    try:
+        done = 0
+
+        if total > len(chunks):
+            parts = []
+
+            for part in results(label):
+                parts.append(part)
+                done += 1
+
+                if progress is not None and progress(done, total) is False:
+                    return None
+
+            offsets, component, sizes, border = _components(parts)
+
+            # Labels that are kept, or background labels that are filled
+            if operation == 'fill holes':
+                select = ~border[component]
+
+            elif operation == 'remove small objects':
+                select = sizes[component] >= size
+
+            else:
+                sizes[component[0]] = 0
+                select = component == np.argmax(sizes)
+
+            select[0] = False
+            merged = dict(zip(chunks, offsets)), select
+
+        for result in results(run):
+            changed.update(result)
+            done += 1
+
+            if progress is not None and progress(done, total) is False:
+                return None
+
+    finally:
+        # Chunks not started yet are dropped when cancelled or on errors
+        for f in futures:
+            f.cancel()
+
+        if own:
+            executor.shutdown(wait=False)
+
+    return changed
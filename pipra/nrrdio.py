@@ -0,0 +1,143 @@
+import numpy as np
+import bz2
+import os
+import zlib
+
+# NRRD types to numpy types
+NRRD_TYPES = {
+    'i1': ['signed char', 'int8', 'int8_t'],
+    'u1': ['uchar', 'unsigned char', 'uint8', 'uint8_t'],
+    'i2': ['short', 'short int', 'signed short', 'signed short int', 'int16', 'int16_t'],
+    'u2': ['ushort', 'unsigned short', 'unsigned short int', 'uint16', 'uint16_t'],
+    'i4': ['int', 'signed int', 'int32', 'int32_t'],
+    'u4': ['uint', 'unsigned int', 'uint32', 'uint32_t'],
+    'i8': ['longlong', 'long long', 'long long int', 'signed long long', 'signed long long int', 'int64', 'int64_t'],
+    'u8': ['ulonglong', 'unsigned long long', 'unsigned long long int', 'uint64', 'uint64_t'],
+    'f4': ['float'],
+    'f8': ['double'],
+}
+
+
+def nrrd_dtype(header):
+    """Numpy data type of NRRD data
+
+    Args:
+        header (dict): NRRD header
+
+    Returns:
+        numpy.dtype: The data type, including byte order
+    """
+    t = [k for k, v in NRRD_TYPES.items() if header['type'] in v][0]
+    dtype = np.dtype(t)
+
+    if dtype.itemsize > 1:
+        dtype = dtype.newbyteorder('>' if header.get('endian') == 'big' else '<')
+
+    return dtype
+
+
+def _decompress(fp, out, decompressor, pending=b'', chunk=2**22):
+    """Decompresses a stream slab by slab into a flat uint8 buffer.
+
+    Returns:
+        bytes: Decompressed bytes that did not fit into `out`
+    """
+    pos = 0
+    data = pending
+
+    while True:
+        n = min(len(data), len(out) - pos)
+        out[pos:pos+n] = np.frombuffer(data, dtype=np.uint8, count=n)
+        pos += n
+        data = data[n:]
+
+        if pos == len(out):
+            return data
+
+        compressed = fp.read(chunk)
+
+        if not compressed:
+            raise ValueError(f"NRRD data is truncated, got {pos} of {len(out)} bytes")
+
+        data = decompressor.decompress(compressed)
+
+
+def read_nrrd(fn, cache=None, axis=0):
+    """Reads a NRRD volume as stack of slices without loading it into memory.
+
+    Uncompressed (raw) data is memory-mapped. Compressed data (gzip, bzip2) is decompressed
+    slab by slab into the decoded file cache, that is memory-mapped as well,
+    or into memory if no cache is provided.
+    The volume is returned as (z, y, x) view, i.e. every slice is a strided view in row-major order.
+
+    Args:
+        fn (str): Path to NRRD file
+        cache (DiskCache, optional): Cache for decompressed data. Defaults to None.
+        axis (int, optional): Slicing axis in (z, y, x) order. Defaults to 0.
+
+    Returns:
+        numpy.ndarray: The volume, a read-only memory-map if possible
+    """
+    import nrrd
+
+    with open(fn, 'rb') as fp:
+        header = nrrd.read_header(fp)
+        offset = fp.tell()
+
+    # NRRD sizes are fastest axis first, i.e. (x, y, z) is stored as C-ordered (z, y, x)
+    shape = tuple(int(i) for i in header['sizes'][::-1])
+    dtype = nrrd_dtype(header)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+
+    # Detached header
+    data_fn = header.get('data file', header.get('datafile'))
+
+    if data_fn is not None:
+        data_fn = os.path.join(os.path.dirname(fn), data_fn)
+        offset = 0
+
+    else:
+        data_fn = fn
+
+    with open(data_fn, 'rb') as fp:
+        fp.seek(offset)
+
+        for _ in range(header.get('line skip', header.get('lineskip', 0))):
+            fp.readline()
+
+        offset = fp.tell()
+
+    byte_skip = header.get('byte skip', header.get('byteskip', 0))
+    encoding = header['encoding']
+
+    if encoding == 'raw':
+        offset = os.path.getsize(data_fn) - nbytes if byte_skip == -1 else offset + byte_skip
+        s = np.memmap(data_fn, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+    elif encoding in ('gzip', 'gz', 'bzip2', 'bz2'):
+        s = cache.load(fn) if cache is not None else None
+
+        if s is None:
+            s = cache.create(fn, shape, dtype) if cache is not None else np.empty(shape, dtype=dtype)
+
+            with open(data_fn, 'rb') as fp:
+                fp.seek(offset)
+                decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32) if encoding in ('gzip', 'gz') \
+                    else bz2.BZ2Decompressor()
+
+                # Skip bytes after decompressing
+                pending = _decompress(fp, np.empty(max(byte_skip, 0), dtype=np.uint8), decompressor)
+                _decompress(fp, s.reshape(-1).view(np.uint8), decompressor, pending)
+
+            if cache is not None:
+                s = cache.commit(fn, s)
+
+    # ASCII encoded data needs to be parsed
+    else:
+        s, _ = nrrd.read(fn, index_order='C')
+
+    # 2D images as single slice
+    if s.ndim == 2:
+        s = s[None]
+
+    return np.moveaxis(s, axis, 0)
@@ -1,23 +1,51 @@
 from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QGridLayout, \
     QSlider, QLabel, QFileDialog, QColorDialog, QMessageBox, QInputDialog, \
-    QAction, QGraphicsPathItem
+    QAction, QGraphicsPathItem, QProgressDialog, QDialog, QDialogButtonBox, QFormLayout, \
+    QSpinBox, QCheckBox, QProgressBar, QPushButton
 from PyQt5.QtGui import QKeySequence, QPainter, QColor, QCursor, QPolygonF, QPen, \
     QPainterPath
-from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtCore import Qt, pyqtSignal, QTimer, QRectF
 import numpy as np
 import pyqtgraph as pg
 import imageio as io
-import flammkuchen as fl
 import os
 from skimage.draw import disk, polygon
-from skimage.color import rgb2gray
 import json
 from glob import glob
 import platform
 
 ### Import related functions
-from .floodfill import floodfill
+from .floodfill import floodfill, floodfill_frames
 from .grabcut import GrabCut
+from .tiles import TiledImage, TiledMask, TILED_PIXELS, level_for
+from .masks import save_masks, RaggedMasks, MaskVolume, EncodedMasks, encode, decode
+from .histogram import HistogramCache, histogram
+from .thumbnails import ThumbnailCache
+from .filmstrip import Filmstrip, FilmstripModel
+from .diskcache import DiskCache
+from .video import VideoStack
+from .interpolate import interpolate_keyframes
+from . import morphology
+from .consensus import consensus, load_frames, save_frames
+from .stats import MaskStats
+from .statsview import StatsWindow
+from .superpixels import SuperpixelCache, label_pixels
+from .components import ComponentIndex
+from .coco import export_coco, FORMATS as COCO_FORMATS
+from . import proxy
+from collections import deque
+from multiprocessing import AuthenticationError
+from concurrent.futures import ThreadPoolExecutor
+from .lru import LRUCache, nbytes
+from .session import SessionServer, SessionClient, DEFAULT_PORT, frame_shape, parse_key
+from .loader import StackLoader
+from .resume import save_resume, load_resume, SAVE_INTERVAL
+from .journal import Journal, COMPACT_BYTES
+from .memory import MemoryManager, shrink_list, PRIORITY_CACHE, PRIORITY_EXPENSIVE_CACHE, \
+    PRIORITY_HISTORY, PRIORITY_DATA
+
+# Images are (y, x) arrays, i.e. frames are shown without transposing
+pg.setConfigOptions(imageAxisOrder='row-major')
 
 class PipraImageItem(pg.ImageItem):
     wheel_change = pyqtSignal(int)
@@ -89,29 +117,44 @@ class PipraImageItem(pg.ImageItem):
 
 class PipraImageView(pg.ImageView):
     keyPressSignal = pyqtSignal(int)
+    maskChanged = pyqtSignal(object, object, object, bool)
+    maskReplaced = pyqtSignal()
+    refined = pyqtSignal()
 
-    def __init__(self, im, mask=None, parent=None):
+    def __init__(self, im, mask=None, parent=None, tiled=None):
         """The drawing environment
 
         Args:
             im (numpy.ndarray): The image to be masked
-            mask (numpy.ndarray, optional): The binary mask for `im`, 
+            mask (numpy.ndarray, optional): The binary mask for `im`,
                 will be initialized as zeros when not provided. Defaults to None.
             parent (QWidget, optional): Used to show ImageView in parent QWidget. Defaults to None.
+            tiled (bool, optional): Only render the tiles in the current viewport
+                at the needed resolution, used for very large frames.
+                If None, it is enabled for frames larger than `TILED_PIXELS`. Defaults to None.
         """
         # Set Widget as parent to show ImageView in Widget
         super().__init__(parent=parent)
 
-        # Set 2D image
-        self.setImage(im)
+        self.tiledOption = tiled
+        self.tiled = False
+        self.im = im
         self.shape = im.shape[:2]
 
+        # Coalesce viewport changes to a single redraw
+        self.renderTimer = QTimer(singleShot=True, interval=0)
+        self.renderTimer.timeout.connect(self.updateViewport)
+
+        # Tiles of the shown frame, accounted by the memory manager
+        self.tileCache = LRUCache()
+
         self.history = []
         self.saved = True
 
         # Flood fill settings
         self.tolerance = 5
         self.only_darker_px = True
+        self.lastSeed = None
 
         # Colors
         self.colorCursor = (255, 0, 100, 255)  # magenta
@@ -134,22 +177,16 @@ class PipraImageView(pg.ImageView):
         self.polygon.setPen(QPen(Qt.red, 1, Qt.SolidLine))
         self.getView().addItem(self.polygon)
 
-        # Current cursor map
-        self.currentCursor = np.zeros(self.shape + (4,), dtype=np.uint8)
+        # Current cursor, only the brush footprint is drawn
+        self.currentCursor = np.zeros((1, 1, 4), dtype=np.uint8)
         self.currentCursorItem = pg.ImageItem(
             self.currentCursor,
             compositionMode=QPainter.CompositionMode_Plus,
         )
 
-        # Current mask
-        self.mask = np.zeros(self.shape + (4,), dtype=np.uint8)
-
-        # If there's already a mask
-        if mask is not None:
-            self.mask[mask] = self.colorMask
-
+        # Current mask, binary and colored using a lookup table
         self.maskItem = PipraImageItem(
-            self.mask,
+            np.zeros((1, 1), dtype=np.uint8),
             compositionMode=QPainter.CompositionMode_Plus,
         )
 
@@ -158,11 +195,38 @@ class PipraImageView(pg.ImageView):
         self.mode = 'circle'
         self.showMask = 1
 
+        # Label index of the current frame's superpixels, set by the stack
+        self.superpixelIndex = None
+
+        # Flood fill and GrabCut on large frames run on a downsampled proxy first,
+        #  the full resolution result is refined in the background, see `commitProxy`
+        self.proxyEditing = False
+        self.proxyImage = None
+        self.proxyGeneration = 0
+        self.refinements = deque()
+        self.refiner = ThreadPoolExecutor(max_workers=1)
+        self.refined.connect(self.applyRefinements)
+
+        # Connected components of the mask, built when first needed, see `componentIndex`
+        self.components = None
+        self.selection = None
+        self.selectionItem = pg.ImageItem(np.zeros((1, 1, 4), dtype=np.uint8),
+                                          compositionMode=QPainter.CompositionMode_Plus)
+
         # Add mask and cursor as overlay images,
         #  disable right click menu
         self.getView().addItem(self.currentCursorItem)
         self.getView().addItem(self.maskItem)
+        self.getView().addItem(self.selectionItem)
         self.getView().setMenuEnabled(False)
+        self.getView().sigRangeChanged.connect(self.renderTimer.start)
+
+        # Histograms are computed once per frame and cached,
+        #  i.e. not for every image update
+        self.getImageItem().sigImageChanged.disconnect(self.ui.histogram.item.imageChanged)
+
+        # Set 2D image and mask
+        self.setZ(im, mask, autoRange=True, histogram=histogram(im))
 
     def keyPressEvent(self, ev):
         """Handling the main shortcuts
@@ -195,13 +259,8 @@ class PipraImageView(pg.ImageView):
 
         # Toggle mask visibility
         elif ev.key() == Qt.Key_Q:
-            if self.showMask:
-                self.maskItem.setImage(np.zeros_like(self.mask))
-
-            else:
-                self.maskItem.setImage(self.mask)
-
             self.showMask = not self.showMask
+            self.updateMask()
 
         # Change Circle and Block
         elif ev.key() == Qt.Key_M:
@@ -227,6 +286,23 @@ class PipraImageView(pg.ImageView):
                 self.mode = 'circle'
                 self.disableGrabCut()
 
+        # Change to SUPERPIXEL mode
+        elif ev.key() == Qt.Key_U:
+            self.mode = 'superpixel' if self.mode != 'superpixel' else 'circle'
+
+        # Keep only the selected component, or the one below the cursor
+        elif ev.key() == Qt.Key_V and modifiers == Qt.ShiftModifier:
+            self.keepComponent()
+
+        # Change to COMPONENT mode
+        elif ev.key() == Qt.Key_V:
+            self.mode = 'component' if self.mode != 'component' else 'circle'
+
+        # Remove the selected component
+        elif ev.key() in (Qt.Key_Delete, Qt.Key_Backspace):
+            if self.selection is not None:
+                self.removeComponent(*self.selection)
+
         # Cycle through options
         elif ev.key() == Qt.Key_1:
             if self.mode == 'circle':
@@ -243,13 +319,17 @@ class PipraImageView(pg.ImageView):
         # Go back in history...
         elif ev.key() == Qt.Key_Z and modifiers == Qt.ControlModifier:
             if len(self.history):
-                old_mask = self.history.pop()
-                self.mask[:, :] = old_mask
-                self.maskItem.setImage(self.mask)
+                self.mask = self.history.pop()
+                self.resetComponents()
+                self.updateMask()
+                self.maskReplaced.emit()
 
         # Clear mask
         elif ev.key() == Qt.Key_X:
-            self.mask[:, :] = False
+            self.mask.fill(False)
+            self.resetComponents()
+            self.updateMask()
+            self.maskReplaced.emit()
 
         # Move 
         elif ev.key() == Qt.Key_Space:
@@ -270,6 +350,20 @@ class PipraImageView(pg.ImageView):
     def mousePressEvent(self, e):
         modifiers = QApplication.keyboardModifiers()
 
+        # Select (left) or remove (right) a whole connected component
+        if (modifiers == Qt.AltModifier or self.mode == 'component') and \
+                not self.maskItem.spaceIsDown and self.xy is not None:
+            i, j = self.mapToImage(self.xy)
+
+            if 0 <= i < self.shape[0] and 0 <= j < self.shape[1]:
+                if e.button() == Qt.LeftButton:
+                    self.selectComponent(i, j)
+
+                elif e.button() == Qt.RightButton:
+                    self.removeComponent(i, j)
+
+            return
+
         if modifiers != Qt.ShiftModifier and not self.maskItem.spaceIsDown:
             # Add to mask in drawing mode
             if e.button() == Qt.LeftButton and self.mode not in ('outline', 'grabcut'):
@@ -300,73 +394,353 @@ class PipraImageView(pg.ImageView):
         if self.xy is None:
             return
 
-        xy = self.getImageItem().mapFromScene(self.xy)
-        radius = self.radius
+        i, j = self.mapToImage(self.xy)
 
         # Current mouse location is outside of scene, ignore... 
-        if xy.x() < 0 or xy.x() >= self.shape[0] or xy.y() < 0 or xy.y() >= self.shape[1]:
+        if i < 0 or i >= self.shape[0] or j < 0 or j >= self.shape[1]:
             return
 
         # Show current cursor position and painting preview
-        self.currentCursor = np.zeros(self.shape+(4,), dtype=np.uint8)
-        cursorMask = np.zeros(self.shape, dtype=np.bool)
-
-        # Different mask modes
-        # Single pixel
-        if self.radius == 0:
-            cursorMask[int(xy.x()), int(xy.y())] = True
-
-        # Square
-        elif self.mode == 'block':
-            cursorMask[int(xy.x() - radius // 2):int(xy.x() + radius // 2 + 1),
-                       int(xy.y() - radius // 2):int(xy.y() + radius // 2) + 1] = True
-
-        # Circle
-        elif self.mode == 'circle':
-            rr, cc = disk((xy.x(), xy.y()), radius, shape=self.shape)
-            cursorMask[rr, cc] = True
-
-        elif self.mode == 'outline' or self.mode == 'grabcut':
-            pass
-
-        # Show the cursorMask colored
-        self.currentCursor[cursorMask] = self.colorCursor
+        rr, cc = self.brush(i, j)
 
         # if mouse is clicked without SHIFT
         if self.maskItem.clicked or forcePaint:
             # Depending on mode,
             #  add or remove pixels from mask
-            val = self.colorMask if self.maskItem.mode == 'add' else self.colorBlack
+            val = self.maskItem.mode == 'add'
             modifiers = QApplication.keyboardModifiers()
 
             if self.maskItem.save_history:
+                # Snapshots are taken after pending refinements, undo restores full resolution results
+                self.applyRefinements(wait=True)
                 self.history.append(self.mask.copy())
 
             # Assign value
             # Floodfill using current xy position as seed pixel
             if modifiers == Qt.ControlModifier:
-                im = (rgb2gray(self.getImageItem().image)*255).astype(np.uint8)
-                f = floodfill(im,
-                              (int(xy.x()),
-                               int(xy.y())),
-                               tolerance=self.tolerance,
-                               only_darker_px=self.only_darker_px)
+                self.lastSeed = i, j
+                settings = dict(tolerance=self.tolerance,
+                                only_darker_px=self.only_darker_px,
+                                levels=self.ui.histogram.getLevels())
+                f = self.proxyFactor()
+
+                # Immediate result on the proxy, refined at full resolution in the background
+                if f > 1:
+                    coarse = proxy.upsample(proxy.proxy_floodfill(self.proxyFrame(), f, (i, j), **settings), f, self.shape)
+
+                    if coarse is not None:
+                        self.commitProxy(*coarse, f, val,
+                                         lambda im, c, o: proxy.refine_floodfill(im, c, o, f, (i, j), **settings))
 
-                self.mask[f == 1] = val
+                else:
+                    f = floodfill(self.im, (i, j), **settings)
+                    self.setMaskPixels(*np.nonzero(f == 1), val)
 
             # Otherwise use the current cursor mask
             else:
-                self.mask[cursorMask] = val
+                self.setMaskPixels(rr, cc, val)
 
             self.showMask = True
             self.saved = False
 
+            # Update mask image
+            self.updateMask()
+
         # Update cursor image
+        self.updateCursor(rr, cc)
+
+    def setMaskPixels(self, rr, cc, value):
+        """Sets pixels of the mask, every drawing tool changes the mask here.
+        Emits `maskChanged` with the coordinates, previous values and the new value.
+
+        Args:
+            rr (numpy.ndarray): Row coordinates
+            cc (numpy.ndarray): Column coordinates
+            value (bool): New value of the pixels
+        """
+        before = self.mask[rr, cc]
+        self.mask[rr, cc] = value
+
+        if self.components is not None:
+            self.components.update(rr, cc, before, bool(value))
+
+        self.maskChanged.emit(rr, cc, before, bool(value))
+
+    def proxyFactor(self):
+        """Subsampling factor of the proxy for interactive operations, 1 if disabled or for small frames"""
+        return proxy.proxy_factor(self.shape) if self.proxyEditing else 1
+
+    def proxyFrame(self):
+        """Downsampled copy of the current frame, created once per frame"""
+        if self.proxyImage is None:
+            self.proxyImage = proxy.downsample(self.im, self.proxyFactor())
+
+        return self.proxyImage
+
+    def commitProxy(self, coarse, offset, f, value, refine, width=None):
+        """Sets an upsampled proxy result and refines it at full resolution in the background.
+        The refinement only changes pixels set by the proxy result and within the band along its boundary.
+
+        Args:
+            coarse (numpy.ndarray): Upsampled proxy result, see `pipra.proxy.upsample`
+            offset (tuple): Offset (i0, j0) of `coarse`
+            f (int): Subsampling factor of the proxy
+            value (bool): New value of the pixels
+            refine (callable): Called with the image, padded `coarse` and its offset in a background thread,
+                returns the refined mask
+            width (int, optional): Padding for the band, `f` if None. Defaults to None.
+        """
+        coarse, offset = proxy.pad(coarse, offset, f if width is None else width, self.shape)
+        i0, j0 = offset
+        rr, cc = np.nonzero(coarse)
+
+        # Pixels that change with the proxy result
+        changed = np.zeros(coarse.shape, dtype=bool)
+        changed[rr, cc] = self.mask[rr+i0, cc+j0] != value
+        self.setMaskPixels(rr+i0, cc+j0, value)
+
+        def apply(refined):
+            restore = np.nonzero(changed & ~refined)
+            extend = np.nonzero(refined & ~coarse)
+            self.setMaskPixels(restore[0]+i0, restore[1]+j0, not value)
+            self.setMaskPixels(extend[0]+i0, extend[1]+j0, value)
+
+        future = self.refiner.submit(refine, self.im, coarse, offset)
+        future.add_done_callback(lambda _: self.refined.emit())
+        self.refinements.append((self.proxyGeneration, future, apply))
+
+    def applyRefinements(self, wait=False):
+        """Sets the full resolution results of proxy operations that are done, in order
+
+        Args:
+            wait (bool, optional): Waits for all pending refinements, e.g. before storing the mask. Defaults to False.
+        """
+        applied = False
+
+        while self.refinements:
+            generation, future, apply = self.refinements[0]
+
+            if not (wait or future.done()):
+                break
+
+            self.refinements.popleft()
+
+            # Refinements of a replaced mask are dropped
+            if generation == self.proxyGeneration:
+                apply(future.result())
+                applied = True
+
+        if applied:
+            self.updateMask()
+
+    def componentIndex(self):
+        """Connected components of the mask, labeled once per frame and updated with every stroke
+
+        Returns:
+            ComponentIndex: The components
+        """
+        if self.components is None:
+            self.components = ComponentIndex(self.getMask())
+
+        return self.components
+
+    def resetComponents(self):
+        """Drops the component index, selection and pending refinements, e.g. when the mask is replaced"""
+        self.proxyGeneration += 1
+        self.components = None
+        self.selection = None
+        self.showSelection()
+
+    def showSelection(self):
+        """Highlights the selected component"""
+        rr, cc = self.componentIndex().component(*self.selection) if self.selection is not None else ([], [])
+
+        if len(rr) == 0:
+            self.selection = None
+            self.selectionItem.setImage(np.zeros((1, 1, 4), dtype=np.uint8))
+            return
+
+        i0, j0 = rr.min(), cc.min()
+        selection = np.zeros((rr.max()-i0+1, cc.max()-j0+1, 4), dtype=np.uint8)
+        selection[rr-i0, cc-j0] = self.colorCursor
+
+        self.selectionItem.setImage(selection)
+        self.setRect(self.selectionItem, i0, i0+selection.shape[0], j0, j0+selection.shape[1])
+
+    def selectComponent(self, i, j):
+        """Selects the connected component at a position, see `keepComponent`"""
+        self.selection = i, j
+        self.showSelection()
+
+    def removeComponent(self, i, j):
+        """Removes the connected component at a position"""
+        # Components and the undo snapshot include pending refinements
+        self.applyRefinements(wait=True)
+        rr, cc = self.componentIndex().component(i, j)
+
+        if len(rr):
+            self.history.append(self.mask.copy())
+            self.setMaskPixels(rr, cc, False)
+            self.saved = False
+            self.updateMask()
+
+        self.showSelection()
+
+    def keepComponent(self):
+        """Removes all connected components except the selected one, or the one below the cursor"""
+        if self.selection is not None:
+            i, j = self.selection
+
+        elif self.xy is not None:
+            i, j = self.mapToImage(self.xy)
+
+        else:
+            return
+
+        # Components and the undo snapshot include pending refinements
+        self.applyRefinements(wait=True)
+
+        if not (0 <= i < self.shape[0] and 0 <= j < self.shape[1]) or not self.componentIndex().root(i, j):
+            return
+
+        rr, cc = self.components.others(i, j)
+
+        if len(rr):
+            self.history.append(self.mask.copy())
+            self.setMaskPixels(rr, cc, False)
+            self.saved = False
+            self.updateMask()
+
+        self.showSelection()
+
+    def brush(self, i, j):
+        """Pixels covered by the current brush
+
+        Args:
+            i (int): Brush center along first image axis
+            j (int): Brush center along second image axis
+
+        Returns:
+            tuple: The brush px indices (rr, cc)
+        """
+        radius = self.radius
+
+        # Different mask modes
+        # Superpixel below the cursor, once computed
+        if self.mode == 'superpixel':
+            if self.superpixelIndex is None:
+                return np.array([], dtype=int), np.array([], dtype=int)
+
+            return label_pixels(self.superpixelIndex, i, j)
+
+        # Connected component below the cursor
+        elif self.mode == 'component':
+            return self.componentIndex().component(i, j)
+
+        # Single pixel
+        elif self.radius == 0:
+            return np.array([i]), np.array([j])
+
+        # Square
+        elif self.mode == 'block':
+            rr, cc = np.mgrid[max(i - radius // 2, 0):min(i + radius // 2 + 1, self.shape[0]),
+                              max(j - radius // 2, 0):min(j + radius // 2 + 1, self.shape[1])]
+            return rr.ravel(), cc.ravel()
+
+        # Circle
+        elif self.mode == 'circle':
+            return disk((i, j), radius, shape=self.shape)
+
+        # Outline and GrabCut
+        return np.array([], dtype=int), np.array([], dtype=int)
+
+    def mapToImage(self, xy):
+        """Maps scene coordinates to full resolution image indices
+
+        Args:
+            xy (QPointF): Position in scene
+
+        Returns:
+            tuple: Image indices (i, j)
+        """
+        xy = self.getView().mapSceneToView(xy)
+        return int(np.floor(xy.y())), int(np.floor(xy.x()))
+
+    def setRect(self, item, i0, i1, j0, j1):
+        """Places an image item at the given full resolution image range"""
+        item.setRect(QRectF(j0, i0, j1-j0, i1-i0))
+
+    def viewRange(self):
+        """Full resolution image range visible in the viewport
+
+        Returns:
+            tuple: The visible range (i0, i1, j0, j1)
+        """
+        (x0, x1), (y0, y1) = self.getView().viewRange()
+        return y0, y1, x0, x1
+
+    def updateCursor(self, rr, cc):
+        """Shows the brush footprint at the current cursor position
+
+        Args:
+            rr (numpy.ndarray): Brush px along first image axis
+            cc (numpy.ndarray): Brush px along second image axis
+        """
+        if len(rr) == 0:
+            self.currentCursorItem.setImage(np.zeros((1, 1, 4), dtype=np.uint8))
+            return
+
+        i0, j0 = rr.min(), cc.min()
+        self.currentCursor = np.zeros((rr.max()-i0+1, cc.max()-j0+1, 4), dtype=np.uint8)
+        self.currentCursor[rr-i0, cc-j0] = self.colorCursor
+
         self.currentCursorItem.setImage(self.currentCursor)
+        self.setRect(self.currentCursorItem, i0, i0+self.currentCursor.shape[0],
+                     j0, j0+self.currentCursor.shape[1])
+
+    def maskLut(self):
+        """Lookup table to color the binary mask"""
+        lut = np.zeros((256, 4), dtype=np.uint8)
+        lut[0] = self.colorBlack
 
-        # Update mask image
         if self.showMask:
-            self.maskItem.setImage(self.mask)
+            lut[1:] = self.colorMask
+
+        return lut
+
+    def updateMask(self):
+        """Shows the current mask, in tiled mode only the visible part"""
+        if self.tiled:
+            self.updateViewport()
+
+        else:
+            self.maskItem.setImage(self.mask.view(np.uint8),
+                                   levels=(0, 255),
+                                   lut=self.maskLut())
+
+    def updateViewport(self):
+        """Renders image and mask tiles in the current viewport
+        at the resolution needed by the current zoom level.
+        """
+        if not self.tiled:
+            return
+
+        i0, i1, j0, j1 = self.viewRange()
+        level = level_for(max(self.getView().viewPixelSize()), self.tiledImage.levels)
+
+        im, r = self.tiledImage.region(level, i0, i1, j0, j1)
+
+        if im.size == 0:
+            return
+
+        self.getImageItem().setImage(im, autoLevels=False)
+        self.setRect(self.getImageItem(), *r)
+
+        mask, r = self.mask.region(level, *r)
+        self.maskItem.setImage(mask.view(np.uint8),
+                               levels=(0, 255),
+                               lut=self.maskLut())
+        self.setRect(self.maskItem, *r)
 
     def enableOutline(self):
         # Change Cursor to visualize it's a different mode
@@ -387,7 +761,7 @@ class PipraImageView(pg.ImageView):
     def drawRectangle(self):
         if self.maskItem.clicked:
             # Get mouse coordinates and store them
-            xy = self.getImageItem().mapFromScene(self.xy)
+            xy = self.getView().mapSceneToView(self.xy)
             self.xys.append(xy)
 
             # Get first and last point
@@ -410,7 +784,7 @@ class PipraImageView(pg.ImageView):
     def recordPolygon(self):
         if self.maskItem.clicked:
             # Store location
-            xy = self.getImageItem().mapFromScene(self.xy)
+            xy = self.getView().mapSceneToView(self.xy)
             self.xys.append(xy)
         
             # Create polygon to be drawn on image temporarily
@@ -423,30 +797,59 @@ class PipraImageView(pg.ImageView):
             # Create polygon from xy locations
             xys = [(i.x(), i.y()) for i in self.xys]
             xys = np.asarray(xys, dtype=np.int32)
-            rr, cc = polygon(xys[:,0], xys[:,1], self.shape)
+            rr, cc = polygon(xys[:,1], xys[:,0], self.shape)
 
             if self.maskItem.save_history:
+                self.applyRefinements(wait=True)
                 self.history.append(self.mask.copy())
 
             # Add polygon px inside of contour to mask
-            self.mask[rr, cc] = self.colorMask
+            self.setMaskPixels(rr, cc, True)
 
         elif self.mode == 'grabcut':
-            # Get image from scene
-            im = self.getImageItem().image 
+            j0, i0 = int(self.rectangle[0]), int(self.rectangle[1])
+            j1, i1 = j0 + int(self.rectangle[2]), i0 + int(self.rectangle[3])
+
+            # For tiled frames, only use the image around the drawn rectangle,
+            #  the margin provides the background model for GrabCut
+            if self.tiled:
+                mi, mj = max((i1-i0) // 2, 10), max((j1-j0) // 2, 10)
+                oi, oj = max(i0-mi, 0), max(j0-mj, 0)
+                im = self.im[oi:i1+mi, oj:j1+mj]
+
+            else:
+                oi, oj = 0, 0
+                im = self.im
+
+            levels = self.ui.histogram.getLevels()
+            f = proxy.proxy_factor(im.shape, proxy.GRABCUT_PROXY_PIXELS) if self.proxyEditing else 1
+
+            # Immediate result on a proxy of the crop, refined at full resolution in the background
+            if f > 1:
+                coarse = proxy.upsample(proxy.proxy_grabcut(im, f, (j0-oj, i0-oi, j1-j0, i1-i0), levels),
+                                        f, im.shape)
+
+                if coarse is not None:
+                    mask, (ci, cj) = coarse
+                    self.commitProxy(mask, (ci+oi, cj+oj), f, True,
+                                     lambda im, c, o: proxy.refine_grabcut(im, c, o, f, levels),
+                                     width=2*f)
 
-            # Apply GrabCut algorithm using drawn rectangle as initialization
-            mask = GrabCut(im, 
-                (self.rectangle[1], self.rectangle[0], self.rectangle[3], self.rectangle[2]))
+            else:
+                # Apply GrabCut algorithm using drawn rectangle as initialization
+                mask = GrabCut(im, 
+                    (j0-oj, i0-oi, j1-j0, i1-i0),
+                    levels=levels)
 
-            # Update mask
-            self.mask[mask] = self.colorMask
+                # Update mask
+                rr, cc = np.nonzero(mask)
+                self.setMaskPixels(rr+oi, cc+oj, True)
 
         else:
             return
 
         # Update mask
-        self.maskItem.setImage(self.mask)
+        self.updateMask()
 
         # Reset polygon for next drawing
         self.xys = []
@@ -472,34 +875,103 @@ class PipraImageView(pg.ImageView):
         Returns:
             numpy.ndarray: binary mask at current location
         """
-        return self.mask.sum(2) > 0
+        # Masks are only stored at full resolution
+        self.applyRefinements(wait=True)
+
+        return self.mask.to_array() if self.tiled else self.mask.copy()
 
-    def setZ(self, im, mask=None):
+    def setZ(self, im, mask=None, autoRange=False, histogram=None):
         """Show image at position z. 
 
         Args:
             im (numpy.ndarray): The image to be shown
             mask (numpy.ndarray, optional): If already a mask exists, 
                 otherwise it will be initialized with zeros. Defaults to None.
+            autoRange (bool, optional): Show whole image and adjust levels. Defaults to False.
+            histogram (tuple, optional): Cached histogram of `im` (bins, counts),
+                the histogram is not recomputed when changing the image. Defaults to None.
         """
-        # Set image
-        self.setImage(im, autoRange=False, autoLevels=False)
+        self.im = im
+        self.proxyImage = None
 
         # Clean history
         self.history = []
+        self.resetComponents()
         self.shape = im.shape[:2]
 
-        # Create new mask
-        self.mask = np.zeros(self.shape + (4,), dtype=np.uint8)
+        # Large frames are rendered tile by tile
+        self.tiled = self.tiledOption
+        
+        if self.tiled is None:
+            self.tiled = self.shape[0] * self.shape[1] > TILED_PIXELS
 
-        # If mask is provided, paint foreground pixels
-        if mask is not None:
-            self.mask[mask] = self.colorMask
+        if self.tiled:
+            # Tiles are keyed by the id of the image, which may be reused by the next frame
+            self.tileCache.clear()
+            self.tiledImage = TiledImage(im, cache=self.tileCache)
+
+            # Start with the whole, subsampled frame
+            shown, r = self.tiledImage.region(self.tiledImage.levels-1, 0, self.shape[0], 0, self.shape[1])
+
+            self.mask = TiledMask.from_array(mask) if mask is not None else TiledMask(self.shape)
+
+        else:
+            shown, r = im, None
+
+            # Create new mask
+            self.mask = np.zeros(self.shape, dtype=bool)
+
+            # If mask is provided, copy foreground pixels
+            if mask is not None:
+                self.mask[:, :] = mask
+
+        # Set image, levels are only adjusted when asked for
+        if autoRange:
+            self.setImage(shown, autoRange=False, autoLevels=True)
+
+        else:
+            self.image, self.imageDisp = shown, None
+            self.getImageItem().setImage(shown, autoLevels=False)
+
+        if r is not None:
+            self.setRect(self.getImageItem(), *r)
+
+        else:
+            self.getImageItem().resetTransform()
+            self.maskItem.resetTransform()
+
+        if histogram is not None:
+            self.setHistogram(*histogram)
+
+        if autoRange:
+            self.getView().setRange(QRectF(0, 0, self.shape[1], self.shape[0]), padding=0)
 
         # Show mask image and force paint event
-        self.maskItem.setImage(self.mask)
+        self.updateMask()
         self.paint()
 
+    def showPreview(self, im, shape):
+        """Shows a downsampled image stretched to its full resolution shape,
+        e.g. while scrubbing through the stack. The mask is hidden.
+
+        Args:
+            im (numpy.ndarray): The downsampled image
+            shape (tuple): Full resolution shape of the image
+        """
+        self.getImageItem().setImage(im, autoLevels=False)
+        self.setRect(self.getImageItem(), 0, shape[0], 0, shape[1])
+
+        self.maskItem.setImage(np.zeros((1, 1), dtype=np.uint8), levels=(0, 255), lut=self.maskLut())
+
+    def setHistogram(self, bins, counts):
+        """Shows a (cached) histogram in the levels widget
+
+        Args:
+            bins (numpy.ndarray): Bin positions
+            counts (numpy.ndarray): Counts per bin
+        """
+        self.ui.histogram.item.plot.setData(bins, counts)
+
     def setColor(self, colorCursor=None, colorMask=None, colorOthers=None, colorBlack=None):
         """Set color for cursor, mask, others and black.
         Colors need to be specified in RGBA (0...255).
@@ -523,7 +995,7 @@ class PipraImageView(pg.ImageView):
             self.colorBlack = colorBlack
 
         # Draw again the scene with new colors
-        self.mask[self.mask.sum(2) > 0] = self.colorMask
+        self.updateMask()
         self.paint()
 
 
@@ -531,7 +1003,13 @@ class PipraImageView(pg.ImageView):
 ## PipraStack (central widget in QMainWindow)
 #############################################
 class PipraStack(QWidget):
-    def __init__(self, stack, mask=None, is_folder=False):
+    histogramReady = pyqtSignal(int)
+    thumbnailReady = pyqtSignal(int)
+    superpixelReady = pyqtSignal(int)
+    levelsReady = pyqtSignal(float, float)
+    message = pyqtSignal(str)
+
+    def __init__(self, stack, mask=None, is_folder=False, fn_thumbnails=None):
         """Stack(QWidget)
 
         The `PipraStack` class carries the whole image stack and the respective masks.
@@ -539,8 +1017,9 @@ class PipraStack(QWidget):
 
         Args:
             stack (list or numpy.ndarray): The image stack
-            mask (numpy.ndarray, optional): The corresponding masks to the image stack. Defaults to None.
+            mask (MaskVolume, RaggedMasks or numpy.ndarray, optional): The corresponding masks to the image stack. Defaults to None.
             is_folder (bool, optional): If the image stack is derived from a folder. Defaults to False.
+            fn_thumbnails (str, optional): File to load and store thumbnails, e.g. next to the `.mask` file. Defaults to None.
         """
         super().__init__()
 
@@ -551,12 +1030,16 @@ class PipraStack(QWidget):
         if mask is None:
             # Create N masks for images in folder
             if is_folder:
-                self.mask = [np.zeros(im.shape[:2], dtype=np.bool) for im in stack]
+                self.mask = RaggedMasks([im.shape[:2] for im in stack])
 
-            # Create 1 mask for 3D stack (t, x, y) or (z, x, y)
+            # Create 1 compressed mask volume for 3D stack (t, y, x) or (z, y, x)
             else:
-                self.mask = np.zeros(stack.shape[:3], dtype=np.bool)
-            
+                self.mask = MaskVolume(stack.shape[:3])
+
+        # Compress dense masks
+        elif isinstance(mask, np.ndarray):
+            self.mask = MaskVolume.from_array(mask)
+
         else:
             # Use provided mask
             self.mask = mask
@@ -564,6 +1047,47 @@ class PipraStack(QWidget):
         self.curId = 0
         self.listActive = False
 
+        # Frames used for interpolation and undo steps of changes across frames
+        self.keyframes = set()
+        self.history = []
+
+        # Frames to review, e.g. where annotators disagree
+        self.review = []
+
+        # Connection to a session shared with other annotators, see `setSession`
+        self.session = None
+        self.sessionTimer = QTimer(singleShot=True, interval=100)
+        self.sessionTimer.timeout.connect(lambda: self.session is not None and self.session.flush())
+
+        # Append-only journal of mask edits to recover them after a crash, see `pipra.journal`
+        self.journal = None
+        self.journalTimer = QTimer(singleShot=True, interval=100)
+        self.journalTimer.timeout.connect(lambda: self.journal is not None and self.journal.flush())
+
+        # Annotated frames, updated whenever a mask is stored
+        self.occupancy = self.mask.occupancy()
+
+        # Changes of the mask in the ImageView, e.g. to skip writing an unchanged resume file
+        self.maskVersion = 0
+        self.resumeCodes = {}
+
+        # Per-frame statistics, updated from the strokes in the ImageView
+        self.stats = MaskStats(self.mask)
+        self.statsWindow = None
+
+        # Per-frame histograms, computed in background
+        self.histograms = HistogramCache(self.stack, callback=self.histogramReady.emit)
+        self.histogramReady.connect(self.showHistogram)
+
+        # Downsampled frames for previews, computed in background
+        self.thumbnails = ThumbnailCache(self.stack, callback=self.thumbnailReady.emit)
+        self.thumbnails.build(fn_thumbnails)
+        self.previewing = False
+
+        # Superpixels of frames shown in superpixel mode, computed in background
+        self.superpixels = SuperpixelCache(self.stack, callback=self.superpixelReady.emit)
+        self.superpixelReady.connect(self.showSuperpixels)
+
         # Use an ImageView to show the ACTIVE image in stack
         self.w = PipraImageView(self.stack[self.curId],
                            self.mask[self.curId],
@@ -585,29 +1109,72 @@ class PipraStack(QWidget):
 
         self.z.setValue(0)
         self.z.setSingleStep(1)
-        self.z.valueChanged.connect(self.changeZ)
+
+        # Coalesce slider changes, only the latest target frame is rendered
+        self.scrubTimer = QTimer(singleShot=True, interval=0)
+        self.scrubTimer.timeout.connect(self.scrub)
+        self.z.valueChanged.connect(self.scrubTimer.start)
+        self.z.sliderReleased.connect(self.scrubTimer.start)
+        self.thumbnailReady.connect(self.scrubTimer.start)
 
         # Listen to signals from other the pyqtgraph widget and the custom Image Item
         self.w.keyPressSignal.connect(self.keyPress)
+        self.w.maskChanged.connect(lambda rr, cc, before, value: self.stats.update(self.curId, rr, cc, before, value))
+        self.w.maskReplaced.connect(lambda: self.stats.compute(self.curId, self.w.getMask(), components=False))
+        self.stats.setLive(self.curId, self.mask[self.curId], self.w.componentIndex)
+        self.w.maskChanged.connect(self.sendStroke)
+        self.w.maskReplaced.connect(lambda: self.sendMasks({self.curId: self.w.getMask()}))
+        self.w.maskChanged.connect(self.journalStroke)
+        self.w.maskChanged.connect(self.countChange)
+        self.w.maskReplaced.connect(self.countChange)
+        self.w.maskReplaced.connect(lambda: self.journalMasks({self.curId: self.w.getMask()}))
         self.w.maskItem.wheel_change.connect(self.wheelChange)
         self.w.maskItem.mouseRelease.connect(self.w.mouseReleaseEvent)
+        self.levelsReady.connect(self.w.setLevels)
 
         self.l.addWidget(QLabel("z position"), 1, 0)
         self.l.addWidget(self.z, 1, 1)
 
+        # Overview of all frames, click on thumbnail to show frame
+        self.filmstripModel = FilmstripModel(self.thumbnails, 
+                                             self.occupancy, 
+                                             levels=self.w.ui.histogram.getLevels,
+                                             keyframes=self.keyframes,
+                                             parent=self)
+        self.filmstrip = Filmstrip(self.filmstripModel, parent=self)
+        self.filmstrip.clicked.connect(lambda index: self.z.setValue(index.row()))
+        self.thumbnailReady.connect(self.filmstripModel.updateFrame)
+        self.w.ui.histogram.item.sigLevelChangeFinished.connect(self.filmstrip.viewport().update)
+
+        self.l.addWidget(self.filmstrip, 2, 0, 1, 2)
+
         self.setLayout(self.l)
 
+    def scrub(self):
+        """Shows the latest target frame of the slider. While dragging the slider,
+        a downsampled preview is shown, and the full resolution frame when it settles.
+        """
+        if self.z.isSliderDown():
+            preview = self.thumbnails.preview(self.z.value())
+            self.filmstrip.setCurrentFrame(self.z.value())
+
+            if preview is not None:
+                self.w.showPreview(*preview)
+                self.previewing = True
+
+        elif self.previewing or self.z.value() != self.curId:
+            self.previewing = False
+            self.changeZ()
+
     def changeZ(self):
         """Slot for a change in `z` or `t` along the image stack. 
         Saves the current state and updates the image in the ImageView environment.
         """
         # Save current mask
-        self.mask[self.curId] = self.w.getMask()
+        self.storeMask()
 
         # Save current view state (zoom, position, ...)
         viewBoxState = self.w.getView().getState()
-        # Save current levels
-        levels = self.w.getImageItem().levels
 
         # New image position
         self.curId = self.z.value()
@@ -620,13 +1187,160 @@ class PipraStack(QWidget):
         else:
             self.curId = min(self.curId, self.stack.shape[0])
 
-        # Set the new image
+        # Set the new image with its cached histogram,
+        #  levels are kept across frames
         im = self.stack[self.curId]
 
-        self.w.setZ(im, self.mask[self.curId])
+        self.w.setZ(im, self.mask[self.curId], histogram=self.histograms.get(self.curId))
+        self.stats.setLive(self.curId, self.mask[self.curId], self.w.componentIndex)
+        self.histograms.request(self.curId-1, self.curId+1)
+        self.showSuperpixels(self.curId)
 
         self.w.getView().setState(viewBoxState)
-        self.w.getImageItem().setLevels(levels)
+        self.filmstrip.setCurrentFrame(self.curId)
+
+    def storeMask(self, i=None, mask=None):
+        """Stores a mask in the stack and updates the annotated/empty state of the frame.
+
+        Args:
+            i (int, optional): Frame index, current frame if None. Defaults to None.
+            mask (numpy.ndarray, optional): The mask, mask of the ImageView if None. Defaults to None.
+        """
+        if i is None:
+            i = self.curId
+
+        # Statistics of the current frame are updated with every stroke
+        if mask is not None:
+            self.stats.compute(i, mask)
+
+            if self.statsWindow is not None:
+                self.statsWindow.scheduleRefresh()
+
+        else:
+            mask = self.w.getMask()
+
+        self.mask[i] = mask
+        self.occupancy[i] = mask.any()
+        self.filmstripModel.updateFrame(i)
+
+    def showHistogram(self, i):
+        """Shows the histogram of frame `i` once it is computed
+
+        Args:
+            i (int): Frame index
+        """
+        if i == self.curId:
+            self.w.setHistogram(*self.histograms[i])
+
+    def showSuperpixels(self, i):
+        """Passes the superpixels of frame `i` to the ImageView if it is shown.
+        In superpixel mode, they are requested for the shown and the neighbouring frames.
+
+        Args:
+            i (int): Frame index
+        """
+        if i != self.curId:
+            return
+
+        if self.w.mode == 'superpixel':
+            self.superpixels.request(i, i-1, i+1)
+
+        self.w.superpixelIndex = self.superpixels.results.get(i)
+
+    def setStackLevels(self):
+        """Sets levels for the whole stack, estimated from percentiles
+        of subsampled frames in the background.
+        """
+        self.histograms.levels().add_done_callback(lambda f: self.levelsReady.emit(*f.result()))
+
+    def stackBytes(self):
+        """Memory of the decoded image data in bytes, memory-mapped and on-demand decoded data takes none"""
+        if isinstance(self.stack, list):
+            return nbytes([im for im in self.stack if not isinstance(im, np.memmap)])
+
+        if isinstance(self.stack, np.ndarray) and not isinstance(self.stack, np.memmap):
+            return self.stack.nbytes
+
+        return 0
+
+    def setStackData(self, stack):
+        """Replaces the image data, e.g. with a memory-mapped copy of the same data
+
+        Args:
+            stack (numpy.ndarray): The image stack, same shape as before
+        """
+        self.stack = stack
+
+        for cache in (self.histograms, self.thumbnails, self.superpixels):
+            cache.stack = stack
+
+        self.w.im = stack[self.curId]
+
+        if self.w.tiled:
+            self.w.tileCache.clear()
+            self.w.tiledImage = TiledImage(self.w.im, cache=self.w.tileCache)
+
+    def extendStack(self, stack):
+        """Continues with further frames of a stack that is being opened, see `pipra.loader.StackLoader`
+
+        Args:
+            stack (numpy.ndarray or list): The image stack, the frames shown so far are unchanged
+        """
+        self.stack = stack
+
+        for cache in (self.histograms, self.thumbnails, self.superpixels):
+            cache.stack = stack
+
+        self.z.setMaximum(len(stack)-1)
+
+    def registerMemory(self, memory, spill=None):
+        """Registers image data, masks, undo histories and caches of the stack with a memory manager.
+        All consumers are named `stack:...`.
+
+        Args:
+            memory (MemoryManager): The memory manager
+            spill (callable, optional): Moves the decoded image data to disk, called with the stack
+                and returns the freed bytes. Image data is only accounted if None. Defaults to None.
+        """
+        memory.register_cache("stack:tiles", self.w.tileCache, PRIORITY_CACHE)
+        memory.register_cache("stack:superpixels", self.superpixels.results, PRIORITY_EXPENSIVE_CACHE)
+
+        if isinstance(self.stack, VideoStack):
+            memory.register_cache("stack:decoded video frames", self.stack.cache, PRIORITY_CACHE)
+
+        if isinstance(self.mask, MaskVolume):
+            memory.register_cache("stack:decoded masks", self.mask.hot, PRIORITY_CACHE)
+
+        # The undo history of the view is replaced when changing frames
+        memory.register("stack:undo history",
+                        lambda: nbytes(self.w.history),
+                        lambda max_bytes: shrink_list(self.w.history, max_bytes),
+                        PRIORITY_HISTORY)
+        memory.register("stack:undo history across frames",
+                        lambda: nbytes(self.history),
+                        lambda max_bytes: shrink_list(self.history, max_bytes),
+                        PRIORITY_HISTORY)
+
+        # The component index is rebuilt when needed
+        def dropComponents(max_bytes):
+            freed = nbytes(self.w.components)
+
+            if freed <= max_bytes:
+                return 0
+
+            self.w.resetComponents()
+            return freed
+
+        memory.register("stack:component index", lambda: nbytes(self.w.components), dropComponents,
+                        PRIORITY_EXPENSIVE_CACHE)
+
+        memory.register("stack:masks", lambda: self.mask.nbytes + nbytes([self.w.mask, self.w.currentCursor]))
+        memory.register_cache("stack:thumbnails", self.thumbnails.results, PRIORITY_CACHE)
+        memory.register("stack:histograms", lambda: nbytes(self.histograms.results))
+        memory.register("stack:image data",
+                        self.stackBytes,
+                        None if spill is None else lambda max_bytes: spill(self),
+                        PRIORITY_DATA)
 
     def wheelChange(self, direction):
         """Change z or t signal depending on wheel direction
@@ -634,7 +1348,7 @@ class PipraStack(QWidget):
         Args:
             direction (int): Wheel direction (up or down)
         """
-        self.z.setValue(self.curId+direction)
+        self.z.setValue(self.z.value()+direction)
 
     def keyPress(self, key):
         """Shortcuts for efficient interaction with `pipra`.
@@ -646,61 +1360,575 @@ class PipraStack(QWidget):
 
         # WASD for +1 -1 -1 +1
         if key == Qt.Key_D or key == Qt.Key_W:
-            self.z.setValue(self.curId+1)
+            self.z.setValue(self.z.value()+1)
 
         elif key == Qt.Key_A or (key == Qt.Key_S and modifiers != Qt.ControlModifier):
-            self.z.setValue(self.curId -1)
+            self.z.setValue(self.z.value()-1)
 
         # Copy mask from previous (-1) mask
         elif key == Qt.Key_C:
-            if self.mask[self.curId].sum() == 0:
-                if self.curId > 0 and modifiers != Qt.ShiftModifier:
-                    # Replace mask
-                    m = self.mask[self.curId-1]
+            if not self.w.getMask().any():
+                # Replace mask with previous or, with SHIFT, next mask
+                j = self.curId+1 if modifiers == Qt.ShiftModifier else self.curId-1
 
-                if self.curId < self.mask.shape[0]-1 and modifiers == Qt.ShiftModifier:
-                    m = self.mask[self.curId+1]
+                # Frames in folders may differ in size
+                if not 0 <= j < len(self.mask) or self.mask[j].shape != self.w.shape:
+                    return
 
-                self.mask[self.curId] = m
-                # Get the state (i.e. position, zoom, ...)
-                viewBoxState = self.w.getView().getState()
-                levels = self.w.getImageItem().levels
+                # Like other changes of whole frames, sent to the session, journaled and undoable
+                self.replaceMasks({self.curId: np.array(self.mask[j])})
 
-                # Set new mask
-                self.w.setZ(self.stack[self.curId], self.mask[self.curId])
+        # Superpixel mode, the ImageView changes the mode after this signal
+        elif key == Qt.Key_U:
+            self.superpixels.request(self.curId)
+            self.showSuperpixels(self.curId)
 
-                # Set view again
-                self.w.getView().setState(viewBoxState)
-                self.w.getImageItem().setLevels(levels)
+        # Toggle keyframe for interpolation
+        elif key == Qt.Key_K:
+            self.toggleKeyframe()
 
-    def getMasks(self):
-        """Saves the current mask and returns all masks.
+        # Interpolate masks between keyframes
+        elif key == Qt.Key_I:
+            self.interpolate()
 
-        Returns:
-            numpy.ndarray: The masks
-        """
-        self.mask[self.curId] = self.w.getMask()
-        return self.mask
+        # Undo changes across frames, e.g. interpolation
+        elif key == Qt.Key_Z and modifiers == (Qt.ControlModifier | Qt.ShiftModifier):
+            self.undo()
 
-##########################
-## Main Window
-##########################
-class PipraMain(QMainWindow):
-    def __init__(self):
-        super().__init__()
-        self.settings_fn = None
-        self.status = self.statusBar()
-        self.menu = self.menuBar()
+        # Next or, with SHIFT, previous frame to review
+        elif key == Qt.Key_N:
+            self.nextReview(-1 if modifiers == Qt.ShiftModifier else 1)
+
+    def reloadMask(self):
+        """Shows the stored mask of the current frame, e.g. after it was replaced."""
+        # Get the state (i.e. position, zoom, ...)
+        viewBoxState = self.w.getView().getState()
+
+        # Set new mask
+        self.w.setZ(self.stack[self.curId], self.mask[self.curId], 
+                    histogram=self.histograms.get(self.curId))
+
+        # Set view again
+        self.w.getView().setState(viewBoxState)
+        self.countChange()
+
+    def countChange(self, *args):
+        """Counts changes of the mask in the ImageView, see `resumeKey`"""
+        self.maskVersion += 1
+
+    def replaceMasks(self, masks):
+        """Replaces the masks of several frames as a single undo step.
+
+        Args:
+            masks (dict or EncodedMasks): New masks by frame index, decoded one at a time
+        """
+        if not masks:
+            return
+
+        self.storeMask()
+
+        # Previous masks are kept compressed
+        self.history.append({i: (encode(self.mask[i]), self.mask[i].shape) for i in masks})
+
+        for i, m in masks.items():
+            self.storeMask(i, m)
+
+        self.sendMasks(masks)
+        self.journalMasks(masks)
+
+        if self.curId in masks:
+            self.reloadMask()
+
+    def undo(self):
+        """Reverts the last change across frames, see `replaceMasks`."""
+        if not self.history:
+            return
+
+        self.storeMask()
+
+        masks = {i: decode(code, shape) for i, (code, shape) in self.history.pop().items()}
+
+        for i, m in masks.items():
+            self.storeMask(i, m)
+
+        self.sendMasks(masks)
+        self.journalMasks(masks)
+        self.reloadMask()
+        self.message.emit("Undo across frames")
+
+    def morphology(self, operation, size=1, three_d=False):
+        """Applies a morphological operation to all masks as a single undo step,
+        see `pipra.morphology.apply`.
+
+        Args:
+            operation (str): One of `pipra.morphology.OPERATIONS`
+            size (int, optional): Radius of the structuring element or minimum object size in px. Defaults to 1.
+            three_d (bool, optional): True 3D operation, otherwise frame by frame. Defaults to False.
+        """
+        self.storeMask()
+
+        dialog, progress = self.progressDialog(f"Applying {operation}...")
+        masks = morphology.apply(self.mask, operation, size, three_d, progress=progress)
+        dialog.close()
+
+        if masks is None:
+            self.message.emit(f"Cancelled {operation}")
+            return
+
+        self.replaceMasks(masks)
+        self.message.emit(f"Applied {operation} to {len(masks)} frames")
+
+    def floodfillFrames(self, i0, i1, recenter=False, connected=True):
+        """Floodfill in a range of frames with the last seed, tolerance and settings of the current frame.
+        The filled regions are added to the masks as a single undo step.
+
+        Args:
+            i0 (int): First frame
+            i1 (int): Last frame (inclusive)
+            recenter (bool, optional): Re-center the seed on the previous frame's region. Defaults to False.
+            connected (bool, optional): Floodfill, otherwise threshold relative to the seed intensity. Defaults to True.
+        """
+        if self.w.lastSeed is None:
+            self.message.emit("Set a seed with Ctrl+click first")
+            return
+
+        self.storeMask()
+
+        dialog, progress = self.progressDialog("Flood filling frames...")
+        regions = floodfill_frames(self.stack, 
+                                   range(i0, i1+1), 
+                                   self.w.lastSeed, 
+                                   seed_frame=self.curId,
+                                   recenter=recenter,
+                                   progress=progress,
+                                   tolerance=self.w.tolerance,
+                                   only_darker_px=self.w.only_darker_px,
+                                   levels=self.w.ui.histogram.getLevels(),
+                                   connected=connected)
+        dialog.close()
+
+        if regions is None:
+            self.message.emit("Cancelled flood fill")
+            return
+
+        # Filled frames are kept compressed until they replace the masks
+        masks = EncodedMasks()
+
+        for i, r in regions.items():
+            masks[i] = self.mask[i] | r
+
+        self.replaceMasks(masks)
+        self.message.emit(f"Flood filled {len(regions)} frames")
+
+    def showStats(self):
+        """Shows the statistics window, updated while editing"""
+        if self.statsWindow is None:
+            self.statsWindow = StatsWindow(self.stats, parent=self)
+            self.w.maskChanged.connect(self.statsWindow.scheduleRefresh)
+            self.w.maskReplaced.connect(self.statsWindow.scheduleRefresh)
+            self.z.valueChanged.connect(self.statsWindow.setCurrentFrame)
+
+        self.statsWindow.show()
+        self.statsWindow.raise_()
+
+    def progressDialog(self, text):
+        """Modal progress dialog for long running operations
+
+        Args:
+            text (str): Label of the dialog
+
+        Returns:
+            tuple: The dialog and a progress callback, called with (done, total) and returning False if cancelled
+        """
+        dialog = QProgressDialog(text, "Cancel", 0, 0, self)
+        dialog.setWindowModality(Qt.WindowModal)
+        dialog.setMinimumDuration(500)
+
+        def progress(done, total):
+            dialog.setMaximum(total)
+            dialog.setValue(done)
+            QApplication.processEvents()
+            return not dialog.wasCanceled()
+
+        return dialog, progress
+
+    def toggleKeyframe(self, i=None):
+        """Marks or unmarks a frame as keyframe for interpolation
+
+        Args:
+            i (int, optional): Frame index, current frame if None. Defaults to None.
+        """
+        if i is None:
+            i = self.curId
+
+        self.keyframes.symmetric_difference_update({i})
+        self.filmstripModel.updateFrame(i)
+        self.message.emit(f"Frame {i} is {'a' if i in self.keyframes else 'no'} keyframe")
+
+    def interpolate(self):
+        """Fills the frames between consecutive keyframes by shape interpolation."""
+        if len(self.keyframes) < 2:
+            self.message.emit("Mark at least two keyframes (K) to interpolate")
+            return
+
+        self.storeMask()
+        masks = interpolate_keyframes(self.mask, self.keyframes)
+        self.replaceMasks(masks)
+        self.message.emit(f"Interpolated {len(masks)} frames between {len(self.keyframes)} keyframes")
+
+    def consensus(self, fns, method='majority', threshold=0.8):
+        """Replaces the masks with the consensus of several annotators as a single undo step,
+        frames with a mean Dice below `threshold` are marked for review, see `pipra.consensus.consensus`.
+
+        Args:
+            fns (list): Paths to `.mask` files of the annotators
+            method (str, optional): One of `pipra.consensus.METHODS`. Defaults to 'majority'.
+            threshold (float, optional): Minimum Dice of frames without review. Defaults to 0.8.
+        """
+        self.storeMask()
+
+        dialog, progress = self.progressDialog("Computing consensus...")
+
+        try:
+            result = consensus(fns, method, progress=progress)
+
+        finally:
+            dialog.close()
+
+        if result is None:
+            self.message.emit("Cancelled consensus")
+            return
+
+        masks, table, _ = result
+
+        if len(masks) != len(self.mask) or any(masks[i].shape != self.mask[i].shape for i in range(len(masks))):
+            raise ValueError("The masks of the annotators do not match the image stack")
+
+        # Changed frames are kept compressed until they replace the masks
+        changed = EncodedMasks()
+
+        for i in range(len(masks)):
+            m = masks[i]
+
+            if not np.array_equal(m, self.mask[i]):
+                changed[i] = m
+
+        self.replaceMasks(changed)
+        self.setReview(table['frame'][table['dice'] < threshold])
+        self.message.emit(f"Mean Dice {table['dice'].mean():.3f}, {len(self.review)} frames to review (N)")
+
+    def setReview(self, frames):
+        """Sets the frames to review, visited with N and SHIFT+N
+
+        Args:
+            frames (iterable): Frame indices
+        """
+        self.review = sorted(int(i) for i in frames if 0 <= i < len(self.mask))
+
+    def nextReview(self, direction=1):
+        """Shows the next (1) or previous (-1) frame to review"""
+        ahead = [i for i in self.review if (i - self.curId) * direction > 0]
+
+        if not ahead:
+            self.message.emit("No more frames to review")
+            return
+
+        self.z.setValue(min(ahead, key=lambda i: abs(i - self.curId)))
+
+    def setSession(self, session):
+        """Joins a session shared with other annotators, the masks of the session replace the own masks.
+
+        Args:
+            session (SessionClient or None): Connection to the session server, None to leave
+        """
+        left = self.session is not None and session is None
+        self.session = session
+
+        # Frames changed in the session were not journaled, the journal continues with all masks
+        if left and self.journal is not None:
+            self.journal.rewrite(self.getMasks())
+
+        if session is None:
+            return
+
+        if len(session.shapes) != len(self.mask) or \
+                any(tuple(s) != self.mask[i].shape for i, s in enumerate(session.shapes)):
+            self.session = None
+            raise ValueError("The masks of the session do not match the image stack")
+
+        for i, m in session.masks().items():
+            self.storeMask(i, m)
+
+        self.history = []
+        self.reloadMask()
+
+    def sendStroke(self, rr, cc, before, value):
+        """Streams pixels changed in the current frame to the session"""
+        if self.session is not None:
+            self.session.stroke(self.curId, rr, cc, before, value)
+            self.sessionTimer.start()
+
+    def sendMasks(self, masks):
+        """Sends replaced masks to the session
+
+        Args:
+            masks (dict): New masks by frame index
+        """
+        if self.session is not None:
+            for i, m in masks.items():
+                self.session.set_frame(i, m)
+
+    def setJournal(self, journal, discard=False):
+        """Records all following mask edits in a journal, see `pipra.journal.Journal`
+
+        Args:
+            journal (Journal or None): The journal, None to stop recording
+            discard (bool, optional): Deletes the previous journal, e.g. if the user discarded unsaved edits.
+                Otherwise it is kept to recover them. Defaults to False.
+        """
+        if self.journal is not None:
+            if discard:
+                self.journal.discard()
+
+            else:
+                self.journal.close()
+
+        self.journal = journal
+
+    def journalStroke(self, rr, cc, before, value):
+        """Records pixels changed in the current frame, masks of a session are persisted by the server"""
+        if self.journal is not None and self.session is None:
+            self.journal.stroke(self.curId, self.w.shape, rr, cc, before, value)
+            self.journalTimer.start()
+
+    def journalMasks(self, masks):
+        """Records replaced masks
+
+        Args:
+            masks (dict): New masks by frame index
+        """
+        if self.journal is not None and self.session is None:
+            for i, m in masks.items():
+                self.journal.set_frame(i, np.asarray(m))
+
+    def applySessionEvent(self, event):
+        """Shows changes of other annotators, see `SessionClient`
+
+        Args:
+            event (tuple): Event of the session server
+        """
+        kind, i = event[:2]
+
+        if kind == 'delta':
+            _, _, idx, value, client = event
+
+            # Strokes in the current frame are drawn without resetting the own undo history
+            if i == self.curId:
+                rr, cc = np.unravel_index(idx, self.w.shape)
+                before = self.w.mask[rr, cc]
+                self.w.mask[rr, cc] = value
+                self.w.updateMask()
+                self.stats.update(i, rr, cc, before, value)
+                self.countChange()
+
+                if self.w.components is not None:
+                    self.w.components.update(rr, cc, before, value)
+
+            else:
+                m = np.array(self.mask[i])
+                m.flat[idx] = value
+                self.storeMask(i, m)
+
+        elif kind in ('set', 'reject'):
+            self.storeMask(i, decode(event[2], self.mask[i].shape))
+
+            if i == self.curId:
+                self.reloadMask()
+
+            if kind == 'reject':
+                owner = self.session.owner(i)
+                self.message.emit(f"Frame {i} is locked by {owner}" if owner else f"Lock frame {i} to edit it")
+
+    def resumeKey(self):
+        """Changes whenever the state of `resumeState` changes, computed without copying any mask
+
+        Returns:
+            tuple: Frame, view, levels, tool settings, number of mask changes and the undo steps
+        """
+        return (self.curId, np.array(self.w.getView().viewRange()).tobytes(),
+                np.array(self.w.ui.histogram.getLevels()).tobytes(), self.w.radius, self.w.mode,
+                float(self.w.tolerance), bool(self.w.only_darker_px), self.maskVersion,
+                tuple(map(id, self.w.history)), tuple(map(id, self.history)))
+
+    def resumeState(self):
+        """Current frame, view, levels, tool settings and undo histories, see `pipra.resume.save_resume`.
+        Nothing in the state changes afterwards, such that it can be written in the background.
+
+        Returns:
+            dict: The state with a copy of the current mask (dense or tiled) and the encoded undo history
+        """
+        self.w.applyRefinements(wait=True)
+
+        # Masks in the undo history do not change, each is encoded once and kept with its mask
+        self.resumeCodes = {id(m): self.resumeCodes.get(id(m)) or (m, encode(m.to_array() if self.w.tiled else m))
+                            for m in self.w.history}
+
+        return {'frame': self.curId,
+                'view_range': np.array(self.w.getView().viewRange(), dtype=np.float64),
+                'levels': np.array(self.w.ui.histogram.getLevels(), dtype=np.float64),
+                'radius': self.w.radius,
+                'mode': self.w.mode,
+                'tolerance': float(self.w.tolerance),
+                'only_darker_px': bool(self.w.only_darker_px),
+                'mask': self.w.mask.copy(),
+                'history': [self.resumeCodes[id(m)][1] for m in self.w.history],
+                'steps': list(self.history)}
+
+    def restoreState(self, state):
+        """Continues where a previous session stopped, see `resumeState`.
+        Undo steps of the current frame are only restored if its mask is unchanged since.
+
+        Args:
+            state (dict): The state, see `pipra.resume.load_resume`
+        """
+        frame = state['frame']
+
+        if not 0 <= frame < len(self.mask):
+            return
+
+        self.z.setValue(frame)
+        self.changeZ()
+
+        (x0, x1), (y0, y1) = state['view_range']
+        self.w.getView().setRange(xRange=(x0, x1), yRange=(y0, y1), padding=0)
+        self.w.setLevels(*state['levels'])
+
+        self.w.radius = int(state['radius'])
+        self.w.tolerance = state['tolerance']
+        self.w.only_darker_px = bool(state['only_darker_px'])
+
+        if state['mode'] == 'outline':
+            self.w.enableOutline()
+
+        elif state['mode'] == 'grabcut':
+            self.w.enableGrabCut()
+
+        self.w.mode = state['mode']
+
+        # The superpixel brush needs the superpixels of the frame, requested when switching to it
+        if self.w.mode == 'superpixel':
+            self.showSuperpixels(frame)
+
+        if np.array_equal(state['mask'], self.mask[frame]):
+            self.w.history = [TiledMask.from_array(m) if self.w.tiled else m for m in state['history']]
+
+        # Undo steps across frames replace whole frames, they only need to fit the stack
+        if all(0 <= i < len(self.mask) and shape == frame_shape(self.mask, i)
+               for step in state['steps'] for i, (_, shape) in step.items()):
+            self.history = state['steps']
+
+    def getMasks(self):
+        """Saves the current mask and returns all masks.
+
+        Returns:
+            MaskVolume or RaggedMasks: The masks
+        """
+        self.storeMask()
+        return self.mask
+
+class BatchFloodfillDialog(QDialog):
+    def __init__(self, current, n, parent=None):
+        """Dialog to select the frame range and options for batch flood filling
+
+        Args:
+            current (int): Current frame, the default range starts here
+            n (int): Number of frames
+            parent (QWidget, optional): Parent widget. Defaults to None.
+        """
+        super().__init__(parent)
+        self.setWindowTitle("Batch flood fill")
+
+        self.first = QSpinBox()
+        self.first.setRange(0, n-1)
+        self.first.setValue(current)
+
+        self.last = QSpinBox()
+        self.last.setRange(0, n-1)
+        self.last.setValue(n-1)
+
+        self.recenter = QCheckBox("Re-center seed on previous frame's region")
+        self.recenter.setChecked(True)
+        self.threshold = QCheckBox("Threshold (not only connected pixels)")
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+
+        l = QFormLayout()
+        l.addRow("First frame", self.first)
+        l.addRow("Last frame", self.last)
+        l.addRow(self.recenter)
+        l.addRow(self.threshold)
+        l.addRow(buttons)
+        self.setLayout(l)
+
+##########################
+## Main Window
+##########################
+class PipraMain(QMainWindow):
+    sessionEvent = pyqtSignal(object)
+    loadEvent = pyqtSignal(object, object)
+
+    def __init__(self):
+        super().__init__()
+        self.settings_fn = None
+        self.status = self.statusBar()
+        self.menu = self.menuBar()
 
         self.file = self.menu.addMenu("&File")
         self.file.addAction("Open file", self.open, QKeySequence("Ctrl+O"))
         self.file.addAction("Open folder", self.openFolder)
-        self.file.addAction("Save", self.save, QKeySequence("Ctrl+S"))
+        self.saveAction = self.file.addAction("Save", self.save, QKeySequence("Ctrl+S"))
         self.file.addSeparator()
         self.file.addAction("Export mask", self.export, QKeySequence("Ctrl+E"))
         self.file.addSeparator()
         self.file.addAction("Close", self.close)
 
+        self.masks = self.menu.addMenu("&Masks")
+        self.masks.setDisabled(True)
+
+        for operation in morphology.OPERATIONS:
+            self.masks.addAction(operation.capitalize(), lambda op=operation: self.applyMorphology(op))
+
+        self.masks.addSeparator()
+        self.masks.addAction("Batch flood fill", self.batchFloodfill)
+        self.masks.addSeparator()
+        self.morphology3D = QAction("3D operations", self, checkable=True)
+        self.masks.addAction(self.morphology3D)
+        self.masks.addAction("Undo across frames", lambda: self.stack.undo())
+        self.masks.addSeparator()
+        self.masks.addAction("Statistics", lambda: self.stack.showStats())
+        self.masks.addAction("Keep only selected component", lambda: self.stack.w.keepComponent())
+        self.masks.addSeparator()
+        self.masks.addAction("Consensus of annotators", self.consensus)
+        self.masks.addAction("Open review list", self.openReview)
+        self.masks.addAction("Export review list", self.exportReview)
+
+        # Several annotators share the masks of a stack, see `pipra.session`
+        self.sessionMenu = self.menu.addMenu("S&ession")
+        self.sessionMenu.setDisabled(True)
+        self.sessionMenu.addAction("Host session", self.hostSession)
+        self.sessionMenu.addAction("Join session", self.joinSession)
+        self.sessionMenu.addSeparator()
+        self.sessionMenu.addAction("Lock frames", self.lockFrames)
+        self.sessionMenu.addAction("Release locks", self.releaseLocks)
+        self.sessionMenu.addSeparator()
+        self.sessionMenu.addAction("Leave session", self.leaveSession)
+
+        self.server = None
+        self.session = None
+        self.sessionEvent.connect(lambda event: self.stack.applySessionEvent(event))
+
         self.settings = self.menu.addMenu("&Settings")
         self.settings.setDisabled(True)
         self.settings.addAction("Set Mask Color", self.setMaskColor)
@@ -713,6 +1941,37 @@ class PipraMain(QMainWindow):
         self.onlyDarkerPx.triggered.connect(self.setOnlyDarkerPx)
 
         self.settings.addAction(self.onlyDarkerPx)
+
+        self.proxyEditing = QAction("Proxy editing for large frames", self, checkable=True)
+        self.proxyEditing.triggered.connect(self.setProxyEditing)
+
+        self.settings.addAction(self.proxyEditing)
+        self.settings.addSeparator()
+
+        self.stackLevels = QAction("Stack-wide auto levels", self, checkable=True)
+        self.stackLevels.triggered.connect(self.setStackLevels)
+
+        self.settings.addAction(self.stackLevels)
+
+        self.showFilmstrip = QAction("Show filmstrip", self, checkable=True)
+        self.showFilmstrip.setChecked(True)
+        self.showFilmstrip.triggered.connect(self.setFilmstrip)
+
+        self.settings.addAction(self.showFilmstrip)
+        self.settings.addSeparator()
+
+        self.cache = DiskCache()
+        self.useCache = QAction("Cache decoded files", self, checkable=True)
+        self.useCache.setChecked(True)
+
+        self.settings.addAction(self.useCache)
+        self.settings.addAction("Set cache size", self.setCacheSize)
+
+        self.randomAccess = QAction("Random access for videos", self, checkable=True)
+        self.randomAccess.setChecked(True)
+
+        self.settings.addAction(self.randomAccess)
+        self.settings.addAction("Set memory budget", self.setMemoryBudget)
         self.settings.addSeparator()
         self.settings.addAction("Save settings", self.saveSettings)
         self.settings.addAction("Load settings", self.loadSettings)
@@ -720,6 +1979,43 @@ class PipraMain(QMainWindow):
         # self.settings.addAction("Change shortcuts", self.changeShortcuts)
         
 
+        # Image data, masks, histories and caches share one memory budget
+        self.memory = MemoryManager()
+        self.memoryLabel = QLabel()
+        self.status.addPermanentWidget(self.memoryLabel)
+
+        self.memoryTimer = QTimer(interval=2000)
+        self.memoryTimer.timeout.connect(self.enforceMemory)
+        self.memoryTimer.start()
+
+        # Files are opened in the background, see `pipra.loader`,
+        #  file names are switched when the first frame is shown
+        self.loader = None
+        self.loaderShown = False
+
+        # Unsaved edits of the current stack are discarded when it is closed, see `open`
+        self.discardEdits = False
+        self.loadEvent.connect(self.applyLoadEvent)
+        self.loadProgress = QProgressBar(maximumWidth=150)
+        self.loadCancel = QPushButton("Cancel")
+        self.loadCancel.clicked.connect(self.cancelLoading)
+        self.status.addPermanentWidget(self.loadProgress)
+        self.status.addPermanentWidget(self.loadCancel)
+        self.loadProgress.hide()
+        self.loadCancel.hide()
+
+        # Frame, view, tool settings and undo histories are written in the background to resume later
+        self.resumeWriter = ThreadPoolExecutor(max_workers=1)
+        self.resumeKey = None
+        self.resumeTimer = QTimer(interval=SAVE_INTERVAL * 1000)
+        self.resumeTimer.timeout.connect(self.saveResume)
+        self.resumeTimer.start()
+
+        # Mask edits are journaled as they happen, synced to disk and compacted into the .mask file periodically
+        self.journalTimer = QTimer(interval=60 * 1000)
+        self.journalTimer.timeout.connect(self.compactJournal)
+        self.journalTimer.start()
+
         self.fn = None
         self.list = None
         self.d = None
@@ -734,17 +2030,474 @@ class PipraMain(QMainWindow):
         if self.stack:
             self.stack.equalize = self.equalize.isChecked()
 
+    def setStackLevels(self):
+        if self.stackLevels.isChecked():
+            self.stack.setStackLevels()
+
+    def fnThumbnails(self):
+        """Thumbnail cache file next to the `.mask` file"""
+        return self.fn_mask[:-len(".mask")] + ".thumbnails"
+
+    def fnResume(self):
+        """Resume file next to the `.mask` file"""
+        return self.fn_mask[:-len(".mask")] + ".resume"
+
+    def fnJournal(self, fn_mask=None):
+        """Journal of mask edits next to the `.mask` file, of the current file if None"""
+        return (fn_mask or self.fn_mask)[:-len(".mask")] + ".journal"
+
+    def compactJournal(self):
+        """Syncs the journal to disk and saves the masks when the journal grew large, see `pipra.journal`"""
+        if self.stack is None or self.stack.journal is None:
+            return
+
+        self.stack.journal.sync()
+
+        if self.stack.journal.nbytes > COMPACT_BYTES and self.loader is None and self.session is None:
+            self.save()
+
+    def saveResume(self, wait=False):
+        """Writes the current frame, view, tool settings and undo histories if they changed, see `pipra.resume`
+
+        Args:
+            wait (bool, optional): Waits until the file is written, e.g. before opening another file. Defaults to False.
+        """
+        if self.stack is None or self.loader is not None or not self.fn:
+            return
+
+        # The mask is final once the refinements of proxy edits are done, only waited for before closing
+        if self.stack.w.refinements and not wait:
+            return
+
+        key = (self.fnResume(), *self.stack.resumeKey())
+
+        if key == self.resumeKey:
+            return
+
+        self.resumeKey = key
+        future = self.resumeWriter.submit(save_resume, self.fnResume(), self.stack.resumeState())
+
+        if wait:
+            try:
+                future.result()
+
+            except OSError as e:
+                print(f"Could not write resume file: \n{e}")
+
+    def restoreResume(self):
+        """Continues at the frame, view, tool settings and undo histories of the last session with this file"""
+        state = load_resume(self.fnResume())
+
+        if state is None:
+            return
+
+        try:
+            self.stack.restoreState(state)
+
+        except Exception as e:
+            print(f"Could not resume: \n{e}")
+            return
+
+        self.onlyDarkerPx.setChecked(self.stack.w.only_darker_px)
+        self.status.showMessage(f"Resumed at frame {self.stack.curId}", 2000)
+
+    def setCacheSize(self):
+        size, ok = QInputDialog.getDouble(self,
+            "Set cache size",
+            f"Maximum size of decoded files in\n{self.cache.directory} [GB]:",
+            self.cache.max_bytes / 2**30,
+            0,
+            10000,
+            1)
+
+        if ok:
+            self.cache.max_bytes = int(size * 2**30)
+            self.cache.evict()
+
+    def setMemoryBudget(self):
+        size, ok = QInputDialog.getDouble(self,
+            "Set memory budget",
+            "Maximum memory of image data, masks, undo histories and caches [GB]:",
+            self.memory.budget / 2**30,
+            0.1,
+            10000,
+            1)
+
+        if ok:
+            self.memory.budget = int(size * 2**30)
+            self.enforceMemory()
+
+    def enforceMemory(self):
+        """Shrinks caches, histories and image data to the memory budget and shows the memory use"""
+        self.memory.enforce()
+        self.memoryLabel.setText(f"Memory: {self.memory.total / 2**30:.2f} / {self.memory.budget / 2**30:.1f} GB")
+
+    def spillStack(self, stack):
+        """Moves the decoded image data of a single file to the disk cache and continues memory-mapped,
+        if caching decoded files is enabled.
+
+        Args:
+            stack (PipraStack): The image stack
+
+        Returns:
+            int: Freed bytes
+        """
+        freed = stack.stackBytes()
+
+        # Frames that are still being decoded are not moved
+        if not freed or not self.fn or not self.useCache.isChecked() or isinstance(stack.stack, list) \
+                or self.loader is not None:
+            return 0
+
+        try:
+            stack.setStackData(self.cache.store(self.fn, stack.stack))
+
+        except OSError as e:
+            print(f"Could not move decoded data to disk: \n{e}")
+            return 0
+
+        self.status.showMessage("Moved image data to disk cache to stay within the memory budget", 2000)
+        return freed
+
+    def setFilmstrip(self):
+        self.stack.filmstrip.setVisible(self.showFilmstrip.isChecked())
+
+    def setStack(self, stack):
+        """Shows a new image stack as central widget
+
+        Args:
+            stack (PipraStack): The image stack
+        """
+        self.closeStack()
+
+        self.stack = stack
+        self.stack.registerMemory(self.memory, spill=self.spillStack)
+        self.setCentralWidget(self.stack)
+        self.stack.z.valueChanged.connect(self.updateStatus)
+        self.stack.message.connect(lambda m: self.status.showMessage(m, 2000))
+        self.masks.setEnabled(True)
+        self.sessionMenu.setEnabled(True)
+
+        self.setStackLevels()
+        self.setFilmstrip()
+        self.setProxyEditing()
+
+    def closeStack(self):
+        """Stops the background work of the current image stack, e.g. before opening another one"""
+        if self.stack is not None:
+            self.stack.histograms.close()
+            self.stack.thumbnails.close()
+            self.stack.superpixels.close()
+            self.stack.w.refiner.shutdown(wait=False)
+
+            if isinstance(self.stack.stack, VideoStack):
+                self.stack.stack.close()
+
+            self.stack.setJournal(None, discard=self.discardEdits)
+
+        self.discardEdits = False
+
+        self.leaveSession()
+        self.memory.unregister("stack:")
+
+    def startLoading(self, loader):
+        """Opens an image stack in the background, the first frame is shown as soon as it is decoded
+
+        Args:
+            loader (StackLoader): The loader, not started yet
+        """
+        self.cancelLoading()
+
+        self.loader = loader
+        self.loaderShown = False
+        loader.callback = lambda event: self.loadEvent.emit(loader, event)
+
+        # The previous stack cannot be edited or saved until it is replaced
+        if self.stack is not None:
+            self.stack.setEnabled(False)
+
+        self.masks.setEnabled(False)
+        self.sessionMenu.setEnabled(False)
+        self.saveAction.setEnabled(False)
+
+        self.loadProgress.setRange(0, 0)
+        self.loadProgress.show()
+        self.loadCancel.show()
+        self.status.showMessage(f"Opening {loader.fn} ...")
+
+        loader.start()
+
+    def cancelLoading(self):
+        """Cancels opening a file. A partially opened stack is closed,
+        the previous stack is kept if the first frame was not shown yet."""
+        if self.loader is None:
+            return
+
+        self.loader.cancel()
+        self.loader = None
+        self.loadProgress.hide()
+        self.loadCancel.hide()
+        self.saveAction.setEnabled(True)
+
+        if self.loaderShown:
+            self.closeStack()
+            self.stack = None
+            self.fn = None
+            self.files = None
+            self.setCentralWidget(QWidget())
+            self.masks.setEnabled(False)
+            self.sessionMenu.setEnabled(False)
+            self.settings.setEnabled(False)
+            self.setWindowTitle("PiPrA")
+
+        elif self.stack is not None:
+            self.discardEdits = False
+            self.stack.setEnabled(True)
+            self.masks.setEnabled(True)
+            self.sessionMenu.setEnabled(True)
+
+        self.status.showMessage("Opening cancelled", 2000)
+
+    def applyLoadEvent(self, loader, event):
+        """Shows the first frame of a stack that is being opened and extends it with the frames decoded since
+
+        Args:
+            loader (StackLoader): The loader that sent the event, events of cancelled loaders are ignored
+            event (tuple): Loading event, see `pipra.loader.StackLoader`
+        """
+        if loader is not self.loader:
+            return
+
+        kind = event[0]
+
+        if kind == 'first':
+            _, stack, mask = event
+
+            # The new file replaces the previous one only now, saving before writes the previous masks
+            self.fn = loader.fn
+            self.fn_mask = loader.fn_mask
+            self.files = loader.files
+            self.setWindowTitle(loader.fn)
+            self.loaderShown = True
+            self.saveAction.setEnabled(True)
+
+            self.setStack(PipraStack(stack, mask, is_folder=loader.files is not None))
+
+            if loader.fn_journal is not None:
+                self.stack.setJournal(Journal(loader.fn_journal, loader.fn_mask))
+
+            # Edits replayed from the journal are not saved yet
+            if loader.recovered:
+                self.stack.w.saved = False
+
+            # Changes across frames wait for all frames
+            self.masks.setEnabled(False)
+            self.sessionMenu.setEnabled(False)
+            self.settings.setEnabled(True)
+
+            if self.settings_fn:
+                self.loadSettings(settings_fn=self.settings_fn)
+
+        elif kind == 'progress':
+            _, stack, total = event
+            self.stack.extendStack(stack)
+            self.loadProgress.setRange(0, total)
+            self.loadProgress.setValue(len(stack))
+            self.status.showMessage(f"Opening {loader.fn}: {len(stack)} / {total} frames", 1000)
+
+        elif kind == 'done':
+            self.stack.setStackData(event[1])
+            self.stack.thumbnails.build(self.fnThumbnails())
+            self.masks.setEnabled(True)
+            self.sessionMenu.setEnabled(True)
+
+            self.loader = None
+            self.loadProgress.hide()
+            self.loadCancel.hide()
+            self.status.showMessage(f"Opened {loader.fn}, recovered {loader.recovered} unsaved edits" if loader.recovered
+                                    else f"Opened {loader.fn}", 5000 if loader.recovered else 2000)
+            self.restoreResume()
+
+        elif kind == 'failed':
+            self.cancelLoading()
+            QMessageBox.critical(self, "Could not load data", f"Could not open\n{loader.fn}\n\n{event[1]}")
+
+    def hostSession(self):
+        """Serves the current masks to other annotators on this machine and joins the session"""
+        if self.server is not None:
+            QMessageBox.information(self, "Host session", f"Already hosting on port {self.server.address[1]}.")
+            return
+
+        try:
+            self.server = SessionServer(self.stack.getMasks().copy(),
+                                        self.fn_mask if self.fn else None,
+                                        self.files).start()
+
+        except OSError as e:
+            QMessageBox.critical(self, "Host session", f"Could not start session server:\n{e}")
+            return
+
+        # Other annotators join with the random key of the session
+        QApplication.clipboard().setText(self.server.authkey.hex())
+        QMessageBox.information(self, "Host session",
+                                f"Serving on port {self.server.address[1]}, annotators join with the key\n\n"
+                                f"{self.server.authkey.hex()}\n\n(copied to the clipboard)")
+
+        self.joinSession(self.server.address, self.server.authkey)
+
+    def joinSession(self, address=None, authkey=None):
+        """Joins a session, the masks of the session replace the own masks
+
+        Args:
+            address (tuple, optional): Host and port of the server, asked for if None. Defaults to None.
+            authkey (bytes, optional): Key of the session, asked for if None. Defaults to None.
+        """
+        if address is None:
+            text, ok = QInputDialog.getText(self, "Join session", "Server (host:port):", text=f"localhost:{DEFAULT_PORT}")
+
+            if not ok:
+                return
+
+            host, _, port = text.rpartition(":")
+            address = host or "localhost", int(port)
+
+        if authkey is None:
+            text, ok = QInputDialog.getText(self, "Join session", "Session key:")
+
+            if not ok:
+                return
+
+            authkey = parse_key(text)
+
+        # The host joins its own server, joining another session stops hosting
+        hosting = self.server is not None and tuple(address) == tuple(self.server.address)
+        self.leaveSession(stopServer=not hosting)
+
+        try:
+            self.session = SessionClient(address, authkey, callback=self.sessionEvent.emit)
+            self.stack.setSession(self.session)
+
+        except (OSError, EOFError, ValueError, AuthenticationError) as e:
+            self.leaveSession()
+            QMessageBox.critical(self, "Join session", f"Could not join session:\n{e}")
+            return
+
+        self.status.showMessage(f"Joined session at {address[0]}:{address[1]}, lock frames to edit them", 2000)
+
+    def lockFrames(self):
+        if self.session is None:
+            QMessageBox.information(self, "Lock frames", "Host or join a session first.")
+            return
+
+        text, ok = QInputDialog.getText(self, "Lock frames", "Frames (first-last):",
+                                        text=f"{self.stack.curId}-{self.stack.curId}")
+
+        if ok:
+            try:
+                i0, i1 = sorted(int(i) for i in text.split("-"))
+
+            except ValueError:
+                QMessageBox.critical(self, "Lock frames", f"Could not read frame range {text}.")
+                return
+
+            locked, owner = self.session.lock(max(i0, 0), min(i1, len(self.stack.mask)-1)).result(timeout=10)
+
+            if locked:
+                self.status.showMessage(f"Locked frames {i0} to {i1}", 2000)
+            else:
+                QMessageBox.information(self, "Lock frames", f"Some frames are locked by {owner}.")
+
+    def releaseLocks(self):
+        if self.session is not None:
+            self.session.unlock(0, len(self.stack.mask)-1)
+
+    def leaveSession(self, stopServer=True):
+        """Leaves the session, the own masks keep the state of the session
+
+        Args:
+            stopServer (bool, optional): Stops serving the session if hosting, other annotators are
+                disconnected. Defaults to True.
+        """
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+        if stopServer and self.server is not None:
+            self.server.close()
+            self.server = None
+
+        if self.stack is not None:
+            self.stack.setSession(None)
+
+    def batchFloodfill(self):
+        dialog = BatchFloodfillDialog(self.stack.curId, len(self.stack.mask), self)
+
+        if dialog.exec_():
+            self.stack.floodfillFrames(dialog.first.value(),
+                                       dialog.last.value(),
+                                       recenter=dialog.recenter.isChecked(),
+                                       connected=not dialog.threshold.isChecked())
+
+    def consensus(self):
+        fns = QFileDialog.getOpenFileNames(self, "Masks of all annotators", self.d, filter="*.mask")[0]
+
+        if len(fns) < 2:
+            return
+
+        method, ok = QInputDialog.getItem(self, "Consensus", "Method:", ["majority", "staple"], 0, False)
+
+        if not ok:
+            return
+
+        threshold, ok = QInputDialog.getDouble(self, "Consensus", "Review frames with a mean Dice below:", 0.8, 0, 1, 2)
+
+        if ok:
+            try:
+                self.stack.consensus(fns, method, threshold)
+
+            except (ValueError, OSError) as e:
+                QMessageBox.critical(self, "Consensus", f"Could not compute consensus:\n{e}")
+
+    def openReview(self):
+        fn = QFileDialog.getOpenFileName(self, "Open review list", self.d, filter="*.txt")[0]
+
+        if fn:
+            self.stack.setReview(load_frames(fn))
+            self.status.showMessage(f"{len(self.stack.review)} frames to review (N)", 2000)
+
+    def exportReview(self):
+        fn = QFileDialog.getSaveFileName(self, "Export review list", self.d, filter="*.txt")[0]
+
+        if fn:
+            save_frames(fn, self.stack.review)
+
+    def applyMorphology(self, operation):
+        if operation in morphology.LOCAL_OPERATIONS:
+            size, ok = QInputDialog.getInt(self, operation.capitalize(), "Radius [px]:", 1, 1, 100)
+
+        elif operation == 'remove small objects':
+            size, ok = QInputDialog.getInt(self, operation.capitalize(), "Minimum object size [px]:", 64, 1, 2**31-1)
+
+        else:
+            size, ok = 1, True
+
+        if ok:
+            self.stack.morphology(operation, size, self.morphology3D.isChecked())
+
     def setOnlyDarkerPx(self):
         self.stack.w.only_darker_px = self.onlyDarkerPx.isChecked()
 
+    def setProxyEditing(self):
+        self.stack.w.proxyEditing = self.proxyEditing.isChecked()
+
     def changeTolerance(self):
-        i, ok = QInputDialog.getInt(self, 
+        i, ok = QInputDialog.getDouble(self, 
         "Set tolerance", 
-        "floodfill tolerance [grayscale], default 5:", 
+        "floodfill tolerance [8 bit grayscale steps, scaled to image dtype], default 5:", 
         self.stack.w.tolerance, 
         0, 
-        100, 
-        1)
+        255, 
+        2)
 
         if ok:
             self.stack.w.tolerance = i
@@ -760,7 +2513,13 @@ class PipraMain(QMainWindow):
                     'colorCursor': self.stack.w.colorCursor,
                     'colorMask': self.stack.w.colorMask,
                     'tolerance': self.stack.w.tolerance,
-                    'onlyDarkerPx': self.onlyDarkerPx.isChecked()
+                    'onlyDarkerPx': self.onlyDarkerPx.isChecked(),
+                    'proxyEditing': self.proxyEditing.isChecked(),
+                    'stackLevels': self.stackLevels.isChecked(),
+                    'useCache': self.useCache.isChecked(),
+                    'cacheSize': self.cache.max_bytes,
+                    'randomAccess': self.randomAccess.isChecked(),
+                    'memoryBudget': self.memory.budget
                 }, fp, indent=4)
 
             self.settings_fn = settings_fn
@@ -789,12 +2548,32 @@ class PipraMain(QMainWindow):
             except Exception as e:
                 print(f"Could not set settings only darker px: \n{e}")
 
+            try:
+                self.proxyEditing.setChecked(settings.get('proxyEditing', False))
+                self.setProxyEditing()
+            except Exception as e:
+                print(f"Could not set settings proxy editing: \n{e}")
+
+            try:
+                self.stackLevels.setChecked(settings.get('stackLevels', False))
+                self.setStackLevels()
+            except Exception as e:
+                print(f"Could not set settings stack-wide levels: \n{e}")
+
+            try:
+                self.useCache.setChecked(settings.get('useCache', True))
+                self.cache.max_bytes = settings.get('cacheSize', self.cache.max_bytes)
+                self.randomAccess.setChecked(settings.get('randomAccess', True))
+                self.memory.budget = settings.get('memoryBudget', self.memory.budget)
+            except Exception as e:
+                print(f"Could not set settings cache: \n{e}")
+
             self.stack.changeZ()
 
             self.settings_fn = settings_fn
 
     def updateStatus(self):
-        self.status.showMessage('z: {} x: {} y: {}'.format(self.stack.z.value(), self.stack.w.shape[0],  self.stack.w.shape[1]))
+        self.status.showMessage('z: {} x: {} y: {}'.format(self.stack.z.value(), self.stack.w.shape[1],  self.stack.w.shape[0]))
 
     def getColor(self, init_color):
         old_color = QColor(*init_color)
@@ -822,57 +2601,38 @@ class PipraMain(QMainWindow):
                 if save_it == QMessageBox.Yes:
                     self.save()
 
+                # Declined edits are not recovered from the journal when the file is opened again
+                self.discardEdits = save_it == QMessageBox.No
+
+        self.saveResume(wait=True)
+
         if file is None:
             file = QFileDialog.getOpenFileName(directory=self.d)[0]
 
         self.status.showMessage(file)
 
         if file:
-            self.fn = file
-            self.setWindowTitle(self.fn)
-            self.fn_mask = ".".join(file.split(".")[:-1]) + ".mask"
-
-            self.d = os.path.dirname(self.fn)
-
-            # NRRD files from ImageJ or CMTK
-            # typically confocal or 2p image data
-            if file.endswith("nrrd"):
-                import nrrd
-                s, metadata = nrrd.read(file)
-                s = s.transpose(2, 0, 1).copy()
-                s = np.repeat(s[..., None], 3, 3)
-
-            # Reading data with imageio (tif, mp4, ...)
-            else:
-                try:
-                    s = io.mimread(file, memtest=False)
-
-                    if len(s[0].shape) == 2:
-                        s = np.asarray(s, dtype=s[0].dtype).transpose(0, 2, 1)
-                        s = np.repeat(s[..., None], 3, 3)
-                    else:
-                        s = np.asarray(s, dtype=s[0].dtype).transpose(0, 2, 1, 3)
-                    print("Stack shape: ", s.shape)
-                except Exception as e:
-                    QMessageBox.critical(self, "Could not load data", f"Could not open\n{file}\n\n{e}")
-                    return
-
-            if os.path.isfile(self.fn_mask):
-                mask = fl.load(self.fn_mask, "/mask")
-                print("Mask shape:  ", mask.shape)
-            else:
-                mask = None
-
-            # self.stack = Stack((rgb2gray(s)*255).astype(np.uint8) if len(s.shape) == 4 else s, mask)
-            self.stack = PipraStack(s, mask)
-            self.setCentralWidget(self.stack)
-            self.stack.z.valueChanged.connect(self.updateStatus)
+            fn_mask = ".".join(file.split(".")[:-1]) + ".mask"
+            self.d = os.path.dirname(file)
+
+            # The session of the previous file ends
+            self.leaveSession()
+
+            # Reading NRRD files, data with imageio (tif, mp4, ...),
+            #  or decoded data from previous sessions in the background
+            self.startLoading(StackLoader(file,
+                                          fn_mask,
+                                          cache=self.cache if self.useCache.isChecked() else None,
+                                          random_access=self.randomAccess.isChecked(),
+                                          fn_journal=self.fnJournal(fn_mask)))
+            return
 
         # Debug mode
         else:
             from skimage.filters import gaussian
             from skimage.draw import ellipse
 
+            self.cancelLoading()
             s = np.random.random_integers(173, 255, 100 * 100 * 20).reshape(20, 100, 100).astype(np.uint8)
 
             for i in range(s.shape[0]):
@@ -885,9 +2645,7 @@ class PipraMain(QMainWindow):
                 s[i][rr, cc] = 125
                 s[i] = gaussian(s[i], 2.5, preserve_range=True)
 
-            self.stack = PipraStack(s)
-            self.setCentralWidget(self.stack)
-            self.stack.z.valueChanged.connect(self.updateStatus)
+            self.setStack(PipraStack(s))
 
         self.settings.setEnabled(True)
 
@@ -927,49 +2685,24 @@ class PipraMain(QMainWindow):
         folder = QFileDialog.getExistingDirectory()
 
         if folder:
+            self.saveResume(wait=True)
             files = glob(os.path.join(folder, "*."+ext))
-
-            ims = []
-
-            for fn in files:
-                im = io.imread(fn)
-
-                if len(im.shape) == 2:
-                    im = im.transpose(1, 0)
-
-                elif len(im.shape) == 3:
-                    im = im.transpose(1, 0, 2)
-
-                ims.append(im)
-
-            # Bug if not RGB-images:
-            # ims = [io.imread(fn).transpose(1, 0, 2) for fn in files]
-
-            self.fn = folder
-            self.files = files
-            self.setWindowTitle(folder)
-            self.fn_mask = os.path.join(folder, "images.mask")
+            fn_mask = os.path.join(folder, "images.mask")
 
             self.d = folder
+            self.leaveSession()
 
-            print("Stack shape: ", len(ims))
-
-            if os.path.isfile(self.fn_mask):
-                mask = fl.load(self.fn_mask, "/mask")
-            else:
-                mask = None
-
-            self.stack = PipraStack(ims, mask, is_folder=True)
-            self.setCentralWidget(self.stack)
-            self.stack.z.valueChanged.connect(self.updateStatus)
-
-            self.settings.setEnabled(True)
-
-            if self.settings_fn:
-                self.loadSettings(settings_fn=self.settings_fn)
+            self.startLoading(StackLoader(folder, fn_mask, files=files, fn_journal=self.fnJournal(fn_mask)))
 
 
     def save(self):
+        # Masks of a session are saved by the server
+        if self.session is not None:
+            fn = self.session.save().result(timeout=60)
+            self.stack.w.saved = True
+            self.status.showMessage(f"Session saved as {fn} ..." if fn else "The session server has no file", 1000)
+            return
+
         if not self.fn:
             QMessageBox.critical(self, "No file loaded", "Please load first a file.")
             return
@@ -990,34 +2723,48 @@ class PipraMain(QMainWindow):
                 self.fn_mask = self.fn_mask.replace("ö","oe").replace("ü","ue").replace("ä","ae")
                 print("after:  ", self.fn_mask)
 
-            fl.save(self.fn_mask, {'mask': self.stack.getMasks(), "files": self.files}, compression='blosc')
+            save_masks(self.fn_mask, self.stack.getMasks(), self.files)
             print('saving done.')
 
+            # The saved masks contain all journaled edits
+            if self.stack.journal is not None:
+                self.stack.journal.reset(self.fn_mask)
+
             self.status.showMessage("Masks saved as {} ...".format(self.fn_mask), 1000)
 
     def export(self):
-        """Exporting segmentation masks as mp4 or tif file, or as single png files.
+        """Exporting segmentation masks as mp4 or tif file, as single png files,
+        or as COCO annotations (polygons or run-length encoded) in a json file.
         """
         if not self.fn:
             QMessageBox.critical(self, "No file loaded", "Please load first a file.")
             return
 
         fn = QFileDialog.getSaveFileName(caption="Select file that should contain exported data",
-            filter="MP4 (*.mp4);; TIFF (*.tif);; PNG (*.png)")[0]
+            filter="MP4 (*.mp4);; TIFF (*.tif);; PNG (*.png);; COCO (*.json)")[0]
 
-        if fn:
-            masks = self.stack.getMasks().astype(np.uint8).transpose(0,2,1)*255
+        if fn.endswith(".json"):
+            self.exportCoco(fn)
+
+        elif fn:
+            # Frames are decoded and written one by one, e.g. for compressed masks
+            masks = self.stack.getMasks()
+            n = len(masks)
+            masks = (m.view(np.uint8)*255 for m in masks)
 
             if fn.endswith(".tif"):
-                io.mimwrite(fn, masks)
+                with io.get_writer(fn) as writer:
+                    for m in masks:
+                        writer.append_data(m)
+
                 QMessageBox.information(self,
                     "Data exported",
                     f"Binary masks where exported as uint8/TIF file: \n{fn}")
 
             elif fn.endswith(".mp4"):
-                io.mimwrite(fn, 
-                    masks,
-                    macro_block_size=None)
+                with io.get_writer(fn, macro_block_size=None) as writer:
+                    for m in masks:
+                        writer.append_data(m)
 
                 QMessageBox.information(self,
                     "Data exported",
@@ -1033,19 +2780,66 @@ class PipraMain(QMainWindow):
 
                 QMessageBox.information(self,
                     "Data exported",
-                    f"Binary masks where exported as {len(masks)} PNG files: \n{fn_x}")
+                    f"Binary masks where exported as {n} PNG files: \n{fn_x}")
 
             else:
                 pass
 
+    def exportCoco(self, fn):
+        """Exports the masks as COCO annotations, one annotation per connected component, see `pipra.coco`
+
+        Args:
+            fn (str): Path to json file
+        """
+        fmt, ok = QInputDialog.getItem(self, "COCO export", "Segmentation:", list(COCO_FORMATS), 0, False)
+
+        if not ok:
+            return
+
+        tolerance = 0
+
+        if fmt == 'polygon':
+            tolerance, ok = QInputDialog.getDouble(self, "COCO export", "Polygon simplification [px]:", 1, 0, 100, 1)
+
+            if not ok:
+                return
+
+        dialog, progress = self.stack.progressDialog("Exporting annotations...")
+
+        try:
+            n = export_coco(fn, self.stack.getMasks(), self.files if self.stack.is_folder else None,
+                            os.path.basename(self.fn), fmt, tolerance, progress=progress)
+
+        finally:
+            dialog.close()
+
+        if n is None:
+            self.status.showMessage("Cancelled export", 2000)
+            return
+
+        QMessageBox.information(self,
+            "Data exported",
+            f"{n} objects were exported as COCO annotations: \n{fn}")
+
     def close(self):
         reply = QMessageBox.question(self,
             "Closing?",
             "Do you really want to close PiPrA?\nHave you saved everything?")
 
         if reply == QMessageBox.Yes:
+            self.saveResume(wait=True)
+
+            # The journal of saved masks is empty, unsaved edits are recovered when the file is opened again
+            if self.stack is not None:
+                self.stack.setJournal(None, discard=self.stack.w.saved)
+
             super().close()
 
+    def closeEvent(self, ev):
+        # Other annotators are disconnected, the server does not outlive the window
+        self.leaveSession()
+        super().closeEvent(ev)
+
 def main():
     """Main entry for pipra
     """
@@ -0,0 +1,185 @@
+import numpy as np
+import cv2
+from scipy import ndimage
+from .floodfill import floodfill, tolerance_scale, RGB_WEIGHTS
+from .grabcut import GrabCut, GrabCutMask
+
+# Interactive operations on larger frames run on a downsampled proxy of about this size
+PROXY_PIXELS = 2**22
+
+# GrabCut is slower than flood fill, its proxy is smaller
+GRABCUT_PROXY_PIXELS = 2**18
+
+
+def proxy_factor(shape, max_px=PROXY_PIXELS):
+    """Subsampling factor of the proxy image, 1 if the frame is small enough
+
+    Args:
+        shape (tuple): Frame shape (y, x)
+        max_px (int, optional): Maximum size of the proxy in px. Defaults to PROXY_PIXELS.
+
+    Returns:
+        int: The factor
+    """
+    return max(int(np.ceil(np.sqrt(shape[0] * shape[1] / max_px))), 1)
+
+
+def downsample(im, f):
+    """Proxy of an image, every `f`-th px along both axes, e.g. of a memory-mapped frame"""
+    return np.ascontiguousarray(im[::f, ::f])
+
+
+def upsample(proxy_mask, f, shape):
+    """Full resolution mask of the bounding box of a proxy mask
+
+    Args:
+        proxy_mask (numpy.ndarray): Mask of the proxy
+        f (int): Subsampling factor
+        shape (tuple): Full resolution shape (y, x)
+
+    Returns:
+        tuple or None: Mask of the bounding box and its offset (i0, j0), None if empty
+    """
+    rr, cc = np.nonzero(proxy_mask)
+
+    if rr.size == 0:
+        return None
+
+    p0, p1, q0, q1 = rr.min(), rr.max()+1, cc.min(), cc.max()+1
+    i0, j0 = p0 * f, q0 * f
+    crop = np.repeat(np.repeat(proxy_mask[p0:p1, q0:q1], f, axis=0), f, axis=1)
+
+    return crop[:shape[0]-i0, :shape[1]-j0], (i0, j0)
+
+
+def pad(mask, offset, width, shape):
+    """Pads a mask crop within the image bounds, e.g. for the band around its boundary
+
+    Args:
+        mask (numpy.ndarray): Mask crop
+        offset (tuple): Offset (i0, j0) of the crop
+        width (int): Padding in px
+        shape (tuple): Image shape (y, x)
+
+    Returns:
+        tuple: Padded mask and its offset
+    """
+    i0, j0 = offset
+    a, b = min(width, i0), min(width, j0)
+    c = min(width, shape[0] - i0 - mask.shape[0])
+    d = min(width, shape[1] - j0 - mask.shape[1])
+
+    return np.pad(mask, ((a, c), (b, d))), (i0 - a, j0 - b)
+
+
+def band(coarse, width):
+    """Splits a coarse mask into its certain inside and the uncertain band along its boundary
+
+    Args:
+        coarse (numpy.ndarray): Upsampled mask
+        width (int): Half width of the band in px
+
+    Returns:
+        tuple: The inside and the band
+    """
+    # Masks touching the crop border touch the image border, which is not a boundary
+    inside = ndimage.binary_erosion(coarse, iterations=width, border_value=1)
+    outside = ~ndimage.binary_dilation(coarse, iterations=width)
+
+    return inside, ~inside & ~outside
+
+
+def _intensity(im):
+    im = np.asarray(im)
+    return im[..., :3].astype(np.float64) @ RGB_WEIGHTS if im.ndim == 3 else im.astype(np.float64)
+
+
+def refine_floodfill(im, coarse, offset, f, seed, tolerance=5, only_darker_px=True, levels=None):
+    """Refines an upsampled proxy flood fill at full resolution in a band along its boundary.
+    Band pixels within the tolerance that are connected to the inside are added.
+
+    Args:
+        im (numpy.ndarray): Full resolution image
+        coarse (numpy.ndarray): Upsampled flood fill, padded by `f`, see `pad`
+        offset (tuple): Offset (i0, j0) of `coarse`
+        f (int): Subsampling factor of the proxy, the half width of the band
+        seed (tuple): Full resolution seed (y, x)
+        tolerance (float, optional): Tolerance in 8 bit grayscale steps, see `floodfill`. Defaults to 5.
+        only_darker_px (bool, optional): Flood fill intensities up to seed + tolerance. Defaults to True.
+        levels (tuple, optional): Display levels to scale the tolerance, see `tolerance_scale`. Defaults to None.
+
+    Returns:
+        numpy.ndarray: The refined mask, same shape and offset as `coarse`
+    """
+    i0, j0 = offset
+    crop = im[i0:i0+coarse.shape[0], j0:j0+coarse.shape[1]]
+    inside, uncertain = band(coarse, f)
+
+    v = _intensity(crop)
+    s = float(_intensity(im[seed[0]:seed[0]+1, seed[1]:seed[1]+1]).ravel()[0])
+    tolerance = float(tolerance) * tolerance_scale(im, levels)
+    similar = v <= s + tolerance if only_darker_px else np.abs(v - s) <= tolerance
+
+    # Components of similar pixels connected to the inside, or to the seed for small regions
+    labels, _ = ndimage.label(inside | (uncertain & similar))
+    keep = np.unique(labels[inside])
+
+    if 0 <= seed[0] - i0 < coarse.shape[0] and 0 <= seed[1] - j0 < coarse.shape[1]:
+        keep = np.r_[keep, labels[seed[0] - i0, seed[1] - j0]]
+
+    return np.isin(labels, keep[keep > 0])
+
+
+def refine_grabcut(im, coarse, offset, f, levels=None):
+    """Refines an upsampled proxy GrabCut at full resolution, only pixels in a band along its boundary are estimated.
+
+    Args:
+        im (numpy.ndarray): Full resolution image
+        coarse (numpy.ndarray): Upsampled GrabCut foreground, padded by `2*f`, see `pad`
+        offset (tuple): Offset (i0, j0) of `coarse`
+        f (int): Subsampling factor of the proxy, the half width of the band
+        levels (tuple, optional): (min, max) levels to scale non-uint8 images to uint8. Defaults to None.
+
+    Returns:
+        numpy.ndarray: The refined mask, same shape and offset as `coarse`
+    """
+    i0, j0 = offset
+    crop = im[i0:i0+coarse.shape[0], j0:j0+coarse.shape[1]]
+    inside, uncertain = band(coarse, f)
+
+    trimap = np.full(coarse.shape, cv2.GC_BGD, dtype=np.uint8)
+    trimap[uncertain] = np.where(coarse[uncertain], cv2.GC_PR_FGD, cv2.GC_PR_BGD)
+    trimap[inside] = cv2.GC_FGD
+
+    return GrabCutMask(crop, trimap, levels=levels)
+
+
+def proxy_floodfill(proxy, f, seed, **kwargs):
+    """Flood fill on the proxy image
+
+    Args:
+        proxy (numpy.ndarray): Proxy image, see `downsample`
+        f (int): Subsampling factor
+        seed (tuple): Full resolution seed (y, x)
+        **kwargs: Flood fill settings, see `floodfill`
+
+    Returns:
+        numpy.ndarray: Mask of the proxy
+    """
+    return floodfill(proxy, (seed[0] // f, seed[1] // f), **kwargs) == 1
+
+
+def proxy_grabcut(crop, f, r, levels=None):
+    """GrabCut on a proxy of an image crop
+
+    Args:
+        crop (numpy.ndarray): Full resolution image crop
+        f (int): Subsampling factor
+        r (tuple): Rectangle (x0, y0, width, height) in the crop
+        levels (tuple, optional): (min, max) levels to scale non-uint8 images to uint8. Defaults to None.
+
+    Returns:
+        numpy.ndarray: Mask of the proxy of the crop
+    """
+    x0, y0, w, h = r
+    return GrabCut(downsample(crop, f), (x0 // f, y0 // f, max(w // f, 1), max(h // f, 1)), levels=levels)
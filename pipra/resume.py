@@ -0,0 +1,167 @@
+import os
+import numpy as np
+import flammkuchen as fl
+from .masks import encode, decode
+
+# Layout of resume files, files of other versions are ignored
+VERSION = 1
+
+# The resume file is written at most this often while annotating, in seconds
+SAVE_INTERVAL = 10
+
+# Encodings of masks in packed buffers, see `pack`
+KINDS = (None, 'bits', 'runs')
+
+
+def pack(codes):
+    """Packs encoded masks into a single byte buffer, stored as one dataset instead of one node per mask
+
+    Args:
+        codes (list): Encoded masks, see `pipra.masks.encode`
+
+    Returns:
+        dict: Encoding of every mask (`kinds`, index into KINDS), byte `offsets` and the buffer `data`
+    """
+    kinds = np.array([KINDS.index(None if c is None else c[0]) for c in codes], dtype=np.uint8)
+    data = [np.zeros(0, dtype=np.uint8) if c is None else np.ascontiguousarray(c[1]).view(np.uint8) for c in codes]
+    offsets = np.zeros(len(codes)+1, dtype=np.int64)
+    np.cumsum([d.size for d in data], out=offsets[1:])
+
+    return {'kinds': kinds, 'offsets': offsets,
+            'data': np.concatenate(data) if data else np.zeros(0, dtype=np.uint8)}
+
+
+def unpack(packed):
+    """Encoded masks of a buffer written by `pack`
+
+    Returns:
+        list: Encoded masks, see `pipra.masks.decode`
+    """
+    codes = []
+
+    for k, o0, o1 in zip(packed['kinds'], packed['offsets'][:-1], packed['offsets'][1:]):
+        kind = KINDS[k]
+        data = packed['data'][o0:o1]
+
+        # Run positions are stored as bytes of uint32
+        codes.append(None if kind is None else (kind, data if kind == 'bits' else data.view(np.uint32)))
+
+    return codes
+
+
+def _array(mask):
+    """Dense copy of a mask, e.g. of a `pipra.tiles.TiledMask`"""
+    return mask.to_array() if hasattr(mask, 'to_array') else np.asarray(mask, dtype=bool)
+
+
+def diff_history(history, current):
+    """Encodes the undo steps of a frame as the pixels that differ from the following step
+
+    Args:
+        history (list): Masks before every change, oldest first
+        current (numpy.ndarray): The current mask
+
+    Returns:
+        list: Encoded differences, see `undo_history`
+    """
+    codes = []
+    after = current
+
+    for before in reversed(history):
+        before = _array(before)
+        codes.append(encode(before != after))
+        after = before
+
+    return codes[::-1]
+
+
+def undo_history(codes, current):
+    """Masks of the undo steps of a frame, see `diff_history`
+
+    Args:
+        codes (list): Encoded differences
+        current (numpy.ndarray): The current mask
+
+    Returns:
+        list: Masks before every change, oldest first
+    """
+    history = []
+    after = current
+
+    for code in reversed(codes):
+        after = after ^ decode(code, current.shape)
+        history.append(after)
+
+    return history[::-1]
+
+
+def save_resume(fn, state):
+    """Writes the state of an annotation session, see `PipraStack.resumeState`.
+    The mask of the current frame and the undo histories are compressed,
+    undo steps of the current frame as differences to the following step.
+
+    Args:
+        fn (str): Path to resume file, e.g. next to the `.mask` file
+        state (dict): The state, with the current `mask`, its undo `history` as encoded masks
+            and the undo `steps` across frames as dicts {frame: (encoded mask, shape)}
+    """
+    state = dict(state)
+    current = _array(state.pop('mask'))
+    steps = state.pop('steps')
+
+    # Undo steps across frames are stored as one list of frames
+    frames = [(k, i, code, shape) for k, step in enumerate(steps) for i, (code, shape) in step.items()]
+
+    state.update({
+        'version': VERSION,
+        'mask': pack([encode(current)]),
+        'shape': np.array(current.shape),
+        'history': pack(diff_history([decode(code, current.shape) for code in state.pop('history')], current)),
+        'steps': pack([code for _, _, code, _ in frames]),
+        'step_index': np.array([k for k, _, _, _ in frames], dtype=np.int64),
+        'step_frames': np.array([i for _, i, _, _ in frames], dtype=np.int64),
+        'step_shapes': np.array([shape for _, _, _, shape in frames], dtype=np.int64).reshape(-1, 2),
+        'step_count': len(steps),
+    })
+
+    # Written next to the file and replaced, a crash while writing keeps the previous state
+    fl.save(fn + ".tmp", state, compression='blosc')
+    os.replace(fn + ".tmp", fn)
+
+
+def load_resume(fn):
+    """Reads a resume file written by `save_resume`
+
+    Args:
+        fn (str): Path to resume file
+
+    Returns:
+        dict or None: The state with the decoded `mask` of the current frame, its undo `history` as masks
+            and the undo `steps` across frames. None if there is no readable file of this version.
+    """
+    if not os.path.isfile(fn):
+        return None
+
+    try:
+        state = fl.load(fn)
+
+    except Exception as e:
+        print(f"Could not load resume file: \n{e}")
+        return None
+
+    if state.get('version') != VERSION:
+        return None
+
+    shape = tuple(int(s) for s in state['shape'])
+    state['mask'] = decode(unpack(state['mask'])[0], shape)
+    state['history'] = undo_history(unpack(state['history']), state['mask'])
+
+    steps = [{} for _ in range(int(state.pop('step_count')))]
+
+    for k, i, code, s in zip(state.pop('step_index'), state.pop('step_frames'), unpack(state['steps']),
+                             state.pop('step_shapes')):
+        steps[k][int(i)] = code, tuple(int(v) for v in s)
+
+    state['steps'] = steps
+
+    return state
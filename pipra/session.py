@@ -0,0 +1,583 @@
+import os
+import secrets
+import socket
+import struct
+import threading
+from concurrent.futures import Future
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+import numpy as np
+from .masks import encode, decode, load_masks, save_masks, MaskVolume
+
+# Default port of the session server on the local machine
+DEFAULT_PORT = 6150
+
+# Servers listen on other interfaces only with a key chosen by the user, see `SessionServer`
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')
+
+# Environment variable with the key of a session served without GUI
+KEY_VARIABLE = "PIPRA_SESSION_KEY"
+
+# Array types of the wire format, see `dumps`
+ARRAY_DTYPES = (np.uint8, np.uint32, np.int64)
+_COUNT = struct.Struct("<I")
+_INT = struct.Struct("<q")
+_ARRAY = struct.Struct("<BI")
+
+
+def new_key():
+    """Random key of a session, shown to the host as hex, see `parse_key`
+
+    Returns:
+        bytes: The key
+    """
+    return secrets.token_bytes(16)
+
+
+def parse_key(text):
+    """Key entered by a user, hex keys of `new_key` or any other passphrase
+
+    Args:
+        text (str): The key
+
+    Returns:
+        bytes: The key
+    """
+    text = text.strip()
+
+    try:
+        return bytes.fromhex(text)
+
+    except ValueError:
+        return text.encode()
+
+
+def _dump(value, out):
+    if value is None:
+        out.append(b"N")
+
+    elif isinstance(value, (bool, np.bool_)):
+        out.append(b"T" if value else b"F")
+
+    elif isinstance(value, (int, np.integer)):
+        out.append(b"i" + _INT.pack(int(value)))
+
+    elif isinstance(value, str):
+        data = value.encode()
+        out.append(b"s" + _COUNT.pack(len(data)) + data)
+
+    elif isinstance(value, np.ndarray):
+        if value.ndim != 1 or value.dtype.type not in ARRAY_DTYPES:
+            raise TypeError(f"Cannot send array of shape {value.shape} and dtype {value.dtype}")
+
+        out.append(b"a" + _ARRAY.pack(ARRAY_DTYPES.index(value.dtype.type), value.size))
+        out.append(np.ascontiguousarray(value).tobytes())
+
+    elif isinstance(value, (tuple, list)):
+        out.append((b"t" if isinstance(value, tuple) else b"l") + _COUNT.pack(len(value)))
+
+        for v in value:
+            _dump(v, out)
+
+    elif isinstance(value, dict):
+        out.append(b"d" + _COUNT.pack(len(value)))
+
+        for k, v in value.items():
+            _dump(k, out)
+            _dump(v, out)
+
+    else:
+        raise TypeError(f"Cannot send {type(value).__name__}")
+
+
+def _load(data, pos):
+    tag = bytes(data[pos:pos+1])
+    pos += 1
+
+    if not tag:
+        raise ValueError("Truncated message")
+
+    if tag in (b"N", b"T", b"F"):
+        return {b"N": None, b"T": True, b"F": False}[tag], pos
+
+    if tag == b"i":
+        return _INT.unpack_from(data, pos)[0], pos + _INT.size
+
+    if tag == b"s":
+        n, = _COUNT.unpack_from(data, pos)
+        pos += _COUNT.size
+
+        if pos + n > len(data):
+            raise ValueError("Truncated message")
+
+        return str(data[pos:pos+n], 'utf-8'), pos + n
+
+    if tag == b"a":
+        k, n = _ARRAY.unpack_from(data, pos)
+        pos += _ARRAY.size
+        dtype = np.dtype(ARRAY_DTYPES[k])
+
+        if pos + n * dtype.itemsize > len(data):
+            raise ValueError("Truncated message")
+
+        return np.frombuffer(data, dtype=dtype, count=n, offset=pos).copy(), pos + n * dtype.itemsize
+
+    if tag in (b"t", b"l", b"d"):
+        n, = _COUNT.unpack_from(data, pos)
+        pos += _COUNT.size
+        items = []
+
+        for _ in range(2*n if tag == b"d" else n):
+            v, pos = _load(data, pos)
+            items.append(v)
+
+        if tag == b"d":
+            return dict(zip(items[::2], items[1::2])), pos
+
+        return (tuple(items) if tag == b"t" else items), pos
+
+    raise ValueError(f"Unknown type tag {tag!r}")
+
+
+def dumps(message):
+    """Serializes a message of None, bool, int, str, 1D arrays (see ARRAY_DTYPES) and tuples, lists and dicts of those.
+    Messages are not pickled, such that reading a message cannot run code.
+
+    Args:
+        message (tuple): The message
+
+    Returns:
+        bytes: Every value as type tag, followed by its size if needed and its data
+    """
+    out = []
+    _dump(message, out)
+    return b"".join(out)
+
+
+def loads(data):
+    """Reads a message written by `dumps`
+
+    Args:
+        data (bytes): The message
+
+    Raises:
+        ValueError: The data is no valid message
+
+    Returns:
+        tuple: The message
+    """
+    try:
+        message, pos = _load(memoryview(data), 0)
+
+    except (struct.error, IndexError, UnicodeDecodeError, RecursionError) as e:
+        raise ValueError(f"Invalid message: {e}") from e
+
+    if pos != len(data):
+        raise ValueError("Invalid message: trailing data")
+
+    return message
+
+
+def frame_shape(masks, i):
+    """Shape of the mask of frame `i`
+
+    Args:
+        masks (MaskVolume, RaggedMasks or numpy.ndarray): The masks
+        i (int): Frame index
+
+    Returns:
+        tuple: The shape (y, x)
+    """
+    if hasattr(masks, 'shapes'):
+        return tuple(int(s) for s in masks.shapes[i])
+
+    return tuple(masks.shape[1:3])
+
+
+class SessionServer:
+    def __init__(self, masks, fn=None, files=None, address=('localhost', DEFAULT_PORT), authkey=None):
+        """Owns the authoritative masks of a session with several annotators.
+
+        Clients lock frame ranges, stream the pixels changed by their strokes
+        and receive the changes of all other clients. Changes to frames that are not
+        locked by the sender are rejected. Locks are released when a client disconnects.
+
+        Messages are tuples serialized with `dumps`, see `SessionClient` for the client side.
+        Clients authenticate with the key of the session, `authkey`, shown to the host to pass it on.
+
+        Args:
+            masks (MaskVolume, RaggedMasks or numpy.ndarray): The masks, copied by the caller if shared
+            fn (str, optional): `.mask` file written when a client saves. Defaults to None.
+            files (list, optional): Image file names when annotating a folder. Defaults to None.
+            address (tuple, optional): Host and port, port 0 picks a free port. Defaults to ('localhost', DEFAULT_PORT).
+            authkey (bytes, optional): Key of the session, a random key if None. Servers listen on other
+                interfaces than localhost only with a given key. Defaults to None.
+
+        Raises:
+            ValueError: No key is given for a server listening on other interfaces than localhost
+        """
+        if authkey is None:
+            if address[0] not in LOCAL_HOSTS:
+                raise ValueError(f"A key is required to serve on {address[0]}, only localhost is served with a random key")
+
+            authkey = new_key()
+
+        self.authkey = authkey
+        self.masks = MaskVolume.from_array(masks) if isinstance(masks, np.ndarray) else masks
+        self.fn = fn
+        self.files = files
+        self.listener = Listener(address, authkey=authkey)
+
+        # Lock owner by frame index and client names by id
+        self.locks = {}
+        self.names = {}
+        self.clients = {}
+
+        self._lock = threading.RLock()
+        self._next_id = 0
+        self._thread = None
+        self._closed = False
+
+    @property
+    def address(self):
+        return self.listener.address
+
+    def start(self):
+        """Accepts clients in a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """Accepts clients until the server is closed, every client is served in its own thread"""
+        while not self._closed:
+            try:
+                conn = self.listener.accept()
+
+            except (OSError, EOFError, AuthenticationError):
+                if self._closed:
+                    break
+
+                # Failed handshake, e.g. wrong authkey
+                continue
+
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def close(self):
+        """Stops accepting clients and disconnects all clients, the port is free afterwards"""
+        self._closed = True
+
+        # A closed socket does not end a pending accept, the accepting thread is woken up by connecting
+        if self._thread is not None:
+            try:
+                socket.create_connection(self.address, timeout=1).close()
+
+            except OSError:
+                pass
+
+            self._thread.join(timeout=5)
+
+        self.listener.close()
+
+        with self._lock:
+            for conn, _ in self.clients.values():
+                conn.close()
+
+    def _send(self, client, message):
+        conn, send_lock = self.clients[client]
+
+        try:
+            with send_lock:
+                conn.send_bytes(dumps(message))
+
+        except (OSError, ValueError):
+            pass
+
+    def _broadcast(self, message, exclude=None):
+        for client in list(self.clients):
+            if client != exclude:
+                self._send(client, message)
+
+    def _locks(self):
+        return 'locks', dict(self.locks), dict(self.names)
+
+    def _serve(self, conn):
+        try:
+            _, name = loads(conn.recv_bytes())
+
+        except (EOFError, OSError, ValueError, TypeError):
+            conn.close()
+            return
+
+        with self._lock:
+            client = self._next_id
+            self._next_id += 1
+            self.names[client] = name
+            self.clients[client] = conn, threading.Lock()
+
+            shapes = [frame_shape(self.masks, i) for i in range(len(self.masks))]
+            frames = [encode(self.masks[i]) for i in range(len(self.masks))]
+            self._send(client, ('welcome', client, shapes, frames, dict(self.locks), dict(self.names)))
+
+        try:
+            while True:
+                message = loads(conn.recv_bytes())
+
+                if message == ('bye',):
+                    break
+
+                self._handle(client, message)
+
+        # Malformed messages end the connection
+        except (EOFError, OSError, ValueError, TypeError, IndexError):
+            pass
+
+        finally:
+            with self._lock:
+                del self.clients[client]
+                del self.names[client]
+                self.locks = {i: c for i, c in self.locks.items() if c != client}
+                self._broadcast(self._locks())
+
+            conn.close()
+
+    def _handle(self, client, message):
+        kind = message[0]
+
+        with self._lock:
+            if kind == 'lock':
+                _, rid, i0, i1 = message
+                owners = {self.locks.get(i, client) for i in range(i0, i1+1)} - {client}
+
+                if owners:
+                    self._send(client, ('reply', rid, (False, self.names[owners.pop()])))
+                    return
+
+                self.locks.update({i: client for i in range(i0, i1+1)})
+                self._send(client, ('reply', rid, (True, self.names[client])))
+                self._broadcast(self._locks())
+
+            elif kind == 'unlock':
+                _, i0, i1 = message
+                self.locks = {i: c for i, c in self.locks.items() if c != client or not i0 <= i <= i1}
+                self._broadcast(self._locks())
+
+            elif kind == 'delta':
+                _, i, idx, value = message
+
+                if self.locks.get(i) != client:
+                    self._send(client, ('reject', i, encode(self.masks[i])))
+                    return
+
+                m = np.array(self.masks[i])
+                m.flat[idx] = value
+                self.masks[i] = m
+                self._broadcast(('delta', i, idx, value, client), exclude=client)
+
+            elif kind == 'set':
+                _, i, code = message
+
+                if self.locks.get(i) != client:
+                    self._send(client, ('reject', i, encode(self.masks[i])))
+                    return
+
+                self.masks[i] = decode(code, frame_shape(self.masks, i))
+                self._broadcast(('set', i, code, client), exclude=client)
+
+            elif kind == 'save':
+                _, rid = message
+
+                if self.fn is not None:
+                    save_masks(self.fn, self.masks, self.files)
+
+                self._send(client, ('reply', rid, self.fn))
+
+
+class SessionClient:
+    def __init__(self, address=('localhost', DEFAULT_PORT), authkey=b"", name=None, callback=None):
+        """Connection of an annotator to a `SessionServer`.
+
+        Strokes are buffered and sent as flat pixel indices with `flush`.
+        Events of the server are passed to `callback` from a background thread:
+
+        - `('delta', i, idx, value, client)`: pixels changed by another client
+        - `('set', i, code, client)`: frame replaced by another client, see `pipra.masks.encode`
+        - `('reject', i, code)`: own change of a frame that is not locked, with the authoritative frame
+        - `('locks', locks, names)`: lock owner by frame and client names by id
+
+        Args:
+            address (tuple, optional): Host and port of the server. Defaults to ('localhost', DEFAULT_PORT).
+            authkey (bytes, optional): Key of the session, see `SessionServer`. Defaults to b"".
+            name (str, optional): Name shown to other annotators, the login name if None. Defaults to None.
+            callback (callable, optional): Called with server events. Defaults to None.
+        """
+        self.name = name or os.environ.get("USER", os.environ.get("USERNAME", "annotator"))
+        self.callback = callback
+        self.conn = Client(address, authkey=authkey)
+        self.conn.send_bytes(dumps(('hello', self.name)))
+
+        _, self.id, self.shapes, self.frames, self.locks, self.names = loads(self.conn.recv_bytes())
+
+        self._pending = {}
+        self._buffer = []
+        self._next_rid = 0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._receive, daemon=True)
+        self._thread.start()
+
+    def _receive(self):
+        try:
+            while True:
+                message = loads(self.conn.recv_bytes())
+
+                if message[0] == 'reply':
+                    self._pending.pop(message[1]).set_result(message[2])
+                    continue
+
+                if message[0] == 'locks':
+                    _, self.locks, self.names = message
+
+                if self.callback is not None:
+                    self.callback(message)
+
+        except (EOFError, OSError, ValueError):
+            for f in self._pending.values():
+                f.cancel()
+
+    def _send(self, message):
+        with self._lock:
+            self.conn.send_bytes(dumps(message))
+
+    def _request(self, kind, *args):
+        with self._lock:
+            rid = self._next_rid
+            self._next_rid += 1
+            f = self._pending[rid] = Future()
+            self.conn.send_bytes(dumps((kind, rid, *args)))
+
+        return f
+
+    def masks(self):
+        """Masks of the session when joining
+
+        Returns:
+            dict: Decoded masks by frame index
+        """
+        return {i: decode(code, shape) for i, (code, shape) in enumerate(zip(self.frames, self.shapes))}
+
+    def owns(self, i):
+        """True if frame `i` is locked by this client"""
+        return self.locks.get(i) == self.id
+
+    def owner(self, i):
+        """Name of the annotator that locked frame `i`, None if not locked"""
+        return self.names.get(self.locks.get(i))
+
+    def lock(self, i0, i1):
+        """Locks frames `i0` to `i1` (inclusive) for editing
+
+        Returns:
+            concurrent.futures.Future: Resolves to (success, owner name)
+        """
+        return self._request('lock', i0, i1)
+
+    def unlock(self, i0, i1):
+        """Releases own locks of frames `i0` to `i1` (inclusive)"""
+        self._send(('unlock', i0, i1))
+
+    def stroke(self, i, rr, cc, before, value):
+        """Buffers pixels changed by a stroke, see `flush`
+
+        Args:
+            i (int): Frame index
+            rr (numpy.ndarray): Row coordinates of painted pixels
+            cc (numpy.ndarray): Column coordinates of painted pixels
+            before (numpy.ndarray): Values of the pixels before painting
+            value (bool): New value of the pixels
+        """
+        changed = np.asarray(before) != value
+        idx = np.ravel_multi_index((np.asarray(rr)[changed], np.asarray(cc)[changed]), self.shapes[i])
+
+        if idx.size == 0:
+            return
+
+        with self._lock:
+            # Consecutive strokes with the same value are merged, the order of other strokes is kept
+            if self._buffer and self._buffer[-1][:2] == (i, value):
+                self._buffer[-1][2].append(idx)
+
+            else:
+                self._buffer.append((i, value, [idx]))
+
+    def flush(self):
+        """Sends the buffered strokes as compact deltas"""
+        with self._lock:
+            buffer, self._buffer = self._buffer, []
+
+            for i, value, idx in buffer:
+                self.conn.send_bytes(dumps(('delta', i, np.unique(np.concatenate(idx)).astype(np.uint32), value)))
+
+    def set_frame(self, i, mask):
+        """Replaces the mask of frame `i`, e.g. after undo or a change across frames"""
+        self.flush()
+        self._send(('set', i, encode(mask)))
+
+    def save(self):
+        """Writes the masks of the session to the server's `.mask` file
+
+        Returns:
+            concurrent.futures.Future: Resolves to the file name, None if the server has no file
+        """
+        self.flush()
+        return self._request('save')
+
+    def close(self):
+        # The server closes the connection, which ends the receiving thread
+        self.flush()
+        self._send(('bye',))
+        self._thread.join(timeout=5)
+        self.conn.close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serves the masks of a .mask file to several pipra annotators")
+    parser.add_argument("mask", help="Path to .mask file, created if it does not exist")
+    parser.add_argument("--shape", type=int, nargs=3, metavar=("Z", "Y", "X"), help="Stack shape of a new .mask file")
+    parser.add_argument("--host", default="localhost", help="Interface to listen on, defaults to localhost")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port, defaults to {DEFAULT_PORT}")
+    parser.add_argument("--key", default=os.environ.get(KEY_VARIABLE),
+                        help=f"Key of the session, defaults to ${KEY_VARIABLE} or a random key. "
+                             "Required to listen on other interfaces than localhost")
+    args = parser.parse_args()
+
+    if args.key is None and args.host not in LOCAL_HOSTS:
+        parser.error(f"Serving on {args.host} requires a key, set --key or ${KEY_VARIABLE}")
+
+    files = None
+
+    if os.path.isfile(args.mask):
+        import flammkuchen as fl
+
+        masks = load_masks(args.mask)
+        files = fl.load(args.mask, "/files")
+
+    elif args.shape:
+        masks = MaskVolume(tuple(args.shape))
+
+    else:
+        parser.error(f"{args.mask} does not exist, provide the stack shape with --shape")
+
+    server = SessionServer(masks, args.mask, files, address=(args.host, args.port),
+                           authkey=None if args.key is None else parse_key(args.key))
+    print(f"Serving {args.mask} on {args.host}:{server.address[1]}")
+
+    if args.key is None:
+        print(f"Session key: {server.authkey.hex()}")
+
+    try:
+        server.serve_forever()
+
+    except KeyboardInterrupt:
+        server.close()
@@ -0,0 +1,212 @@
+import numpy as np
+from scipy import ndimage
+from .components import STRUCTURE
+
+# Columns of the statistics table
+COLUMNS = ('frame', 'area', 'centroid_y', 'centroid_x', 'bbox_y0', 'bbox_x0', 'bbox_y1', 'bbox_x1', 'components')
+
+
+def frame_stats(mask, components=True):
+    """Statistics of a single mask
+
+    Args:
+        mask (numpy.ndarray): 2D boolean mask
+        components (bool, optional): Counts the components, 0 if False. Defaults to True.
+
+    Returns:
+        tuple: Area, sum of y and x coordinates, bounding box (y0, x0, y1, x1) and number of components
+    """
+    rr, cc = np.nonzero(mask)
+
+    if rr.size == 0:
+        return 0, 0, 0, (-1, -1, -1, -1), 0
+
+    n = ndimage.label(mask, STRUCTURE)[1] if components else 0
+
+    return rr.size, int(rr.sum()), int(cc.sum()), (rr.min(), cc.min(), rr.max()+1, cc.max()+1), n
+
+
+class MaskStats:
+    def __init__(self, masks):
+        """Per-frame area, centroid, bounding box and number of components of a stack's masks.
+
+        Area, centroid and bounding box are updated incrementally from the pixels changed by a stroke.
+        The number of components, and the bounding box if erasing at its border, is marked outdated
+        and recomputed from the mask when requested. The frame edited in the GUI is not recomputed
+        from its stored mask, its components are taken from the component index of the view, see `setLive`.
+
+        Args:
+            masks (MaskVolume, RaggedMasks or numpy.ndarray): The masks, used to recompute outdated frames
+        """
+        self.masks = masks
+        n = len(masks)
+
+        self.area = np.zeros(n, dtype=np.int64)
+        self.sums = np.zeros((n, 2), dtype=np.int64)
+        self.bbox = np.full((n, 4), -1, dtype=np.int64)
+        self.components = np.zeros(n, dtype=np.int64)
+
+        # Empty frames are up to date, all other frames are computed when requested
+        occupancy = masks.occupancy() if hasattr(masks, 'occupancy') else np.array([m.any() for m in masks])
+        self.dirtyArea = occupancy.copy()
+        self.dirtyBox = occupancy.copy()
+        self.dirtyComponents = occupancy.copy()
+
+        # Frame edited in the GUI and its component index, see `setLive`
+        self.live = None
+        self.liveIndex = None
+
+    def __len__(self):
+        return len(self.area)
+
+    def compute(self, i, mask=None, components=True):
+        """Recomputes all statistics of frame `i`
+
+        Args:
+            i (int): Frame index
+            mask (numpy.ndarray, optional): The mask, stored mask if None. Defaults to None.
+            components (bool, optional): Counts the components, otherwise they are marked outdated. Defaults to True.
+        """
+        mask = self.masks[i] if mask is None else mask
+        self.area[i], self.sums[i, 0], self.sums[i, 1], self.bbox[i], n = frame_stats(mask, components)
+        self.dirtyArea[i] = self.dirtyBox[i] = False
+
+        self.components[i] = n
+        self.dirtyComponents[i] = not components
+
+    def setLive(self, i, mask=None, index=None):
+        """Sets the frame edited in the GUI. Its stored mask is outdated until the frame is left,
+        outdated statistics of the frame are computed from `mask` and its component index instead.
+
+        Args:
+            i (int or None): Frame index, None if no frame is edited
+            mask (numpy.ndarray, optional): The mask of the frame. Defaults to None.
+            index (callable, optional): Returns the `ComponentIndex` of the frame. Defaults to None.
+        """
+        self.live = i
+        self.liveIndex = index
+
+        if i is not None and (self.dirtyArea[i] or self.dirtyBox[i]):
+            self.compute(i, mask, components=False)
+
+    def update(self, i, rr, cc, before, value):
+        """Updates the statistics of frame `i` from changed pixels
+
+        Args:
+            i (int): Frame index
+            rr (numpy.ndarray): Row coordinates of painted pixels
+            cc (numpy.ndarray): Column coordinates of painted pixels
+            before (numpy.ndarray): Values of the pixels before painting
+            value (bool): New value of the pixels
+        """
+        changed = np.asarray(before) != value
+        rr, cc = np.asarray(rr)[changed], np.asarray(cc)[changed]
+
+        if rr.size == 0:
+            return
+
+        # Pixels painted twice in one stroke changed once
+        rr, cc = np.unique(np.stack([rr, cc]), axis=1)
+
+        box = rr.min(), cc.min(), rr.max()+1, cc.max()+1
+        sign = 1 if value else -1
+        self.dirtyComponents[i] = True
+
+        if self.dirtyArea[i]:
+            return
+
+        empty = self.area[i] == 0
+        self.area[i] += sign * rr.size
+        self.sums[i] += sign * np.array([rr.sum(), cc.sum()], dtype=np.int64)
+
+        if self.dirtyBox[i]:
+            return
+
+        # Added pixels only extend the bounding box
+        if value:
+            y0, x0, y1, x1 = box if empty else self.bbox[i]
+            self.bbox[i] = min(y0, box[0]), min(x0, box[1]), max(y1, box[2]), max(x1, box[3])
+
+        # Removing pixels at the border of the bounding box may shrink it
+        elif self.area[i] == 0:
+            self.bbox[i] = -1
+
+        else:
+            y0, x0, y1, x1 = self.bbox[i]
+            self.dirtyBox[i] = box[0] == y0 or box[1] == x0 or box[2] == y1 or box[3] == x1
+
+    def resolve(self, frames=None):
+        """Recomputes outdated statistics
+
+        Args:
+            frames (iterable, optional): Frame indices, all frames if None. Defaults to None.
+        """
+        frames = range(len(self)) if frames is None else frames
+
+        for i in frames:
+            if i == self.live and self.liveIndex is not None:
+                if self.dirtyBox[i] or self.dirtyComponents[i]:
+                    n, box = self.liveIndex().summary()
+                    self.components[i] = n
+
+                    if self.dirtyBox[i]:
+                        self.bbox[i] = box
+
+                    self.dirtyBox[i] = self.dirtyComponents[i] = False
+
+            elif self.dirtyArea[i] or self.dirtyBox[i] or self.dirtyComponents[i]:
+                self.compute(i)
+
+    def centroid(self):
+        """Centroids (y, x) of all frames, NaN for empty frames
+
+        Returns:
+            numpy.ndarray: The centroids as (n, 2) array
+        """
+        self.resolve(np.flatnonzero(self.dirtyArea))
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.area[:, None] > 0, self.sums / self.area[:, None], np.nan)
+
+    def table(self):
+        """All statistics, outdated frames are recomputed
+
+        Returns:
+            dict: Column name to numpy array, see COLUMNS
+        """
+        self.resolve()
+        c = self.centroid()
+
+        return dict(zip(COLUMNS, (np.arange(len(self)), self.area, c[:, 0], c[:, 1],
+                                  *self.bbox.T, self.components)))
+
+
+def export(table, fn):
+    """Exports statistics as CSV, or as Parquet if `fn` ends with `.parquet` (requires pyarrow).
+
+    Args:
+        table (dict): Column name to numpy array, see `MaskStats.table`
+        fn (str): Path to output file
+    """
+    if fn.endswith(".parquet"):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        pq.write_table(pa.table({k: np.asarray(v) for k, v in table.items()}), fn)
+
+    else:
+        data = np.column_stack([np.asarray(v, dtype=np.float64) for v in table.values()])
+        fmt = ['%d' if np.issubdtype(np.asarray(v).dtype, np.integer) else '%.3f' for v in table.values()]
+        np.savetxt(fn, data, fmt=fmt, delimiter=',', header=','.join(table), comments='')
+
+
+if __name__ == '__main__':
+    import argparse
+    from .masks import load_masks
+
+    parser = argparse.ArgumentParser(description="Exports per-frame statistics of a .mask file as CSV or Parquet")
+    parser.add_argument("mask", help="Path to .mask file")
+    parser.add_argument("output", help="Output file, .csv or .parquet")
+    args = parser.parse_args()
+
+    export(MaskStats(load_masks(args.mask)).table(), args.output)
@@ -0,0 +1,110 @@
+from PyQt5.QtWidgets import QWidget, QGridLayout, QTableView, QComboBox, QPushButton, QFileDialog, \
+    QMessageBox
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QTimer
+import numpy as np
+import pyqtgraph as pg
+from .stats import COLUMNS, export
+
+
+class StatsModel(QAbstractTableModel):
+    def __init__(self, parent=None):
+        """Table model showing the statistics of all frames, see `MaskStats.table`
+
+        Args:
+            parent (QObject, optional): Parent object. Defaults to None.
+        """
+        super().__init__(parent)
+        self.table = {k: np.zeros(0) for k in COLUMNS}
+
+    def rowCount(self, parent=QModelIndex()):
+        return len(self.table['frame'])
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(COLUMNS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole:
+            v = self.table[COLUMNS[index.column()]][index.row()]
+            return f"{v:.1f}" if isinstance(v, float) else str(v)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return COLUMNS[section]
+
+    def setTable(self, table):
+        """Shows new statistics
+
+        Args:
+            table (dict): Column name to numpy array
+        """
+        self.beginResetModel()
+        self.table = {k: v.tolist() for k, v in table.items()}
+        self.endResetModel()
+
+
+class StatsWindow(QWidget):
+    def __init__(self, stats, parent=None):
+        """Plot and table of per-frame mask statistics across the stack, with export.
+        Refreshes are coalesced, such that painting stays responsive.
+
+        Args:
+            stats (MaskStats): The statistics of the stack
+            parent (QWidget, optional): Parent widget. Defaults to None.
+        """
+        super().__init__(parent, Qt.Window)
+        self.setWindowTitle("Mask statistics")
+        self.stats = stats
+
+        self.column = QComboBox()
+        self.column.addItems(COLUMNS[1:])
+        self.column.currentIndexChanged.connect(self.refresh)
+
+        self.plot = pg.PlotWidget()
+        self.plot.setLabel('bottom', 'frame')
+        self.curve = self.plot.plot(pen='g')
+        self.current = pg.InfiniteLine(0, pen='y')
+        self.plot.addItem(self.current)
+
+        self.model = StatsModel(self)
+        self.tableView = QTableView()
+        self.tableView.setModel(self.model)
+
+        self.exportButton = QPushButton("Export...")
+        self.exportButton.clicked.connect(self.export)
+
+        self.refreshTimer = QTimer(singleShot=True, interval=200)
+        self.refreshTimer.timeout.connect(self.refresh)
+
+        l = QGridLayout()
+        l.addWidget(self.column, 0, 0)
+        l.addWidget(self.exportButton, 0, 1)
+        l.addWidget(self.plot, 1, 0, 1, 2)
+        l.addWidget(self.tableView, 2, 0, 1, 2)
+        self.setLayout(l)
+
+        self.resize(600, 600)
+        self.refresh()
+
+    def scheduleRefresh(self, *args):
+        """Refreshes after the mask stopped changing for a moment"""
+        self.refreshTimer.start()
+
+    def refresh(self):
+        table = self.stats.table()
+        self.curve.setData(table['frame'], table[self.column.currentText()].astype(np.float64))
+        self.model.setTable(table)
+
+    def setCurrentFrame(self, i):
+        """Marks frame `i` in the plot and table"""
+        self.current.setValue(i)
+        self.tableView.selectRow(i)
+
+    def export(self):
+        fn = QFileDialog.getSaveFileName(self, "Export statistics", filter="CSV (*.csv);; Parquet (*.parquet)")[0]
+
+        if fn:
+            try:
+                export(self.stats.table(), fn)
+
+            except ImportError:
+                QMessageBox.critical(self, "Parquet export", "Exporting as Parquet requires pyarrow.")
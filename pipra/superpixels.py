@@ -0,0 +1,92 @@
+import numpy as np
+from .background import BackgroundCache
+from .lru import LRUCache
+
+# Average superpixel size in px
+SUPERPIXEL_PX = 400
+
+
+def superpixels(im, px=SUPERPIXEL_PX, compactness=10):
+    """Oversegmentation of an image into superpixels using SLIC.
+
+    Args:
+        im (numpy.ndarray): 2D image, optionally RGB(A)
+        px (int, optional): Average superpixel size in px. Defaults to SUPERPIXEL_PX.
+        compactness (float, optional): Balances color proximity and space proximity. Defaults to 10.
+
+    Returns:
+        numpy.ndarray: Label image, labels start at 0
+    """
+    from skimage.segmentation import slic
+
+    im = np.asarray(im)
+
+    # Intensities are scaled to [0, 1], such that the compactness works for any dtype
+    im = im[..., :3].astype(np.float32) if im.ndim == 3 else im.astype(np.float32)
+    lo, hi = np.nanmin(im), np.nanmax(im)
+    im = (im - lo) / max(hi - lo, 1e-12)
+
+    n = max(im.shape[0] * im.shape[1] // px, 1)
+
+    kwargs = dict(n_segments=n, compactness=compactness, start_label=0)
+
+    try:
+        labels = slic(im, channel_axis=-1 if im.ndim == 3 else None, **kwargs)
+
+    except TypeError:
+        # scikit-image < 0.19 has no channel_axis
+        labels = slic(im, multichannel=im.ndim == 3, **kwargs)
+
+    return labels.astype(np.int32)
+
+
+def label_index(labels):
+    """Index from labels to their px, such that the px of a label are found in O(label size).
+
+    Args:
+        labels (numpy.ndarray): Label image with labels starting at 0
+
+    Returns:
+        tuple: The label image, flat px indices sorted by label and the offset of every label
+    """
+    flat = labels.ravel()
+    order = np.argsort(flat, kind='stable').astype(np.int32 if flat.size < 2**31 else np.int64)
+    offsets = np.zeros(flat.max()+2, dtype=np.int64)
+    np.cumsum(np.bincount(flat), out=offsets[1:])
+
+    return labels, order, offsets
+
+
+def label_pixels(index, i, j):
+    """Pixels of the superpixel at a given position
+
+    Args:
+        index (tuple): Label index, see `label_index`
+        i (int): Position along first image axis
+        j (int): Position along second image axis
+
+    Returns:
+        tuple: The px indices (rr, cc) of the superpixel
+    """
+    labels, order, offsets = index
+    k = labels[i, j]
+
+    return np.divmod(order[offsets[k]:offsets[k+1]], labels.shape[1])
+
+
+class SuperpixelCache(BackgroundCache):
+    def __init__(self, stack, callback=None, max_bytes=512 * 2**20):
+        """Superpixels and their label index per frame, computed in a background thread,
+        see `BackgroundCache`. Least recently used frames are dropped when exceeding `max_bytes`.
+
+        Args:
+            stack (numpy.ndarray or list): The image stack
+            callback (callable, optional): Called with the frame index
+                when the superpixels are ready, from the worker thread. Defaults to None.
+            max_bytes (int, optional): Maximum size of cached label indices. Defaults to 512 MB.
+        """
+        super().__init__(stack, callback)
+        self.results = LRUCache(max_bytes)
+
+    def compute(self, im):
+        return label_index(superpixels(im))
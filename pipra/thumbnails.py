@@ -0,0 +1,160 @@
+import numpy as np
+import flammkuchen as fl
+import os
+from .background import BackgroundCache
+from .lru import LRUCache
+
+# Maximum edge length of thumbnails in px
+THUMBNAIL_SIZE = 96
+
+# Size of cached thumbnails
+THUMBNAIL_BYTES = 64 * 2**20
+
+# Frames of a stack with thumbnails computed in advance, e.g. as previews while scrubbing
+PREVIEW_FRAMES = 512
+
+
+def thumbnail(im, size=THUMBNAIL_SIZE):
+    """Downsampled copy of an image by striding, keeping dtype and channels.
+
+    Args:
+        im (numpy.ndarray): 2D image, optionally with channels
+        size (int, optional): Maximum edge length. Defaults to THUMBNAIL_SIZE.
+
+    Returns:
+        numpy.ndarray: The thumbnail
+    """
+    step = max(-(-max(im.shape[:2]) // size), 1)
+    return np.ascontiguousarray(im[::step, ::step])
+
+
+class ThumbnailCache(BackgroundCache):
+    def __init__(self, stack, callback=None, size=THUMBNAIL_SIZE, max_bytes=THUMBNAIL_BYTES):
+        """Downsampled frames, computed in a background thread when requested, see `BackgroundCache`.
+        The cached results are tuples of the thumbnail and the original frame shape,
+        least recently used thumbnails are evicted. Videos are read with their own decoder.
+
+        Args:
+            stack (numpy.ndarray, list or VideoStack): The image stack
+            callback (callable, optional): Called with the frame index
+                when a thumbnail is ready, from the worker thread. Defaults to None.
+            size (int, optional): Maximum edge length. Defaults to THUMBNAIL_SIZE.
+            max_bytes (int, optional): Size of cached thumbnails. Defaults to THUMBNAIL_BYTES.
+        """
+        self._source = None
+        self._reader = None
+        super().__init__(stack, callback)
+        self.size = size
+        self.stride = 1
+        self.results = LRUCache(max_bytes)
+
+    @property
+    def stack(self):
+        return self._stack
+
+    @stack.setter
+    def stack(self, stack):
+        if stack is self._source:
+            return
+
+        # Thumbnails of videos do not block seeking, the previous reader is closed after pending thumbnails
+        if self._reader is not None:
+            self.submit(self._reader.close)
+
+        self._source = stack
+        self._reader = stack.reader() if hasattr(stack, 'reader') else None
+        self._stack = stack if self._reader is None else self._reader
+
+    def compute(self, im):
+        return thumbnail(im, self.size), im.shape[:2]
+
+    def build(self, fn=None):
+        """Computes the thumbnails of every `stride`-th frame in the background, see `preview`.
+        All other thumbnails are computed when requested, e.g. for the visible part of the filmstrip.
+
+        Args:
+            fn (str, optional): Thumbnail file, loaded before and saved after building. Defaults to None.
+        """
+        if fn is not None:
+            self.load(fn)
+
+        self.stride = max(-(-len(self.stack) // PREVIEW_FRAMES), 1)
+        missing = [i for i in range(0, len(self.stack), self.stride) if i not in self.results]
+        self.request(*missing)
+
+        if fn is not None and missing:
+            self.submit(self.save, fn)
+
+    def preview(self, i):
+        """Thumbnail of frame `i`, or of the closest preceding frame built in advance, see `build`
+
+        Args:
+            i (int): Frame index
+
+        Returns:
+            tuple or None: The thumbnail and the original frame shape, None if not computed yet
+        """
+        r = self.results.get(i)
+
+        return self.results.get(i - i % self.stride) if r is None else r
+
+    def close(self):
+        if self._reader is not None:
+            self.submit(self._reader.close)
+
+        super().close()
+
+    def save(self, fn):
+        """Saves the cached thumbnails into a single padded array
+
+        Args:
+            fn (str): Thumbnail file, e.g. next to the `.mask` file
+        """
+        frames = sorted(self.results.keys())
+        results = [self.results.get(i) for i in frames]
+
+        if not frames or any(r is None for r in results):
+            return
+
+        thumbs = [r[0] for r in results]
+
+        # Only save if thumbnails can be stacked
+        if len(set(t.shape[2:] for t in thumbs)) != 1 or len(set(t.dtype for t in thumbs)) != 1:
+            return
+
+        buffer = np.zeros((len(thumbs), self.size, self.size) + thumbs[0].shape[2:], dtype=thumbs[0].dtype)
+
+        for i, t in enumerate(thumbs):
+            buffer[i, :t.shape[0], :t.shape[1]] = t
+
+        fl.save(fn, {'thumbnails': buffer,
+                     'thumbnail_shapes': np.array([t.shape[:2] for t in thumbs]),
+                     'shapes': np.array([r[1] for r in results]),
+                     'frames': np.array(frames),
+                     'count': len(self.stack),
+                     'size': self.size}, compression='blosc')
+
+    def load(self, fn):
+        """Loads previously saved thumbnails, if they match the stack
+
+        Args:
+            fn (str): Thumbnail file
+        """
+        if not os.path.isfile(fn):
+            return
+
+        try:
+            d = fl.load(fn)
+
+        except Exception as e:
+            print(f"Could not load thumbnails: \n{e}")
+            return
+
+        # Files of older versions contain all frames
+        frames = d.get('frames', np.arange(len(d['thumbnails'])))
+
+        if d['size'] != self.size or d.get('count', len(d['thumbnails'])) != len(self.stack):
+            return
+
+        for i, t, (h, w), shape in zip(frames, d['thumbnails'], d['thumbnail_shapes'], d['shapes']):
+            self.results[int(i)] = t[:h, :w], tuple(shape)
@@ -0,0 +1,254 @@
+import numpy as np
+from .lru import LRUCache
+
+# Tile edge length in px
+TILE_SIZE = 512
+
+# Frames larger than this (in px) are shown tiled
+TILED_PIXELS = 4096 * 4096
+
+
+def level_for(px_size, levels):
+    """Pyramid level needed to show an image with a given pixel size on screen.
+
+    Args:
+        px_size (float): Image px per screen px
+        levels (int): Number of available pyramid levels
+
+    Returns:
+        int: The pyramid level, 0 is full resolution
+    """
+    if px_size <= 1:
+        return 0
+
+    return int(min(np.floor(np.log2(px_size)), levels-1))
+
+
+def _level_range(start, stop, step, size):
+    """Converts a full resolution range to a range at a pyramid level"""
+    start = max(int(start), 0) // step
+    stop = min(-(-int(np.ceil(stop)) // step), -(-size // step))
+
+    return start, max(stop, start)
+
+
+class TiledImage:
+    def __init__(self, im, tile_size=TILE_SIZE, cache=None):
+        """Multi-resolution access to a large 2D image (grayscale or with channels).
+
+        Every pyramid level `l` subsamples the image by `2**l`. Levels are cut into
+        tiles that are created on demand and kept in a least-recently-used cache,
+        such that only the tiles in the current viewport are read.
+
+        Args:
+            im (numpy.ndarray): The image, may be a memory-mapped array
+            tile_size (int, optional): Tile edge length in px. Defaults to TILE_SIZE.
+            cache (LRUCache, optional): Tile cache, may be shared across images. Defaults to None.
+        """
+        self.im = im
+        self.shape = im.shape[:2]
+        self.tile_size = tile_size
+        self.cache = cache if cache is not None else LRUCache()
+
+        # Number of levels until the whole image fits into one tile
+        self.levels = 1
+
+        while max(self.shape) > tile_size * 2**(self.levels-1):
+            self.levels += 1
+
+    def tile(self, level, ti, tj):
+        """Returns a tile at a given pyramid level.
+
+        Args:
+            level (int): Pyramid level
+            ti (int): Tile index along first axis
+            tj (int): Tile index along second axis
+
+        Returns:
+            numpy.ndarray: The tile
+        """
+        key = (id(self.im), level, ti, tj)
+        t = self.cache.get(key)
+
+        if t is None:
+            s = 2**level
+            n = self.tile_size * s
+
+            t = np.ascontiguousarray(self.im[ti*n:(ti+1)*n:s, tj*n:(tj+1)*n:s])
+            self.cache.put(key, t)
+
+        return t
+
+    def region(self, level, i0, i1, j0, j1):
+        """Assembles an image region from tiles at a given pyramid level.
+
+        Args:
+            level (int): Pyramid level
+            i0 (float): Start along first axis (full resolution px)
+            i1 (float): Stop along first axis (full resolution px)
+            j0 (float): Start along second axis (full resolution px)
+            j1 (float): Stop along second axis (full resolution px)
+
+        Returns:
+            tuple: The region as numpy.ndarray and the covered
+                full resolution range (i0, i1, j0, j1)
+        """
+        s = 2**level
+        ts = self.tile_size
+        li0, li1 = _level_range(i0, i1, s, self.shape[0])
+        lj0, lj1 = _level_range(j0, j1, s, self.shape[1])
+
+        out = np.zeros((li1-li0, lj1-lj0) + self.im.shape[2:], dtype=self.im.dtype)
+
+        for ti in range(li0 // ts, -(-li1 // ts)):
+            for tj in range(lj0 // ts, -(-lj1 // ts)):
+                t = self.tile(level, ti, tj)
+
+                # Overlap of tile and region in level coordinates
+                a0, a1 = max(ti*ts, li0), min(ti*ts+t.shape[0], li1)
+                b0, b1 = max(tj*ts, lj0), min(tj*ts+t.shape[1], lj1)
+
+                out[a0-li0:a1-li0, b0-lj0:b1-lj0] = t[a0-ti*ts:a1-ti*ts, b0-tj*ts:b1-tj*ts]
+
+        return out, (li0*s, li1*s, lj0*s, lj1*s)
+
+
+class TiledMask:
+    def __init__(self, shape, tile_size=TILE_SIZE):
+        """Sparse binary mask stored as full resolution tiles.
+
+        Tiles are only allocated when pixels are set, i.e. memory scales
+        with the annotated area and not with the image size.
+        Supports index arrays, i.e. `mask[rr, cc]` and `mask[rr, cc] = value`.
+
+        Args:
+            shape (tuple): Mask shape
+            tile_size (int, optional): Tile edge length in px. Defaults to TILE_SIZE.
+        """
+        self.shape = tuple(shape[:2])
+        self.tile_size = tile_size
+        self.tiles = {}
+
+    @classmethod
+    def from_array(cls, mask, tile_size=TILE_SIZE):
+        """Creates a tiled mask from a dense binary mask.
+
+        Args:
+            mask (numpy.ndarray): Dense binary mask
+            tile_size (int, optional): Tile edge length in px. Defaults to TILE_SIZE.
+
+        Returns:
+            TiledMask: The tiled mask
+        """
+        m = cls(mask.shape, tile_size)
+        ts = tile_size
+
+        for ti in range(-(-m.shape[0] // ts)):
+            for tj in range(-(-m.shape[1] // ts)):
+                t = mask[ti*ts:(ti+1)*ts, tj*ts:(tj+1)*ts]
+
+                if t.any():
+                    m.tiles[ti, tj] = m._empty()
+                    m.tiles[ti, tj][:t.shape[0], :t.shape[1]] = t
+
+        return m
+
+    def _empty(self):
+        return np.zeros((self.tile_size, self.tile_size), dtype=bool)
+
+    def _split(self, rr, cc):
+        """Groups full resolution indices by tile"""
+        rr = np.asarray(rr, dtype=np.intp).ravel()
+        cc = np.asarray(cc, dtype=np.intp).ravel()
+        ts = self.tile_size
+
+        ti, tj = rr // ts, cc // ts
+        keys = ti * (-(-self.shape[1] // ts)) + tj
+        order = np.argsort(keys, kind='stable')
+        keys, idx = np.unique(keys[order], return_index=True)
+
+        for k, a, b in zip(keys, idx, list(idx[1:]) + [len(order)]):
+            sel = order[a:b]
+            yield (int(ti[sel[0]]), int(tj[sel[0]])), sel, rr[sel] % ts, cc[sel] % ts
+
+    def __getitem__(self, index):
+        rr, cc = index
+        rr = np.asarray(rr)
+        out = np.zeros(rr.shape, dtype=bool).ravel()
+
+        for key, sel, r, c in self._split(rr, cc):
+            if key in self.tiles:
+                out[sel] = self.tiles[key][r, c]
+
+        return out.reshape(rr.shape)
+
+    def __setitem__(self, index, value):
+        rr, cc = index
+
+        for key, sel, r, c in self._split(rr, cc):
+            if key not in self.tiles:
+                if not value:
+                    continue
+
+                self.tiles[key] = self._empty()
+
+            self.tiles[key][r, c] = value
+
+    def fill(self, value):
+        """Sets every px of the mask to `value`"""
+        self.tiles = {}
+
+        if value:
+            ts = self.tile_size
+
+            for ti in range(-(-self.shape[0] // ts)):
+                for tj in range(-(-self.shape[1] // ts)):
+                    self.tiles[ti, tj] = ~self._empty()
+
+    def any(self):
+        return any(t.any() for t in self.tiles.values())
+
+    @property
+    def nbytes(self):
+        return sum(t.nbytes for t in self.tiles.values())
+
+    def copy(self):
+        m = TiledMask(self.shape, self.tile_size)
+        m.tiles = {k: t.copy() for k, t in self.tiles.items()}
+        return m
+
+    def to_array(self):
+        """Dense binary mask
+
+        Returns:
+            numpy.ndarray: The mask as full resolution boolean array
+        """
+        out, _ = self.region(0, 0, self.shape[0], 0, self.shape[1])
+        return out
+
+    def region(self, level, i0, i1, j0, j1):
+        """Assembles a mask region at a given pyramid level,
+        see `TiledImage.region`.
+        """
+        s = 2**level
+        ts = self.tile_size
+        li0, li1 = _level_range(i0, i1, s, self.shape[0])
+        lj0, lj1 = _level_range(j0, j1, s, self.shape[1])
+
+        out = np.zeros((li1-li0, lj1-lj0), dtype=bool)
+
+        for (ti, tj), t in self.tiles.items():
+            # First px in tile that lies on the level grid
+            oi, oj = (-ti*ts) % s, (-tj*ts) % s
+            t = t[oi::s, oj::s]
+
+            # Tile position in level coordinates
+            a, b = (ti*ts + oi) // s, (tj*ts + oj) // s
+
+            a0, a1 = max(a, li0), min(a+t.shape[0], li1)
+            b0, b1 = max(b, lj0), min(b+t.shape[1], lj1)
+
+            if a0 < a1 and b0 < b1:
+                out[a0-li0:a1-li0, b0-lj0:b1-lj0] = t[a0-a:a1-a, b0-b:b1-b]
+
+        return out, (li0*s, li1*s, lj0*s, lj1*s)
@@ -0,0 +1,200 @@
+import numpy as np
+import flammkuchen as fl
+import threading
+import os
+from .lru import LRUCache
+
+# Video formats that are opened with random access
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv", ".m4v", ".wmv")
+
+
+def build_index(fn):
+    """Builds a frame index of a video in a single pass over its packets, no frame is decoded.
+
+    Args:
+        fn (str): Path to video
+
+    Returns:
+        dict: Presentation timestamps of all frames (`pts`), indices of keyframes (`keyframes`)
+            and the time base (`time_base`) to convert timestamps to seconds
+    """
+    import av
+
+    with av.open(fn) as container:
+        stream = container.streams.video[0]
+        pts, key = [], []
+
+        for packet in container.demux(stream):
+            # Flushing packets do not contain frames
+            if packet.size == 0:
+                continue
+
+            pts.append(packet.pts if packet.pts is not None else packet.dts)
+            key.append(packet.is_keyframe)
+
+        time_base = stream.time_base.numerator, stream.time_base.denominator
+
+    # Frames are shown in presentation order, packets are stored in decoding order
+    pts, key = np.asarray(pts, dtype=np.int64), np.asarray(key, dtype=bool)
+    order = np.argsort(pts, kind='stable')
+
+    return {'pts': pts[order],
+            'keyframes': np.flatnonzero(key[order]),
+            'time_base': np.array(time_base)}
+
+
+def load_index(fn, fn_index):
+    """Loads the frame index of a video, the index is built and stored if needed.
+
+    Args:
+        fn (str): Path to video
+        fn_index (str): Path to index file, e.g. next to the video
+
+    Returns:
+        dict: The frame index, see `build_index`
+    """
+    st = os.stat(fn)
+
+    if os.path.isfile(fn_index):
+        try:
+            index = fl.load(fn_index)
+
+            if index['size'] == st.st_size and index['mtime'] == st.st_mtime_ns:
+                return index
+
+        except Exception as e:
+            print(f"Could not load video index: \n{e}")
+
+    index = build_index(fn)
+    index['size'] = st.st_size
+    index['mtime'] = st.st_mtime_ns
+
+    try:
+        fl.save(fn_index, index)
+    except Exception as e:
+        print(f"Could not save video index: \n{e}")
+
+    return index
+
+
+class VideoStack:
+    def __init__(self, fn, fn_index=None, cache_bytes=512 * 2**20):
+        """Random access to the frames of a compressed video without decoding it as a whole.
+
+        A frame is read by seeking to the closest preceding keyframe in the frame index
+        and decoding forward. Reading consecutive frames continues decoding without seeking.
+        Recently decoded frames are kept in a cache.
+
+        Args:
+            fn (str): Path to video
+            fn_index (str, optional): Path to index file, defaults to `.index` next to the video. Defaults to None.
+            cache_bytes (int, optional): Size of decoded frame cache. Defaults to 512 MB.
+        """
+        import av
+
+        if fn_index is None:
+            fn_index = os.path.splitext(fn)[0] + ".index"
+
+        self.fn = fn
+        self.fn_index = fn_index
+        self.index = load_index(fn, fn_index)
+        self.pts = self.index['pts']
+        self.keyframes = self.index['keyframes']
+
+        self.container = av.open(fn)
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = 'AUTO'
+
+        self.cache = LRUCache(cache_bytes)
+        self._lock = threading.Lock()
+        self._decoder = None
+        self._next = None
+
+        first = self[0]
+        self.shape = (len(self.pts),) + first.shape
+        self.dtype = first.dtype
+        self.ndim = len(self.shape)
+
+    @property
+    def timestamps(self):
+        """Frame timestamps in seconds"""
+        num, den = self.index['time_base']
+        return self.pts * num / den
+
+    def __len__(self):
+        return len(self.pts)
+
+    def __getitem__(self, i):
+        i = int(i)
+
+        if i < 0:
+            i += len(self)
+
+        if not 0 <= i < len(self):
+            raise IndexError(f"Frame {i} out of range for video with {len(self)} frames")
+
+        im = self.cache.get(i)
+
+        if im is None:
+            with self._lock:
+                im = self._decode(i)
+
+        return im
+
+    def keyframe(self, i):
+        """Closest keyframe at or before frame `i`"""
+        return self.keyframes[max(np.searchsorted(self.keyframes, i, side='right')-1, 0)]
+
+    def _decode(self, i):
+        # Seek to closest keyframe before frame i, unless decoding
+        #  forward from the last decoded frame is cheaper
+        if self._next is None or i < self._next or self.keyframe(i) > self._next:
+            k = self.keyframe(i)
+            self.container.seek(int(self.pts[k]), stream=self.stream, backward=True, any_frame=False)
+            self._decoder = self.container.decode(self.stream)
+            self._next = k
+
+        for frame in self._decoder:
+            # Frame number from its timestamp, frames without timestamp follow in decoding order
+            if frame.pts is None:
+                j = self._next
+
+            else:
+                j = int(np.searchsorted(self.pts, frame.pts))
+
+                # Frames missing in the index are skipped
+                if j == len(self.pts) or self.pts[j] != frame.pts:
+                    continue
+
+            self._next = j + 1
+
+            if j == i:
+                im = frame.to_ndarray(format='rgb24')
+                self.cache.put(j, im)
+                return im
+
+            # The frame is missing in the video
+            if j > i:
+                break
+
+        self._next = None
+        raise IndexError(f"Could not decode frame {i} of {self.fn}")
+
+    def reader(self, cache_bytes=64 * 2**20):
+        """Independent reader of the same video with its own decoder,
+        e.g. for background work that should not block seeking in the GUI.
+
+        Args:
+            cache_bytes (int, optional): Size of decoded frame cache. Defaults to 64 MB.
+
+        Returns:
+            VideoStack: The reader
+        """
+        return VideoStack(self.fn, self.fn_index, cache_bytes)
+
+    def close(self):
+        # Waits for a frame that is being decoded
+        with self._lock:
+            self.container.close()
+            self._decoder = None
+            self._next = None
@@ -0,0 +1,65 @@
+import threading
+import numpy as np
+from pipra.background import BackgroundCache
+
+
+class Means(BackgroundCache):
+    def __init__(self, stack, callback=None):
+        super().__init__(stack, callback)
+        self.computed = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def compute(self, im):
+        self.release.wait()
+        self.computed.append(im[0, 0])
+
+        if im[0, 0] < 0:
+            raise ValueError("broken frame")
+
+        return float(im.mean())
+
+
+def wait(cache):
+    """Waits for all requests submitted before"""
+    cache.submit(lambda: None).result()
+
+
+def test_results_are_computed_once():
+    stack = np.arange(4, dtype=float)[:, None, None] * np.ones((4, 2, 2))
+    ready = []
+    cache = Means(stack, ready.append)
+    cache.release.clear()
+
+    assert cache.get(2) is None
+    cache.request(2, 3, -1, 4)
+    cache.request(3)
+    assert cache.pending == {2, 3}
+
+    cache.release.set()
+    wait(cache)
+
+    assert cache.computed == [2, 3] and ready == [2, 3]
+    assert cache.get(2) == 2 and 3 in cache and cache[3] == 3 and not cache.pending
+
+    cache.request(2)
+    wait(cache)
+    assert cache.computed == [2, 3]
+    cache.close()
+
+
+def test_failed_frames_can_be_requested_again():
+    stack = np.zeros((2, 2, 2))
+    stack[1] = -1
+    ready = []
+    cache = Means(stack, ready.append)
+
+    cache.request(0, 1)
+    wait(cache)
+
+    assert ready == [0] and 1 not in cache and not cache.pending
+
+    cache.request(1)
+    wait(cache)
+    assert cache.computed == [0, -1, -1]
+    cache.close()
@@ -0,0 +1,114 @@
+import json
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+from pipra.masks import MaskVolume, RaggedMasks
+
+coco = importlib.import_module("pipra.coco")
+
+
+def rle_counts(s):
+    """Decompresses RLE counts like the COCO API (`rleFrString`)"""
+    counts, p = [], 0
+
+    while p < len(s):
+        x, k, more = 0, 0, True
+
+        while more:
+            c = ord(s[p]) - 48
+            x |= (c & 0x1f) << 5 * k
+            more = bool(c & 0x20)
+            p += 1
+            k += 1
+
+            if not more and c & 0x10:
+                x |= -1 << 5 * k
+
+        if len(counts) > 2:
+            x += counts[-2]
+
+        counts.append(x)
+
+    return counts
+
+
+def rle_mask(segmentation):
+    """Mask of a COCO RLE, runs in column-major order starting with background"""
+    h, w = segmentation['size']
+    counts = rle_counts(segmentation['counts'])
+    flat = np.repeat(np.arange(len(counts)) % 2 == 1, counts)
+
+    return flat.reshape(w, h).T
+
+
+def test_rle_string_large_and_relative_counts():
+    counts = [0, 5, 1000, 3, 70000, 1, 2]
+
+    assert rle_counts(coco.rle_string(counts)) == counts
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_rle_matches_objects(seed):
+    rng = np.random.default_rng(seed)
+    m = rng.random((23, 31)) > 0.8
+    m[0, :] = m[:, -1] = True
+    objs = coco.objects(m, 'rle')
+    total = np.zeros(m.shape, dtype=int)
+
+    for o in objs:
+        obj = rle_mask(o['segmentation'])
+        x, y, w, h = o['bbox']
+
+        assert obj.sum() == o['area']
+        assert not obj[:y].any() and not obj[y+h:].any() and not obj[:, :x].any() and not obj[:, x+w:].any()
+        total += obj
+
+    np.testing.assert_array_equal(total, m)
+
+
+def test_polygons():
+    m = np.zeros((20, 20), dtype=bool)
+    m[2:8, 3:12] = True
+    m[15, 15] = True
+    objs = coco.objects(m, 'polygon')
+
+    assert sorted(o['area'] for o in objs) == [1, 54]
+
+    for o in objs:
+        for poly in o['segmentation']:
+            assert len(poly) >= 6 and len(poly) % 2 == 0
+
+
+@pytest.mark.parametrize("fmt", coco.FORMATS)
+def test_to_coco(fmt):
+    masks = np.zeros((3, 16, 16), dtype=bool)
+    masks[0, 2:5, 2:5] = masks[0, 10:12, 10:14] = True
+    masks[2, 8:, :4] = True
+
+    with ThreadPoolExecutor(2) as executor:
+        data = coco.to_coco(MaskVolume.from_array(masks), name="stack.tif", fmt=fmt, executor=executor)
+
+    assert [i['frame_index'] for i in data['images']] == [0, 1, 2]
+    assert [a['image_id'] for a in data['annotations']] == [1, 1, 3]
+    assert [a['id'] for a in data['annotations']] == [1, 2, 3]
+    assert [a['area'] for a in data['annotations']] == [9, 8, 32]
+    json.dumps(data)
+
+    if fmt == 'rle':
+        np.testing.assert_array_equal(rle_mask(data['annotations'][2]['segmentation']), masks[2])
+
+
+def test_to_coco_folder_and_cancel():
+    masks = RaggedMasks.from_list([np.ones((4, 6), dtype=bool), np.zeros((2, 2), dtype=bool)])
+
+    with ThreadPoolExecutor(1) as executor:
+        data = coco.to_coco(masks, files=["a.png", "b.png"], executor=executor)
+        cancelled = coco.to_coco(masks, executor=executor, progress=lambda done, total: False)
+
+    assert [(i['file_name'], i['width'], i['height']) for i in data['images']] == [("a.png", 6, 4), ("b.png", 2, 2)]
+    assert len(data['annotations']) == 1
+    assert cancelled is None
+
+    with pytest.raises(ValueError):
+        coco.to_coco(masks, fmt='mask')
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from scipy import ndimage
+from pipra.components import ComponentIndex, STRUCTURE
+
+
+def labeled(mask):
+    return ndimage.label(mask, STRUCTURE)
+
+
+def test_component_and_others():
+    m = np.zeros((12, 12), dtype=bool)
+    m[1:4, 1:4] = True
+    m[4, 4] = True
+    m[8:10, 8:11] = True
+    index = ComponentIndex(m)
+
+    # The diagonal pixel is not connected
+    rr, cc = index.component(2, 2)
+    assert len(rr) == 9 and m[rr, cc].all()
+    assert len(index.component(0, 11)[0]) == 0
+
+    rr, cc = index.others(2, 2)
+    assert sorted(zip(rr, cc)) == [(4, 4)] + [(i, j) for i in (8, 9) for j in (8, 9, 10)]
+
+
+def test_erasing_splits_components():
+    m = np.zeros((5, 9), dtype=bool)
+    m[2, :] = True
+    index = ComponentIndex(m)
+
+    index.update(np.array([2]), np.array([4]), np.array([True]), False)
+
+    assert len(index.component(2, 0)[0]) == 4
+    assert index.root(2, 0) != index.root(2, 8)
+    assert index.summary() == (2, (2, 0, 3, 9))
+
+
+def test_painting_merges_components():
+    m = np.zeros((5, 9), dtype=bool)
+    m[2, :3] = m[2, 6:] = True
+    index = ComponentIndex(m)
+
+    assert index.root(2, 0) != index.root(2, 8)
+
+    # Diagonal neighbours do not connect
+    index.update(np.array([1, 1]), np.array([3, 5]), np.zeros(2, dtype=bool), True)
+    assert index.root(2, 0) != index.root(2, 8)
+
+    index.update(np.array([1]), np.array([4]), np.zeros(1, dtype=bool), True)
+    index.update(np.array([2, 2]), np.array([3, 5]), np.zeros(2, dtype=bool), True)
+
+    assert index.root(2, 0) == index.root(2, 8) == index.root(1, 4)
+    assert len(index.component(2, 0)[0]) == 11
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_strokes_match_labeling(seed):
+    rng = np.random.default_rng(seed)
+    m = rng.random((40, 40)) > 0.7
+    index = ComponentIndex(m)
+
+    for _ in range(40):
+        rr, cc = rng.integers(0, 40, 25), rng.integers(0, 40, 25)
+        value = bool(rng.random() > 0.5)
+        before = m[rr, cc]
+        m[rr, cc] = value
+        index.update(rr, cc, before, value)
+
+        lab, n = labeled(m)
+        assert index.summary()[0] == n
+
+        # Same partition of the px as labeling from scratch
+        i, j = np.argwhere(m)[rng.integers(np.count_nonzero(m))]
+        rr2, cc2 = index.component(i, j)
+        np.testing.assert_array_equal(np.sort(np.ravel_multi_index((rr2, cc2), m.shape)),
+                                      np.flatnonzero(lab == lab[i, j]))
+
+
+def test_summary_of_empty_mask():
+    m = np.zeros((6, 6), dtype=bool)
+    m[2, 2] = True
+    index = ComponentIndex(m)
+    index.update(np.array([2]), np.array([2]), np.array([True]), False)
+
+    assert index.summary() == (0, (-1, -1, -1, -1))
+    assert ComponentIndex(np.zeros((3, 3), dtype=bool)).summary() == (0, (-1, -1, -1, -1))
@@ -0,0 +1,110 @@
+import importlib
+import numpy as np
+import pytest
+from pipra.masks import MaskVolume, RaggedMasks, save_masks
+
+# The package namespace exports the `consensus` function under the module name
+cs = importlib.import_module("pipra.consensus")
+
+
+@pytest.fixture
+def annotators(tmp_path):
+    """Masks of a noisy, a slightly noisy and an accurate annotator of the same square"""
+    rng = np.random.default_rng(0)
+    truth = np.zeros((6, 32, 40), dtype=bool)
+    truth[:, 8:24, 10:30] = True
+    fns, votes = [], []
+
+    for j, noise in enumerate([0.3, 0.02, 0.0]):
+        m = truth ^ (rng.random(truth.shape) < noise)
+        fn = str(tmp_path / f"{j}.mask")
+        save_masks(fn, MaskVolume.from_array(m))
+        fns.append(fn)
+        votes.append(m)
+
+    return fns, np.stack(votes), truth
+
+
+def test_majority():
+    votes = np.array([[1, 1, 0, 0], [1, 0, 1, 0], [1, 0, 0, 0]], dtype=bool)
+
+    np.testing.assert_array_equal(cs.majority(votes), [True, False, False, False])
+    np.testing.assert_array_equal(cs.majority(votes[:2]), [True, False, False, False])
+
+
+def test_vote_patterns():
+    votes = np.array([[1, 0, 1, 0], [1, 1, 0, 0]], dtype=bool)
+
+    np.testing.assert_array_equal(cs.vote_patterns(votes), [3, 2, 1, 0])
+
+
+def test_agreement():
+    a = np.zeros((2, 4, 4), dtype=bool)
+    a[0, :2] = True
+    b = a.copy()
+    b[0, :, :2] = True
+    dice, iou = cs.agreement(np.stack([a, b]))
+
+    # 8 and 12 px sharing 8 px, the empty frame agrees
+    np.testing.assert_allclose(dice, [2 * 8 / 20, 1])
+    np.testing.assert_allclose(iou, [8 / 12, 1])
+    np.testing.assert_array_equal(cs.agreement(a[None])[0], [1, 1])
+
+
+def test_staple_ranks_annotators():
+    rng = np.random.default_rng(1)
+    truth = rng.random(20000) < 0.3
+    votes = np.stack([truth ^ (rng.random(truth.shape) < noise) for noise in (0.01, 0.1, 0.4)])
+    w, p, q = cs.staple(np.bincount(cs.vote_patterns(votes), minlength=8), 3)
+
+    assert p[0] > p[1] > p[2] and q[0] > q[1] > q[2]
+    assert ((w[cs.vote_patterns(votes)] > 0.5) != truth).mean() < 0.02
+
+
+@pytest.mark.parametrize("method", cs.METHODS)
+@pytest.mark.parametrize("chunk_frames", [1, 4, 100])
+def test_consensus_of_files(monkeypatch, annotators, method, chunk_frames):
+    fns, votes, truth = annotators
+    monkeypatch.setattr(cs, 'CHUNK_PX', chunk_frames * len(fns) * 32 * 40)
+    masks, table, performance = cs.consensus(fns, method)
+
+    assert isinstance(masks, MaskVolume)
+    np.testing.assert_array_equal(table['frame'], np.arange(6))
+    np.testing.assert_allclose(table['dice'], cs.agreement(votes)[0])
+
+    if method == 'majority':
+        np.testing.assert_array_equal(masks.to_array(), cs.majority(votes))
+        assert performance is None
+
+    else:
+        assert (masks.to_array() != truth).mean() < 0.01
+        assert performance['sensitivity'][2] > performance['sensitivity'][0]
+
+
+def test_consensus_of_folders(tmp_path):
+    shapes = [(5, 6), (3, 3), (5, 6)]
+    rng = np.random.default_rng(2)
+    votes = [[rng.random(s) > 0.5 for s in shapes] for _ in range(3)]
+    fns = []
+
+    for j, masks in enumerate(votes):
+        fns.append(str(tmp_path / f"{j}.mask"))
+        save_masks(fns[-1], RaggedMasks.from_list(masks), files=["a.png", "b.png", "c.png"])
+
+    masks, _, _ = cs.consensus(fns)
+
+    assert isinstance(masks, RaggedMasks)
+
+    for i in range(3):
+        np.testing.assert_array_equal(masks[i], cs.majority(np.stack([v[i] for v in votes])))
+
+
+def test_consensus_cancel_and_frames(annotators, tmp_path):
+    fns = annotators[0]
+
+    assert cs.consensus(fns, progress=lambda done, total: False) is None
+
+    fn = str(tmp_path / "review.txt")
+    cs.save_frames(fn, [4])
+    np.testing.assert_array_equal(cs.load_frames(fn), [4])
+    np.testing.assert_array_equal(cs.disagreement({'frame': np.arange(3), 'dice': np.array([1, .5, .9])}), [1])
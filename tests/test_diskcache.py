@@ -0,0 +1,85 @@
+import os
+import time
+import numpy as np
+from pipra.diskcache import DiskCache, file_key, STALE_SECONDS
+
+
+def source(tmp_path, name="a.tif", size=4096):
+    fn = str(tmp_path / name)
+
+    with open(fn, "wb") as f:
+        f.write(bytes(size))
+
+    return fn
+
+
+def test_file_key(tmp_path):
+    fn = source(tmp_path, size=5 * 2**20)
+    key = file_key(fn)
+    st = os.stat(fn)
+
+    assert file_key(fn) == key
+    assert file_key(source(tmp_path, "b.tif", 5 * 2**20)) != key
+
+    # Edited in place outside of the hashed blocks, with the same size and modification time
+    time.sleep(0.01)
+
+    with open(fn, "r+b") as f:
+        f.seek(2**20 + 10)
+        f.write(b"x")
+
+    os.utime(fn, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert os.stat(fn).st_mtime_ns == st.st_mtime_ns
+    assert file_key(fn) != key
+
+
+def test_store_and_load(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache"))
+    fn = source(tmp_path)
+    s = np.arange(60, dtype=np.uint16).reshape(3, 4, 5)
+
+    assert cache.load(fn) is None
+
+    stored = cache.store(fn, s)
+    loaded = cache.load(fn)
+
+    assert isinstance(loaded, np.memmap) and not loaded.flags.writeable
+    np.testing.assert_array_equal(stored, s)
+    np.testing.assert_array_equal(loaded, s)
+    assert os.listdir(cache.directory) == [os.path.basename(cache.path(fn))]
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache"), max_bytes=3500)
+    fns = [source(tmp_path, f"{i}.tif") for i in range(3)]
+
+    for i, fn in enumerate(fns):
+        cache.store(fn, np.zeros(1000, dtype=np.uint8))
+        os.utime(cache.path(fn), (i, i))
+
+    # Loading marks an entry as recently used
+    cache.load(fns[0])
+    cache.store(source(tmp_path, "3.tif"), np.zeros(1000, dtype=np.uint8))
+
+    assert [cache.load(fn) is not None for fn in fns] == [True, False, True]
+
+
+def test_unfinished_entries(tmp_path):
+    directory = tmp_path / "cache"
+    directory.mkdir()
+    stale, current = directory / "stale.npy.tmp", directory / "current.npy.tmp"
+    stale.write_bytes(bytes(2000))
+    current.write_bytes(bytes(2000))
+    old = time.time() - STALE_SECONDS - 10
+    os.utime(stale, (old, old))
+
+    # Removed on start-up
+    cache = DiskCache(str(directory), max_bytes=5000)
+    assert sorted(os.listdir(directory)) == ["current.npy.tmp"]
+
+    # Entries that are still written count towards the cache size
+    fn = source(tmp_path)
+    cache.store(fn, np.zeros(2000, dtype=np.uint8))
+    cache.store(source(tmp_path, "b.tif"), np.zeros(2000, dtype=np.uint8))
+
+    assert cache.load(fn) is None and current.exists()
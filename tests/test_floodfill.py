@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+from pipra.floodfill import floodfill, tolerance_scale, floodfill_frames, centroid_seed
+from pipra.masks import EncodedMasks
+
+
+def steps(dtype, step):
+    """Ramp image with 8 intensity steps along x, darkest on the left"""
+    im = np.repeat(np.arange(8) * step, 4)[None].repeat(6, 0)
+
+    return im.astype(dtype)
+
+
+def test_tolerance_scale():
+    assert tolerance_scale(np.array([0, 10], dtype=np.uint8), (50, 60)) == 1
+    assert tolerance_scale(np.array([0, 4095], dtype=np.uint16)) == pytest.approx(4095 / 255)
+    assert tolerance_scale(np.zeros(3, dtype=np.uint16), (0, 4095)) == pytest.approx(4095 / 255)
+    assert tolerance_scale(np.array([0., .5], dtype=np.float32)) == pytest.approx(.5 / 255)
+    assert tolerance_scale(np.zeros(3, dtype=np.float32), (-1, 1)) == pytest.approx(2 / 255)
+
+
+@pytest.mark.parametrize("dtype, step, levels", [(np.uint8, 10, (0, 255)),
+                                                 (np.uint16, 10 * 4095 / 255, (0, 4095)),
+                                                 (np.float32, 10 / 255, (0, 1))])
+def test_tolerance_in_display_steps(dtype, step, levels):
+    """The same tolerance fills the same region of 8 bit, 12 bit and float data shown at its full range"""
+    im = steps(dtype, step)
+
+    for tolerance, columns in ((5, 4), (15, 8), (25, 12)):
+        f = floodfill(im, (3, 0), tolerance=tolerance, levels=levels) == 1
+
+        assert f.all(0).sum() == columns and f.sum() == 6 * columns
+
+    # Equal tolerances both ways from the seed
+    f = floodfill(im, (3, 12), tolerance=15, levels=levels, only_darker_px=False) == 1
+    np.testing.assert_array_equal(np.flatnonzero(f.all(0)), np.arange(8, 20))
+
+
+def test_12_bit_data_does_not_leak():
+    """12 bit data stored as uint16, an edge of 100 raw units stops a fill with tolerance 5"""
+    im = np.zeros((10, 10), dtype=np.uint16)
+    im[:, 5:] = 100
+    im[0, 0] = 4095
+
+    assert (floodfill(im, (5, 0), tolerance=5) == 1).sum() == 49
+
+
+def test_rgb_and_byte_order():
+    im = np.zeros((6, 8, 3), dtype=np.uint16)
+    im[:, 4:] = 1000, 0, 0
+    im[0, 0] = 4095
+    levels = 0, 4095
+
+    f = floodfill(im, (3, 1), tolerance=5, levels=levels) == 1
+    assert f.sum() == 23
+
+    f = floodfill(im.astype('>u2'), (3, 1), tolerance=5, levels=levels, connected=False) == 1
+    assert f.sum() == 23
+
+
+def moving_square(n=8, shape=(30, 40)):
+    """Dark square moving right by 3 px per frame on a bright background"""
+    stack = np.full((n,) + shape, 200, dtype=np.uint8)
+
+    for i in range(n):
+        stack[i, 10:20, 3*i:3*i+8] = 10
+
+    return stack
+
+
+def test_centroid_seed():
+    region = np.zeros((9, 9), dtype=bool)
+    region[2:5, 1:8] = True
+    region[8, 8] = True
+
+    assert centroid_seed(region) == (3, 4)
+
+
+def test_floodfill_frames():
+    stack = moving_square()
+    regions = floodfill_frames(stack, range(2, 6), (15, 12), tolerance=5, levels=(0, 255), only_darker_px=False)
+
+    assert isinstance(regions, EncodedMasks) and sorted(regions) == [2, 3, 4, 5]
+
+    # The fixed seed fills the background once the square moved on
+    assert [regions[i].sum() for i in range(2, 6)] == [80, 80, 80, 30 * 40 - 80]
+    np.testing.assert_array_equal(regions[3], stack[3] == 10)
+
+
+@pytest.mark.parametrize("seed_frame", [0, 4, 7])
+def test_floodfill_frames_recenter(seed_frame):
+    stack = moving_square()
+    seed = 15, 3 * seed_frame + 4
+    regions = floodfill_frames(stack, range(8), seed, seed_frame=seed_frame, recenter=True, levels=(0, 255))
+
+    for i in range(8):
+        np.testing.assert_array_equal(regions[i], stack[i] == 10)
+
+
+def test_floodfill_frames_cancel():
+    calls = []
+
+    def progress(done, total):
+        calls.append(total)
+        return False
+
+    assert floodfill_frames(moving_square(), range(8), (15, 5), progress=progress) is None
+    assert calls == [8]
@@ -0,0 +1,47 @@
+import numpy as np
+from pipra.histogram import subsample, histogram, stack_levels, HistogramCache
+
+
+def test_subsample_is_a_view():
+    im = np.zeros((1000, 2000), dtype=np.uint16)
+    s = subsample(im, max_px=2**12)
+
+    assert np.shares_memory(s, im)
+    assert s.size <= 2**12 and s.size > 2**10
+
+
+def test_histogram():
+    im = np.array([[0, 0, 255], [7, 7, 7]], dtype=np.uint8)
+    x, counts = histogram(im)
+
+    np.testing.assert_array_equal(x, np.arange(256))
+    assert counts[0] == 2 and counts[7] == 3 and counts[255] == 1
+
+    im = np.array([0., 1., np.nan, 2., np.inf])
+    x, counts = histogram(im[None], bins=4)
+    assert counts.sum() == 3 and x[0] == 0
+
+    x, counts = histogram(np.full((2, 2), np.nan))
+    assert counts.sum() == 0
+
+
+def test_stack_levels():
+    stack = np.zeros((100, 20, 20), dtype=np.uint16)
+    stack[:, :, 10:] = 1000
+
+    # Outliers are ignored
+    stack[::10, 0, 0] = 60000
+
+    assert stack_levels(stack) == (0, 1000)
+
+
+def test_histogram_cache():
+    stack = np.arange(3 * 4 * 4, dtype=np.uint8).reshape(3, 4, 4)
+    cache = HistogramCache(stack)
+
+    assert cache.get(1) is None
+    assert cache.levels().result() == stack_levels(stack)
+
+    x, counts = cache.get(1)
+    np.testing.assert_array_equal(np.flatnonzero(counts), np.arange(16, 32))
+    cache.close()
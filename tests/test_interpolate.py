@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from pipra.interpolate import signed_distance, interpolate, interpolate_keyframes
+from pipra.masks import MaskVolume, EncodedMasks
+
+
+def square(y0, x0, size, shape=(48, 48)):
+    m = np.zeros(shape, dtype=bool)
+    m[y0:y0+size, x0:x0+size] = True
+    return m
+
+
+def test_signed_distance():
+    m = square(10, 10, 8)
+    d = signed_distance(m)
+
+    assert (d[m] > 0).all() and (d[~m] < 0).all()
+    assert signed_distance(np.ones((4, 4), dtype=bool)).min() > 0
+
+
+def test_interpolate_grows_between_keyframes():
+    frames = list(interpolate(square(20, 20, 4), square(14, 14, 16), 5))
+    areas = [m.sum() for m in frames]
+
+    assert len(frames) == 5
+    assert areas == sorted(areas) and 16 <= areas[0] and areas[-1] <= 256
+
+
+@pytest.mark.parametrize("chunk_px", [48 * 48, 3 * 48 * 48, 2**24])
+def test_interpolate_chunks_match(chunk_px):
+    m0, m1 = square(5, 5, 10), square(25, 20, 20)
+    expected = list(interpolate(m0, m1, 11, chunk_px=2**24))
+    frames = list(interpolate(m0, m1, 11, chunk_px=chunk_px))
+
+    assert len(frames) == 11
+
+    for a, b in zip(frames, expected):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_interpolate_empty_keyframes():
+    empty = np.zeros((48, 48), dtype=bool)
+
+    assert list(interpolate(square(5, 5, 10), square(5, 5, 10), 0)) == []
+    assert not any(m.any() for m in interpolate(empty, empty, 3))
+
+    # An empty keyframe shrinks the shape of the other one
+    areas = [m.sum() for m in interpolate(square(10, 10, 20), empty, 4)]
+    assert areas == sorted(areas, reverse=True) and areas[0] < 400
+
+
+def test_interpolate_keyframes():
+    v = MaskVolume((10, 48, 48))
+    v[1] = square(10, 10, 10)
+    v[5] = square(10, 10, 10)
+    v[9] = square(20, 20, 10)
+    result = interpolate_keyframes(v, [9, 1, 5])
+
+    assert isinstance(result, EncodedMasks)
+    assert sorted(result) == [2, 3, 4, 6, 7, 8]
+
+    for i in (2, 3, 4):
+        np.testing.assert_array_equal(result[i], v[1])
+
+
+def test_encoded_masks():
+    masks = [square(1, 2, 3, (5, 7)), square(0, 0, 2, (3, 3))]
+    e = EncodedMasks()
+    e[4], e[9] = masks
+
+    assert len(e) == 2 and 4 in e and 5 not in e
+    np.testing.assert_array_equal(e[9], masks[1])
+    assert [i for i, _ in e.items()] == [4, 9]
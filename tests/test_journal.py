@@ -0,0 +1,159 @@
+import os
+import numpy as np
+import pytest
+from pipra.journal import Journal, replay, records, runs, expand, snapshot_id, DELTA, SET
+from pipra.masks import MaskVolume, RaggedMasks, save_masks
+
+SHAPE = (4, 12, 10)
+
+
+def stroke(journal, masks, i, rr, cc, value):
+    rr, cc = np.asarray(rr), np.asarray(cc)
+    m = np.array(masks[i])
+    before = m[rr, cc]
+    m[rr, cc] = value
+    masks[i] = m
+    journal.stroke(i, m.shape, rr, cc, before, value)
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    """A saved `.mask` file and its masks"""
+    fn = str(tmp_path / "stack.mask")
+    a = np.zeros(SHAPE, dtype=bool)
+    a[1, 2:5, 2:5] = True
+    save_masks(fn, MaskVolume.from_array(a))
+
+    return fn, a
+
+
+def test_runs_roundtrip():
+    idx = np.array([0, 1, 2, 5, 7, 8, 100])
+
+    np.testing.assert_array_equal(runs(idx), [0, 3, 5, 6, 7, 9, 100, 101])
+    np.testing.assert_array_equal(expand(runs(idx)), idx)
+
+
+def test_replay_strokes_and_frames(tmp_path, snapshot):
+    fn, a = snapshot
+    current = MaskVolume.from_array(a)
+    j = Journal(str(tmp_path / "stack.journal"), fn)
+
+    stroke(j, current, 0, [1, 1, 2], [1, 2, 2], True)
+    stroke(j, current, 0, [3], [3], True)
+    stroke(j, current, 1, [2, 3], [2, 2], False)
+    full = np.ones(SHAPE[1:], dtype=bool)
+    j.set_frame(3, full)
+    current[3] = full
+    stroke(j, current, 3, [0], [0], False)
+    j.set_frame(2, np.zeros(SHAPE[1:], dtype=bool))
+    j.close()
+
+    assert [r[0] for r in records(j.fn)] == [DELTA, DELTA, SET, DELTA, SET]
+
+    masks = MaskVolume.from_array(a)
+    assert replay(j.fn, masks, fn) == 5
+    np.testing.assert_array_equal(masks.to_array(), current.to_array())
+
+
+def test_replay_only_matching_snapshot(tmp_path, snapshot):
+    fn, a = snapshot
+    j = Journal(str(tmp_path / "stack.journal"), fn)
+    stroke(j, MaskVolume.from_array(a), 0, [0], [0], True)
+    j.close()
+
+    assert replay(str(tmp_path / "missing.journal"), MaskVolume.from_array(a), fn) is None
+    assert replay(j.fn, MaskVolume.from_array(a), None) is None
+
+    # Saving the masks again changes the snapshot
+    os.utime(fn, ns=(0, 0))
+    assert snapshot_id(fn)[0] == 0
+    assert replay(j.fn, MaskVolume.from_array(a), fn) is None
+
+    # A journal of another snapshot is started over
+    Journal(j.fn, fn).close()
+    assert list(records(j.fn)) == []
+
+
+def test_incomplete_record_is_ignored(tmp_path, snapshot):
+    fn, a = snapshot
+    current = MaskVolume.from_array(a)
+    j = Journal(str(tmp_path / "stack.journal"), fn)
+    stroke(j, current, 0, [0], [0], True)
+    j.flush()
+    expected = current.to_array()
+    stroke(j, current, 0, [5, 6], [5, 6], True)
+    j.close()
+
+    # A crash while writing the last record
+    with open(j.fn, "r+b") as f:
+        f.truncate(os.path.getsize(j.fn) - 2)
+
+    masks = MaskVolume.from_array(a)
+    assert replay(j.fn, masks, fn) == 1
+    np.testing.assert_array_equal(masks.to_array(), expected)
+
+
+@pytest.mark.parametrize("cut", [2, 9, 40])
+def test_reopen_after_incomplete_record(tmp_path, snapshot, cut):
+    fn, a = snapshot
+    current = MaskVolume.from_array(a)
+    j = Journal(str(tmp_path / "stack.journal"), fn)
+    stroke(j, current, 0, [0], [0], True)
+    j.flush()
+    size = os.path.getsize(j.fn)
+    j.set_frame(2, np.ones(SHAPE[1:], dtype=bool))
+    j.close()
+
+    # A crash while writing the last record, the next session appends edits
+    with open(j.fn, "r+b") as f:
+        f.truncate(min(size + cut, os.path.getsize(j.fn) - 1))
+
+    j = Journal(j.fn, fn)
+    assert j.nbytes == size
+    stroke(j, current, 1, [6, 7], [6, 6], True)
+    j.close()
+
+    masks = MaskVolume.from_array(a)
+    assert replay(j.fn, masks, fn) == 2
+    assert masks[1].sum() == a[1].sum() + 2
+    assert not masks[2].any()
+
+
+def test_reset_rewrite_and_discard(tmp_path, snapshot):
+    fn, a = snapshot
+    current = MaskVolume.from_array(a)
+    j = Journal(str(tmp_path / "stack.journal"), fn)
+    stroke(j, current, 2, [4], [4], True)
+    j.flush()
+
+    j.reset(fn)
+    assert list(records(j.fn)) == []
+
+    # Rewriting stores every frame
+    stroke(j, current, 0, [0], [0], True)
+    j.rewrite(current)
+    masks = MaskVolume(SHAPE)
+    assert replay(j.fn, masks, fn) == SHAPE[0]
+    np.testing.assert_array_equal(masks.to_array(), current.to_array())
+
+    j.discard()
+    assert not os.path.exists(j.fn)
+
+
+def test_ragged_masks(tmp_path):
+    fn = str(tmp_path / "folder.mask")
+    shapes = [(3, 4), (6, 2)]
+    save_masks(fn, RaggedMasks(shapes), files=["a.png", "b.png"])
+    current = RaggedMasks(shapes)
+    j = Journal(str(tmp_path / "folder.journal"), fn)
+    stroke(j, current, 1, [5, 0], [1, 0], True)
+    j.set_frame(0, np.ones((3, 4), dtype=bool))
+    current[0] = np.ones((3, 4), dtype=bool)
+    j.close()
+
+    masks = RaggedMasks(shapes)
+    assert replay(j.fn, masks, fn) == 2
+
+    for i in range(2):
+        np.testing.assert_array_equal(masks[i], current[i])
@@ -0,0 +1,143 @@
+import numpy as np
+import pytest
+import imageio as io
+from pipra.loader import StackLoader, is_stack, image_shape
+from pipra.masks import MaskVolume, RaggedMasks, save_masks
+from pipra.journal import Journal
+from pipra.diskcache import DiskCache
+
+
+def frames(n=6, shape=(5, 7)):
+    return [np.full(shape, 10 * i, dtype=np.uint16) for i in range(n)]
+
+
+def load(fn, **kwargs):
+    """Loads in the calling thread, returns the events"""
+    events = []
+    StackLoader(fn, callback=events.append, **kwargs).run()
+
+    return events
+
+
+def test_is_stack():
+    assert not is_stack(np.zeros((5, 7))) and not is_stack(np.zeros((5, 7, 3)))
+    assert is_stack(np.zeros((5, 7, 9))) and is_stack(np.zeros((2, 5, 7, 3)))
+
+
+def test_read_file(tmp_path):
+    fn = str(tmp_path / "stack.tif")
+    io.mimwrite(fn, frames())
+    events = load(fn, fn_mask=str(tmp_path / "stack.mask"))
+    kinds = [e[0] for e in events]
+
+    assert kinds[0] == 'first' and kinds[-1] == 'done' and set(kinds[1:-1]) == {'progress'}
+
+    _, first, masks = events[0]
+    assert len(first) == 1 and isinstance(masks, MaskVolume) and masks.shape == (6, 5, 7)
+    np.testing.assert_array_equal(events[-1][1], np.stack(frames()))
+    assert events[-2][2] == 6
+
+
+class Reader:
+    """Reader that reports more frames than it decodes, like some video readers"""
+    def __init__(self, n, length):
+        self.n, self.length = n, length
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def get_length(self):
+        return self.length
+
+    def __iter__(self):
+        return iter(frames(self.n))
+
+
+def test_truncated_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(io, 'get_reader', lambda fn: Reader(4, 10))
+    fn_mask = str(tmp_path / "video.mask")
+    m = np.zeros((10, 5, 7), dtype=bool)
+    m[3, 1, 1] = m[8, 2, 2] = True
+    save_masks(fn_mask, MaskVolume.from_array(m))
+
+    events = load(str(tmp_path / "video.avi"), fn_mask=fn_mask, random_access=False)
+    masks = events[0][2]
+
+    np.testing.assert_array_equal(events[-1][1], np.stack(frames(4)))
+
+    # Masks of the reported frames are shortened to the decoded frames
+    assert len(masks) == 4 and masks[3][1, 1]
+    assert events[-2] == ('progress', events[-1][1], 10)
+
+
+def test_unknown_length(tmp_path, monkeypatch):
+    monkeypatch.setattr(io, 'get_reader', lambda fn: Reader(4, float('inf')))
+    events = load(str(tmp_path / "video.avi"), random_access=False)
+
+    assert events[0][2].shape == (4, 5, 7)
+    np.testing.assert_array_equal(events[-1][1], np.stack(frames(4)))
+
+
+def test_cache(tmp_path):
+    fn = str(tmp_path / "stack.tif")
+    io.mimwrite(fn, frames())
+    cache = DiskCache(str(tmp_path / "cache"))
+    load(fn, cache=cache)
+    events = load(fn, cache=cache)
+
+    assert [e[0] for e in events] == ['first', 'progress', 'done']
+    assert isinstance(events[-1][1], np.memmap)
+    np.testing.assert_array_equal(events[-1][1], np.stack(frames()))
+
+
+def test_read_folder(tmp_path):
+    files = []
+
+    for i, shape in enumerate([(5, 7), (3, 4), (6, 6)]):
+        files.append(str(tmp_path / f"{i}.png"))
+        io.imwrite(files[-1], np.full(shape, i, dtype=np.uint8))
+
+    assert image_shape(files[1]) == (3, 4)
+
+    events = load(str(tmp_path), files=files)
+    masks = events[0][2]
+
+    assert isinstance(masks, RaggedMasks) and [m.shape for m in masks] == [(5, 7), (3, 4), (6, 6)]
+    assert [im[0, 0] for im in events[-1][1]] == [0, 1, 2]
+
+    assert load(str(tmp_path), files=[])[0][0] == 'failed'
+
+
+def test_journal_is_replayed(tmp_path):
+    fn = str(tmp_path / "stack.tif")
+    io.mimwrite(fn, frames())
+    fn_mask, fn_journal = str(tmp_path / "stack.mask"), str(tmp_path / "stack.journal")
+    save_masks(fn_mask, MaskVolume((6, 5, 7)))
+
+    j = Journal(fn_journal, fn_mask)
+    j.stroke(2, (5, 7), [1, 2], [3, 3], [False, False], True)
+    j.close()
+
+    l = StackLoader(fn, fn_mask=fn_mask, fn_journal=fn_journal)
+    masks = l.masks(lambda: (6, 5, 7))
+
+    assert l.recovered == 1 and masks[2].sum() == 2
+
+
+def test_cancel(tmp_path):
+    fn = str(tmp_path / "stack.tif")
+    io.mimwrite(fn, frames())
+    events = []
+    l = StackLoader(fn, callback=events.append)
+
+    def cancel(event):
+        events.append(event)
+        l.cancel()
+
+    l.callback = cancel
+    l.start().join(10)
+
+    assert [e[0] for e in events] == ['first', 'cancelled']
@@ -0,0 +1,172 @@
+import numpy as np
+import pytest
+import flammkuchen as fl
+from pipra.masks import encode, decode, MaskVolume, RaggedMasks, save_masks, load_masks
+
+
+def random_masks(shapes, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.random(s) > 0.5 for s in shapes]
+
+
+SHAPES = [(3, 5), (0, 4), (7, 9), (1, 1), (0, 0), (16, 16)]
+
+
+def test_encode_empty():
+    assert encode(np.zeros((4, 5), dtype=bool)) is None
+    np.testing.assert_array_equal(decode(None, (4, 5)), np.zeros((4, 5), dtype=bool))
+
+
+def test_encode_picks_runs_for_blobs_and_bits_for_noise():
+    blob = np.zeros((64, 64), dtype=bool)
+    blob[10:30, 20:40] = True
+    noise = random_masks([(64, 64)])[0]
+
+    assert encode(blob)[0] == 'runs'
+    assert encode(noise)[0] == 'bits'
+
+
+@pytest.mark.parametrize("shape", [(1, 1), (3, 5), (64, 64), (17, 33)])
+def test_encode_roundtrip(shape):
+    for m in random_masks([shape] * 3) + [np.ones(shape, dtype=bool)]:
+        code = encode(m)
+        np.testing.assert_array_equal(decode(code, shape), m)
+
+    # Runs touching both ends of the frame
+    m = np.zeros(shape, dtype=bool)
+    m.flat[0] = m.flat[-1] = True
+    np.testing.assert_array_equal(decode(encode(m), shape), m)
+
+
+def test_encode_non_bool():
+    m = np.zeros((8, 8), dtype=np.uint8)
+    m[2:4, 2:4] = 255
+    np.testing.assert_array_equal(decode(encode(m), m.shape), m > 0)
+
+
+def test_volume_roundtrip():
+    masks = np.stack(random_masks([(12, 10)] * 5))
+    masks[2] = False
+    v = MaskVolume.from_array(masks)
+
+    assert len(v) == 5
+    assert v.frames[2] is None
+    np.testing.assert_array_equal(v.to_array(), masks)
+    np.testing.assert_array_equal(v.to_array(1, 3), masks[1:3])
+    np.testing.assert_array_equal(v.occupancy(), [True, True, False, True, True])
+
+
+def test_volume_frames_are_read_only():
+    v = MaskVolume((2, 4, 4))
+    v[0] = np.ones((4, 4), dtype=bool)
+
+    with pytest.raises(ValueError):
+        v[0][0, 0] = False
+
+    with pytest.raises(ValueError):
+        v[1] = np.ones((4, 5), dtype=bool)
+
+    # Assigning replaces the decoded frame
+    m = np.zeros((4, 4), dtype=bool)
+    m[1, 2] = True
+    v[0] = m
+    np.testing.assert_array_equal(v[0], m)
+
+
+def test_volume_copy_and_truncate():
+    masks = np.stack(random_masks([(6, 6)] * 4))
+    v = MaskVolume.from_array(masks)
+    c = v.copy()
+    c[0] = np.zeros((6, 6), dtype=bool)
+
+    np.testing.assert_array_equal(v[0], masks[0])
+
+    v.truncate(2)
+    assert len(v) == 2 and v.shape == (2, 6, 6)
+    np.testing.assert_array_equal(v.to_array(), masks[:2])
+
+
+def test_volume_save_load(tmp_path):
+    fn = str(tmp_path / "stack.mask")
+    masks = np.stack(random_masks([(12, 10)] * 4))
+    masks[1] = False
+    save_masks(fn, MaskVolume.from_array(masks))
+    loaded = load_masks(fn)
+
+    assert isinstance(loaded, MaskVolume)
+    np.testing.assert_array_equal(loaded.to_array(), masks)
+    assert loaded.frames[1] is None
+
+
+def test_ragged_roundtrip():
+    masks = random_masks(SHAPES)
+    r = RaggedMasks.from_list(masks)
+
+    assert len(r) == len(masks)
+
+    for m, s in zip(masks, r):
+        np.testing.assert_array_equal(s, m)
+
+
+def test_ragged_assignment():
+    r = RaggedMasks(SHAPES)
+    m = np.ones((7, 9), dtype=bool)
+    r[2] = m
+
+    np.testing.assert_array_equal(r[2], m)
+    assert not r[0].any() and not r[5].any()
+
+    with pytest.raises(ValueError):
+        r[2] = np.ones((9, 7), dtype=bool)
+
+
+def test_ragged_occupancy_with_empty_frames():
+    masks = [np.zeros(s, dtype=bool) for s in SHAPES]
+    masks[3][0, 0] = True
+    masks[5][15, 15] = True
+
+    np.testing.assert_array_equal(RaggedMasks.from_list(masks).occupancy(),
+                                  [False, False, False, True, False, True])
+
+    # Frames without px at the end of the buffer
+    np.testing.assert_array_equal(RaggedMasks([(0, 3), (0, 3)]).occupancy(), [False, False])
+    assert RaggedMasks(np.zeros((0, 2))).occupancy().shape == (0,)
+
+
+def test_ragged_save_load(tmp_path):
+    fn = str(tmp_path / "folder.mask")
+    masks = random_masks(SHAPES)
+    save_masks(fn, RaggedMasks.from_list(masks), files=[f"{i}.png" for i in range(len(masks))])
+    loaded = load_masks(fn)
+
+    assert isinstance(loaded, RaggedMasks)
+
+    for m, s in zip(masks, loaded):
+        np.testing.assert_array_equal(s, m)
+
+    np.testing.assert_array_equal(loaded.occupancy(), [m.any() for m in masks])
+
+
+def test_stack_file_layout(tmp_path):
+    """Masks are (z, y, x) in memory and (z, x, y) in files, as written by older versions"""
+    fn = str(tmp_path / "stack.mask")
+    masks = np.stack(random_masks([(6, 9)] * 3))
+    save_masks(fn, masks)
+
+    np.testing.assert_array_equal(fl.load(fn, "/mask"), masks.transpose(0, 2, 1))
+
+    old = str(tmp_path / "old.mask")
+    fl.save(old, {'mask': masks.transpose(0, 2, 1), 'files': None}, compression='blosc')
+    np.testing.assert_array_equal(load_masks(old).to_array(), masks)
+
+
+def test_old_folder_file(tmp_path):
+    fn = str(tmp_path / "folder.mask")
+    masks = random_masks([(6, 9), (4, 2)])
+    fl.save(fn, {'mask': [m.T for m in masks], 'files': ["a.png", "b.png"]}, compression='blosc')
+    loaded = load_masks(fn)
+
+    assert isinstance(loaded, RaggedMasks)
+
+    for m, s in zip(masks, loaded):
+        np.testing.assert_array_equal(s, m)
@@ -0,0 +1,67 @@
+import numpy as np
+from pipra.memory import MemoryManager, shrink_list, PRIORITY_CACHE, PRIORITY_HISTORY, PRIORITY_DATA
+from pipra.lru import LRUCache
+
+
+def test_shrink_list():
+    items = [np.zeros(100, np.uint8) for _ in range(5)]
+    newest = items[-1]
+
+    assert shrink_list(items, 250) == 300
+    assert len(items) == 2 and items[-1] is newest
+    assert shrink_list(items, 1000) == 0
+
+
+def filled_cache(n, size=100):
+    cache = LRUCache(max_bytes=10**9)
+
+    for i in range(n):
+        cache.put(i, np.zeros(size, np.uint8))
+
+    return cache
+
+
+def test_caches_are_shrunk_before_histories():
+    m = MemoryManager(budget=1100)
+    cache = filled_cache(5)
+    history = [np.zeros(200, np.uint8) for _ in range(3)]
+    spilled = []
+
+    m.register("data", lambda: 0 if spilled else 300, lambda b: spilled.append(b) or 300, PRIORITY_DATA)
+    m.register("history", lambda: sum(h.nbytes for h in history), lambda b: shrink_list(history, b), PRIORITY_HISTORY)
+    m.register_cache("cache", cache)
+    m.register("masks", lambda: 100)
+
+    assert m.usage() == {"data": 300, "history": 600, "cache": 500, "masks": 100}
+
+    # The cache alone frees enough, its most recent value is kept
+    assert m.enforce() == 400 and m.total == 1100
+    assert cache.keys() == [4] and len(history) == 3
+
+    # Then the oldest undo steps are dropped
+    cache.put(0, np.zeros(100, np.uint8))
+    history.append(np.zeros(200, np.uint8))
+    assert m.enforce() == 300 and m.total == 1100
+    assert cache.keys() == [0] and len(history) == 3 and not spilled
+
+    # Image data is spilled last
+    m.budget = 200
+    assert m.enforce() == 900 and m.total == 200
+    assert not history and spilled == [0]
+
+
+def test_within_budget_and_unregister():
+    m = MemoryManager(budget=1000)
+    cache = filled_cache(3)
+    m.register_cache("stack:cache", cache, PRIORITY_CACHE)
+    m.register_cache("stack:other", filled_cache(2))
+    m.register_cache("tiles", filled_cache(1))
+
+    assert m.enforce() == 0 and len(cache) == 3
+
+    m.unregister("stack:")
+    assert list(m.usage()) == ["tiles"]
+
+    # Consumers with the same name are replaced
+    m.register("tiles", lambda: 5)
+    assert m.total == 5
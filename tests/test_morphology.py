@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+from scipy import ndimage
+from pipra import morphology as mo
+from pipra.masks import MaskVolume, RaggedMasks
+from pipra.components import ComponentIndex
+
+
+def volume(seed=0, shape=(13, 24, 24)):
+    rng = np.random.default_rng(seed)
+    return ndimage.binary_opening(rng.random(shape) < 0.5)
+
+
+def applied(masks, changed):
+    out = masks.copy()
+
+    for i, m in changed.items():
+        out[i] = m
+
+    return out
+
+
+def test_fill_holes_per_frame():
+    m = np.zeros((2, 9, 9), dtype=bool)
+    m[:, 2:7, 2:7] = True
+    m[:, 4, 4] = False
+    out = mo.morphology(m, 'fill holes')
+
+    assert out[:, 4, 4].all()
+
+
+def test_remove_small_and_keep_largest_per_frame():
+    m = np.zeros((1, 20, 20), dtype=bool)
+    m[0, 1:3, 1:3] = True
+    m[0, 10:16, 10:16] = True
+
+    np.testing.assert_array_equal(mo.morphology(m, 'remove small objects', 5)[0, 1:3, 1:3], False)
+    np.testing.assert_array_equal(mo.morphology(m, 'keep largest component')[0], mo.morphology(m, 'remove small objects', 5)[0])
+
+
+def test_erode_keeps_border():
+    m = np.ones((1, 6, 6), dtype=bool)
+
+    assert mo.morphology(m, 'erode').all()
+
+
+@pytest.mark.parametrize("operation", mo.OPERATIONS)
+def test_apply_frames_match_stack(operation):
+    a = volume()
+    changed = mo.apply(MaskVolume.from_array(a), operation, 2)
+
+    np.testing.assert_array_equal(applied(a, changed), mo.morphology(a, operation, 2))
+
+
+@pytest.mark.parametrize("operation", ['fill holes', 'remove small objects', 'keep largest component'])
+@pytest.mark.parametrize("frames_per_chunk", [1, 3, 100])
+def test_apply_3d_chunks_match_volume(monkeypatch, operation, frames_per_chunk):
+    a = volume(1)
+    monkeypatch.setattr(mo, 'CHUNK_PX', frames_per_chunk * 24 * 24)
+    changed = mo.apply(MaskVolume.from_array(a), operation, 30, three_d=True)
+
+    np.testing.assert_array_equal(applied(a, changed), mo.morphology(a, operation, 30, three_d=True))
+
+
+def test_apply_3d_empty():
+    v = MaskVolume((4, 8, 8))
+
+    for operation in mo.OPERATIONS:
+        assert mo.apply(v, operation, 2, three_d=True) == {}
+
+
+def test_apply_ragged_and_cancel():
+    masks = [volume(2, (1, 10, 12))[0], np.zeros((5, 5), dtype=bool), volume(3, (1, 7, 7))[0]]
+    changed = mo.apply(RaggedMasks.from_list(masks), 'dilate', 1, three_d=True)
+
+    assert 1 not in changed
+
+    for i, m in changed.items():
+        np.testing.assert_array_equal(m, mo.morphology(masks[i][None], 'dilate', 1)[0])
+
+    assert mo.apply(MaskVolume.from_array(volume()), 'dilate', progress=lambda done, total: False) is None
+
+
+def test_keep_largest_like_component_tool():
+    """Both keep the same component, a longer diagonal chain is not connected"""
+    m = np.zeros((1, 14, 14), dtype=bool)
+    m[0, :3, :3] = True
+    m[0, 4:, 4:] = np.eye(10, dtype=bool)
+    index = ComponentIndex(m[0])
+    rr, cc = index.others(1, 1)
+    kept = m[0].copy()
+    kept[rr, cc] = False
+
+    np.testing.assert_array_equal(mo.morphology(m, 'keep largest component')[0], kept)
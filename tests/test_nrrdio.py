@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+nrrd = pytest.importorskip("nrrd")
+from pipra import nrrdio
+from pipra.nrrdio import read_nrrd
+from pipra.diskcache import DiskCache
+
+
+def volume(dtype=np.uint16, shape=(5, 7, 9)):
+    rng = np.random.default_rng(0)
+    return (rng.random(shape) * 1000).astype(dtype)
+
+
+def write(tmp_path, data, name="volume.nrrd", **header):
+    fn = str(tmp_path / name)
+    nrrd.write(fn, data, header, index_order='C')
+
+    return fn
+
+
+@pytest.mark.parametrize("encoding", ['raw', 'gzip', 'bzip2'])
+@pytest.mark.parametrize("dtype", [np.uint8, np.int16, np.float32])
+@pytest.mark.parametrize("endian", ['little', 'big'])
+def test_matches_pynrrd(tmp_path, encoding, dtype, endian):
+    fn = write(tmp_path, volume(dtype), encoding=encoding, endian=endian)
+    expected, _ = nrrd.read(fn, index_order='C')
+    s = read_nrrd(fn)
+
+    assert s.shape == expected.shape
+    np.testing.assert_array_equal(s, expected)
+
+    if encoding == 'raw':
+        assert isinstance(s, np.memmap)
+
+
+@pytest.mark.parametrize("encoding", ['gzip', 'bzip2'])
+def test_compressed_into_cache(tmp_path, monkeypatch, encoding):
+    fn = write(tmp_path, volume(), encoding=encoding)
+    cache = DiskCache(str(tmp_path / "cache"))
+    s = read_nrrd(fn, cache)
+
+    assert isinstance(s, np.memmap) and cache.load(fn) is not None
+    np.testing.assert_array_equal(s, volume())
+
+    # Read from the cache when opened again
+    def fail(*args):
+        raise AssertionError("Decompressed again")
+
+    monkeypatch.setattr(nrrdio, '_decompress', fail)
+    np.testing.assert_array_equal(read_nrrd(fn, cache), volume())
+
+
+@pytest.mark.parametrize("axis", range(3))
+def test_slicing_axis(tmp_path, axis):
+    fn = write(tmp_path, volume(), encoding='raw')
+
+    np.testing.assert_array_equal(read_nrrd(fn, axis=axis), np.moveaxis(volume(), axis, 0))
+
+
+def test_2d_and_ascii(tmp_path):
+    im = volume(shape=(7, 9))
+
+    np.testing.assert_array_equal(read_nrrd(write(tmp_path, im, encoding='raw')), im[None])
+    np.testing.assert_array_equal(read_nrrd(write(tmp_path, im, "ascii.nrrd", encoding='ascii')), im[None])
+
+
+def test_detached_data_and_byte_skip(tmp_path):
+    data = volume()
+    header = {'type': 'uint16', 'dimension': 3, 'sizes': np.array(data.shape[::-1]),
+              'encoding': 'raw', 'endian': 'little', 'data file': 'volume.raw', 'byte skip': 4}
+    fn = str(tmp_path / "volume.nhdr")
+    nrrd.write(fn, data, header, detached_header=True, index_order='C')
+
+    # Bytes before the data are skipped
+    (tmp_path / "volume.raw").write_bytes(b"HEAD" + data.astype('<u2').tobytes())
+    np.testing.assert_array_equal(read_nrrd(fn), data)
+
+    # Data at the end of the file
+    header['byte skip'] = -1
+    nrrd.write(fn, data, header, detached_header=True, index_order='C')
+    (tmp_path / "volume.raw").write_bytes(b"HEAD" + data.astype('<u2').tobytes())
+
+    np.testing.assert_array_equal(read_nrrd(fn), data)
+
+
+def test_truncated(tmp_path):
+    fn = write(tmp_path, volume(), encoding='gzip')
+
+    with open(fn, "r+b") as f:
+        f.seek(0, 2)
+        f.truncate(f.tell() - 40)
+
+    with pytest.raises(ValueError):
+        read_nrrd(fn)
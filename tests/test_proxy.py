@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from skimage.draw import disk
+from pipra import proxy
+from pipra.floodfill import floodfill
+
+
+def blob(shape=(300, 400), center=(140, 210), radius=90):
+    """Dark disk with narrow notches on a bright background, the notches are lost on a proxy"""
+    im = np.full(shape, 220, dtype=np.uint16)
+    im[disk(center, radius, shape=shape)] = 30
+    i, j = center
+    im[i-1:i+1, j-radius:j-radius+3] = 220
+    im[i-radius:i-radius+5, j:j+2] = 220
+
+    return im
+
+
+def test_proxy_factor():
+    assert proxy.proxy_factor((100, 100), max_px=10000) == 1
+    assert proxy.proxy_factor((1000, 1000), max_px=10000) == 10
+    assert proxy.proxy_factor((1001, 1000), max_px=10000) == 11
+
+
+def test_upsample_and_pad():
+    m = np.zeros((5, 6), dtype=bool)
+    m[1:3, 2] = True
+    crop, offset = proxy.upsample(m, 4, (19, 22))
+
+    assert offset == (4, 8) and crop.shape == (8, 4) and crop.all()
+    assert proxy.upsample(np.zeros((5, 6), dtype=bool), 4, (19, 22)) is None
+
+    # Crops at the image border are cut
+    m[4, 5] = True
+    crop, offset = proxy.upsample(m, 4, (19, 22))
+    assert offset == (4, 8) and crop.shape == (15, 14)
+
+    padded, offset = proxy.pad(np.ones((8, 4), dtype=bool), (4, 8), 6, (19, 22))
+    assert offset == (0, 2) and padded.shape == (4 + 8 + 6, 6 + 4 + 6) and padded.sum() == 32
+
+
+def test_band():
+    coarse = np.zeros((20, 20), dtype=bool)
+    coarse[5:15, 5:15] = True
+    inside, uncertain = proxy.band(coarse, 2)
+
+    assert inside.sum() == 6 * 6 and not (inside & uncertain).any()
+    assert (coarse & ~inside <= uncertain).all()
+
+    # Up to 2 px from the boundary
+    assert uncertain[3, 5] and uncertain[5, 3] and uncertain[6, 6] and inside[7, 7] and not uncertain[2, 5] and not uncertain[8, 8]
+
+    # The image border is not a boundary
+    inside, _ = proxy.band(np.ones((6, 6), dtype=bool), 2)
+    assert inside.all()
+
+
+@pytest.mark.parametrize("f", [2, 4, 7])
+def test_refine_floodfill_matches_full_resolution(f):
+    im = blob()
+    settings = dict(tolerance=10, levels=(0, 255))
+    full = floodfill(im, (140, 210), **settings) == 1
+
+    coarse = proxy.upsample(proxy.proxy_floodfill(proxy.downsample(im, f), f, (140, 210), **settings), f, im.shape)
+    coarse, (i0, j0) = proxy.pad(*coarse, f, im.shape)
+    refined = proxy.refine_floodfill(im, coarse, (i0, j0), f, (140, 210), **settings)
+
+    # The proxy misses the boundary, the band restores it
+    window = full[i0:i0+coarse.shape[0], j0:j0+coarse.shape[1]]
+    assert (coarse != window).sum() > 100
+    np.testing.assert_array_equal(refined, window)
+    assert window.sum() == full.sum()
+
+
+def test_refine_grabcut():
+    im = blob().astype(np.uint8)
+    f = 4
+    r = 30, 30, 360, 230
+    coarse = proxy.upsample(proxy.proxy_grabcut(im, f, r), f, im.shape)
+    coarse, offset = proxy.pad(*coarse, 2 * f, im.shape)
+    refined = proxy.refine_grabcut(im, coarse, offset, f)
+
+    truth = (im == 30)[offset[0]:offset[0]+coarse.shape[0], offset[1]:offset[1]+coarse.shape[1]]
+
+    assert refined.shape == coarse.shape
+    assert (coarse != truth).sum() > 100
+    assert (refined != truth).sum() < 10
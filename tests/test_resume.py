@@ -0,0 +1,93 @@
+import os
+import numpy as np
+from pipra.masks import encode, decode
+from pipra.resume import pack, unpack, diff_history, undo_history, save_resume, load_resume, VERSION
+
+
+def masks(n, shape=(16, 20), seed=0):
+    rng = np.random.default_rng(seed)
+    out = [rng.random(shape) > 0.5 for _ in range(n)]
+
+    # A blob is run-length encoded
+    out[0] = np.zeros(shape, dtype=bool)
+    out[0][2:6, 3:9] = True
+    return out
+
+
+def assert_codes_equal(a, b, shape):
+    assert len(a) == len(b)
+
+    for x, y in zip(a, b):
+        assert (x is None) == (y is None)
+        np.testing.assert_array_equal(decode(x, shape), decode(y, shape))
+
+
+def test_pack_roundtrip():
+    ms = masks(3)
+    codes = [encode(ms[0]), None, encode(ms[1]), encode(ms[2]), None]
+    packed = pack(codes)
+
+    assert codes[0][0] == 'runs' and codes[2][0] == 'bits'
+    assert packed['data'].dtype == np.uint8
+    assert_codes_equal(unpack(packed), codes, ms[0].shape)
+    assert unpack(pack([])) == []
+
+
+def test_history_differences():
+    history = masks(4)
+    current = masks(1, seed=1)[0]
+    codes = diff_history(history, current)
+    restored = undo_history(codes, current)
+
+    assert len(restored) == 4
+
+    for a, b in zip(restored, history):
+        np.testing.assert_array_equal(a, b)
+
+    # Unchanged steps take no space
+    assert diff_history([current, current], current) == [None, None]
+
+
+def state(shape=(16, 20)):
+    history = masks(3, shape)
+    current = masks(1, shape, seed=2)[0]
+    steps = [{0: (encode(history[1]), shape), 4: (None, (3, 3))}, {}, {2: (encode(history[0]), shape)}]
+
+    return {'frame': 4, 'view_range': np.array([[0., 20.], [0., 16.]]), 'radius': 3, 'mode': 'superpixel',
+            'mask': current, 'history': [encode(m) for m in history], 'steps': steps}
+
+
+def test_save_load(tmp_path):
+    fn = str(tmp_path / "stack.resume")
+    s = state()
+    save_resume(fn, s)
+    loaded = load_resume(fn)
+
+    assert not os.path.exists(fn + ".tmp")
+    assert (loaded['frame'], loaded['radius'], loaded['mode']) == (4, 3, 'superpixel')
+    np.testing.assert_array_equal(loaded['view_range'], s['view_range'])
+    np.testing.assert_array_equal(loaded['mask'], s['mask'])
+
+    for a, code in zip(loaded['history'], s['history']):
+        np.testing.assert_array_equal(a, decode(code, s['mask'].shape))
+
+    assert len(loaded['steps']) == 3 and loaded['steps'][1] == {}
+    assert sorted(loaded['steps'][0]) == [0, 4] and loaded['steps'][0][4] == (None, (3, 3))
+    np.testing.assert_array_equal(decode(*loaded['steps'][2][2]), decode(*s['steps'][2][2]))
+
+
+def test_load_other_versions(tmp_path, monkeypatch):
+    fn = str(tmp_path / "stack.resume")
+
+    assert load_resume(fn) is None
+
+    monkeypatch.setattr("pipra.resume.VERSION", VERSION + 1)
+    save_resume(fn, state())
+    monkeypatch.undo()
+
+    assert load_resume(fn) is None
+
+    with open(fn, "wb") as f:
+        f.write(b"broken")
+
+    assert load_resume(fn) is None
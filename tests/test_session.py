@@ -0,0 +1,92 @@
+import queue
+import numpy as np
+import pytest
+from multiprocessing import AuthenticationError
+from pipra.session import SessionServer, SessionClient, dumps, loads, new_key, parse_key
+
+
+def test_messages_roundtrip():
+    message = ('delta', 3, np.arange(5, dtype=np.uint32), True, None, "name", [1, -2], {0: 'a', 7: (False,)})
+    loaded = loads(dumps(message))
+
+    assert loaded[:2] == ('delta', 3)
+    np.testing.assert_array_equal(loaded[2], message[2])
+    assert loaded[2].dtype == np.uint32
+    assert loaded[3:] == message[3:]
+
+
+@pytest.mark.parametrize("value", [object(), np.zeros((2, 2), dtype=np.uint8), np.zeros(3, dtype=np.float64), 1.5])
+def test_messages_refuse_other_types(value):
+    with pytest.raises(TypeError):
+        dumps(('x', value))
+
+
+@pytest.mark.parametrize("data", [b"", b"t\x02\x00\x00\x00i", b"s\xff\xff\x00\x00abc", b"Q", b"NN",
+                                  b"a\x00\x10\x00\x00\x00\x01", b"\x80\x04\x95"])
+def test_messages_reject_invalid_data(data):
+    with pytest.raises(ValueError):
+        loads(data)
+
+
+def test_keys():
+    key = new_key()
+
+    assert len(key) == 16 and parse_key(key.hex()) == key
+    assert parse_key(" secret ") == b"secret"
+
+
+def test_non_local_server_needs_key():
+    with pytest.raises(ValueError):
+        SessionServer(np.zeros((1, 4, 4), dtype=bool), address=('0.0.0.0', 0))
+
+
+@pytest.fixture
+def server():
+    s = SessionServer(np.zeros((4, 8, 8), dtype=bool), address=('localhost', 0)).start()
+    yield s
+    s.close()
+
+
+def test_wrong_key_is_rejected(server):
+    with pytest.raises(AuthenticationError):
+        SessionClient(server.address, b"wrong")
+
+    # The server keeps accepting clients
+    SessionClient(server.address, server.authkey).close()
+
+
+def test_strokes_are_shared_with_locks(server):
+    events = queue.Queue()
+    a = SessionClient(server.address, server.authkey, name="a")
+    b = SessionClient(server.address, server.authkey, name="b", callback=events.put)
+
+    assert a.lock(0, 1).result(5) == (True, "a")
+    assert b.lock(1, 2).result(5) == (False, "a")
+
+    a.stroke(0, np.array([1, 2]), np.array([3, 3]), np.array([False, False]), True)
+    a.flush()
+
+    while True:
+        event = events.get(timeout=5)
+
+        if event[0] == 'delta':
+            break
+
+    kind, i, idx, value, client = event
+    assert (i, value, client) == (0, True, a.id)
+    np.testing.assert_array_equal(idx, [1*8+3, 2*8+3])
+
+    # Changes of frames locked by someone else are rejected
+    b.set_frame(0, np.ones((8, 8), dtype=bool))
+
+    while True:
+        event = events.get(timeout=5)
+
+        if event[0] == 'reject':
+            break
+
+    assert event[1] == 0
+    a.close()
+    b.close()
+
+    assert server.masks[0][1, 3] and server.masks[0][2, 3] and server.masks[0].sum() == 2
@@ -0,0 +1,89 @@
+import numpy as np
+from pipra.stats import MaskStats, frame_stats, export, COLUMNS
+from pipra.components import ComponentIndex
+from pipra.masks import MaskVolume
+
+
+def expected(masks):
+    return [frame_stats(m) for m in masks]
+
+
+def check(stats, masks):
+    table = stats.table()
+
+    for i, (area, sy, sx, bbox, n) in enumerate(expected(masks)):
+        assert table['area'][i] == area
+        assert table['components'][i] == n
+        assert tuple(table[c][i] for c in COLUMNS[4:8]) == tuple(bbox)
+
+        if area:
+            np.testing.assert_allclose((table['centroid_y'][i], table['centroid_x'][i]), (sy / area, sx / area))
+
+        else:
+            assert np.isnan(table['centroid_y'][i])
+
+
+def test_frame_stats():
+    m = np.zeros((10, 10), dtype=bool)
+    m[1:3, 1:3] = True
+    m[3, 3] = True
+
+    # 4-connected like the component tools, the diagonal pixel is a component of its own
+    assert frame_stats(m) == (5, 1+1+2+2+3, 1+2+1+2+3, (1, 1, 4, 4), 2)
+    assert frame_stats(np.zeros((3, 3), dtype=bool))[0] == 0
+
+
+def test_incremental_updates():
+    rng = np.random.default_rng(0)
+    masks = np.zeros((3, 20, 20), dtype=bool)
+    masks[1, 5:10, 5:10] = True
+    v = MaskVolume.from_array(masks)
+    stats = MaskStats(v)
+
+    for _ in range(30):
+        i = rng.integers(3)
+        rr, cc = rng.integers(0, 20, 15), rng.integers(0, 20, 15)
+        value = bool(rng.random() > 0.4)
+        m = np.array(v[i])
+        before = m[rr, cc]
+        m[rr, cc] = value
+        v[i] = m
+        masks[i] = m
+        stats.update(i, rr, cc, before, value)
+
+    check(stats, masks)
+
+
+def test_live_frame_uses_component_index():
+    masks = np.zeros((2, 16, 16), dtype=bool)
+    masks[0, 2:6, 2:6] = True
+    v = MaskVolume.from_array(masks)
+    stats = MaskStats(v)
+
+    # The edited frame is not stored while editing
+    live = masks[0].copy()
+    index = ComponentIndex(live)
+    stats.setLive(0, live, lambda: index)
+
+    for rr, cc, value in [([10, 11], [10, 11], True), ([2, 3, 4, 5], [5, 5, 5, 5], False), ([2], [2], False)]:
+        rr, cc = np.array(rr), np.array(cc)
+        before = live[rr, cc]
+        live[rr, cc] = value
+        index.update(rr, cc, before, value)
+        stats.update(0, rr, cc, before, value)
+
+    check(stats, [live, masks[1]])
+    assert not v[0][10, 10]
+
+
+def test_export_csv(tmp_path):
+    fn = str(tmp_path / "stats.csv")
+    masks = np.zeros((2, 5, 5), dtype=bool)
+    masks[1, 1:3, 1:3] = True
+    export(MaskStats(MaskVolume.from_array(masks)).table(), fn)
+
+    with open(fn) as f:
+        lines = f.read().splitlines()
+
+    assert lines[0] == ','.join(COLUMNS)
+    assert lines[2].split(',')[1] == '4'
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+import skimage.segmentation
+from pipra.superpixels import superpixels, label_index, label_pixels
+
+
+def image(rgb=False):
+    """Two halves of different intensity with noise"""
+    rng = np.random.default_rng(0)
+    im = np.full((40, 60), 20.)
+    im[:, 30:] = 200
+    im += rng.normal(0, 5, im.shape)
+
+    return np.stack([im, im / 2, im / 4], -1).astype(np.uint8) if rgb else im.astype(np.uint16)
+
+
+@pytest.mark.parametrize("rgb", [False, True])
+def test_superpixels(rgb):
+    labels = superpixels(image(rgb), px=100)
+
+    assert labels.shape == (40, 60) and labels.dtype == np.int32
+    assert labels.min() == 0 and labels.max() > 4
+
+    # Superpixels follow the edge
+    left, right = set(np.unique(labels[:, :29])), set(np.unique(labels[:, 31:]))
+    assert not left & right
+
+
+def test_superpixels_without_channel_axis(monkeypatch):
+    """scikit-image < 0.19 only knows `multichannel`"""
+    slic = skimage.segmentation.slic
+    calls = []
+
+    def old_slic(im, multichannel=True, **kwargs):
+        if 'channel_axis' in kwargs:
+            raise TypeError("slic() got an unexpected keyword argument 'channel_axis'")
+
+        calls.append(multichannel)
+        return slic(im, channel_axis=-1 if multichannel else None, **kwargs)
+
+    expected = [superpixels(image(rgb), px=100) for rgb in (False, True)]
+    monkeypatch.setattr(skimage.segmentation, 'slic', old_slic)
+
+    for rgb in (False, True):
+        np.testing.assert_array_equal(superpixels(image(rgb), px=100), expected[rgb])
+
+    assert calls == [False, True]
+
+
+def test_label_index():
+    labels = np.array([[0, 0, 2], [1, 2, 2]])
+    index = label_index(labels)
+
+    for k in range(3):
+        rr, cc = label_pixels(index, *np.argwhere(labels == k)[0])
+        np.testing.assert_array_equal(sorted(zip(rr, cc)), np.argwhere(labels == k))
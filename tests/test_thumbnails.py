@@ -0,0 +1,120 @@
+import numpy as np
+import pytest
+import pipra.thumbnails as th
+from pipra.thumbnails import thumbnail, ThumbnailCache
+
+
+def stack(n=10, shape=(50, 70)):
+    return np.arange(n, dtype=np.uint16)[:, None, None] * np.ones((n,) + shape, dtype=np.uint16)
+
+
+def wait(cache):
+    cache.submit(lambda: None).result()
+
+
+def test_thumbnail():
+    im = np.arange(200 * 300 * 3, dtype=np.uint16).reshape(200, 300, 3)
+    t = thumbnail(im, 96)
+
+    assert t.shape == (50, 75, 3) and t.dtype == np.uint16
+    np.testing.assert_array_equal(t, im[::4, ::4])
+    assert thumbnail(im[:10, :10], 96).shape == (10, 10, 3)
+
+
+def test_build_stride_and_preview(monkeypatch):
+    monkeypatch.setattr(th, 'PREVIEW_FRAMES', 4)
+    cache = ThumbnailCache(stack(10), size=16)
+    cache.build()
+    wait(cache)
+
+    assert cache.stride == 3 and sorted(cache.results.keys()) == [0, 3, 6, 9]
+
+    # Frames in between show the preceding thumbnail until they are computed
+    t, shape = cache.preview(5)
+    assert shape == (50, 70) and t[0, 0] == 3 and t.shape == (10, 14)
+
+    cache.get(5)
+    wait(cache)
+    assert cache.preview(5)[0][0, 0] == 5
+    cache.close()
+
+
+def test_thumbnails_are_bounded():
+    cache = ThumbnailCache(stack(10), size=16, max_bytes=3 * 10 * 14 * 2)
+    cache.request(*range(10))
+    wait(cache)
+
+    assert sorted(cache.results.keys()) == [7, 8, 9]
+    assert cache.get(0) is None
+    cache.close()
+
+
+def test_save_load(tmp_path, monkeypatch):
+    fn = str(tmp_path / "stack.thumbnails")
+    monkeypatch.setattr(th, 'PREVIEW_FRAMES', 5)
+    cache = ThumbnailCache(stack(10), size=16)
+    cache.build(fn)
+    wait(cache)
+    cache.close()
+
+    loaded = ThumbnailCache(stack(10), size=16)
+    loaded.load(fn)
+
+    assert sorted(loaded.results.keys()) == [0, 2, 4, 6, 8]
+    np.testing.assert_array_equal(loaded.results.get(4)[0], cache.results.get(4)[0])
+    assert loaded.results.get(4)[1] == (50, 70)
+
+    # Thumbnails of other stacks or sizes are not used
+    for other in (ThumbnailCache(stack(11), size=16), ThumbnailCache(stack(10), size=32)):
+        other.load(fn)
+        assert len(other.results) == 0
+
+
+class Video:
+    """Stack with its own readers, like `pipra.video.VideoStack`"""
+    def __init__(self, n):
+        self.frames = stack(n)
+        self.readers = []
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, i):
+        raise AssertionError("Thumbnails are read with their own reader")
+
+    def reader(self):
+        r = Reader(self.frames)
+        self.readers.append(r)
+        return r
+
+
+class Reader:
+    def __init__(self, frames):
+        self.frames = frames
+        self.closed = False
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, i):
+        return self.frames[i]
+
+    def close(self):
+        self.closed = True
+
+
+def test_video_reader():
+    video = Video(4)
+    cache = ThumbnailCache(video, size=16)
+    cache.request(1)
+    wait(cache)
+
+    assert cache.get(1)[0][0, 0] == 1
+
+    cache.stack = Video(4)
+    wait(cache)
+    assert video.readers[0].closed
+
+    cache.close()
+    cache._executor.shutdown(wait=True)
+    assert cache.stack.closed
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+from pipra.tiles import TiledImage, TiledMask, level_for
+from pipra.lru import LRUCache, nbytes
+
+
+def test_level_for():
+    assert level_for(0.5, 5) == level_for(1, 5) == 0
+    assert level_for(2, 5) == 1
+    assert level_for(7.9, 5) == 2
+    assert level_for(1000, 5) == 4
+
+
+def test_levels():
+    assert TiledImage(np.zeros((100, 100)), tile_size=128).levels == 1
+
+    # Subsampled by 8, the image fits into one tile
+    assert TiledImage(np.zeros((100, 1000)), tile_size=128).levels == 4
+    assert TiledImage(np.zeros((100, 1025)), tile_size=128).levels == 5
+
+
+@pytest.mark.parametrize("level", range(4))
+@pytest.mark.parametrize("rgb", [False, True])
+def test_region_matches_subsampling(level, rgb):
+    rng = np.random.default_rng(level)
+    im = rng.integers(0, 2**16, (300, 417) + ((3,) if rgb else ()), dtype=np.uint16)
+    tiled = TiledImage(im, tile_size=64)
+    s = 2**level
+
+    out, (i0, i1, j0, j1) = tiled.region(level, 37.5, 251, -20, 500)
+
+    # The covered range is on the level grid and clipped to the image
+    assert i0 % s == 0 and j0 == 0 and i0 <= 37 and i1 >= 251 and j1 >= 417
+    np.testing.assert_array_equal(out, im[i0:i1:s, j0:j1:s])
+
+
+def test_tiles_are_cached():
+    cache = LRUCache(max_bytes=3 * 64 * 64 * 2)
+    tiled = TiledImage(np.zeros((256, 256), dtype=np.uint16), tile_size=64, cache=cache)
+
+    t = tiled.tile(0, 1, 1)
+    assert tiled.tile(0, 1, 1) is t
+
+    # Only the most recently used tiles stay within the budget
+    tiled.region(0, 0, 64, 0, 256)
+    assert len(cache) == 3 and cache.nbytes <= cache.max_bytes
+    assert (id(tiled.im), 0, 1, 1) not in cache
+
+
+def test_tiled_mask():
+    rng = np.random.default_rng(0)
+    dense = np.zeros((150, 230), dtype=bool)
+    dense[10:40, 100:200] = True
+    mask = TiledMask.from_array(dense, tile_size=64)
+
+    assert sorted(mask.tiles) == [(0, 1), (0, 2), (0, 3)]
+
+    rr, cc = rng.integers(0, 150, 500), rng.integers(0, 230, 500)
+    np.testing.assert_array_equal(mask[rr, cc], dense[rr, cc])
+
+    # Erasing outside of allocated tiles allocates nothing
+    mask[rr, cc] = False
+    dense[rr, cc] = False
+    assert len(mask.tiles) == 3
+
+    mask[[140], [5]] = True
+    dense[140, 5] = True
+    np.testing.assert_array_equal(mask.to_array(), dense)
+    assert mask.nbytes == 4 * 64 * 64
+
+    for level in range(3):
+        out, (i0, i1, j0, j1) = mask.region(level, 13, 149, 27, 230)
+        np.testing.assert_array_equal(out, dense[i0:i1:2**level, j0:j1:2**level])
+
+    copy = mask.copy()
+    mask.fill(False)
+    assert not mask.any() and copy.any()
+
+
+def test_lru_cache():
+    cache = LRUCache(max_bytes=300)
+    a, b, c = np.zeros(100, np.uint8), np.zeros(100, np.uint8), np.zeros(150, np.uint8)
+    cache['a'], cache['b'] = a, b
+
+    assert cache.get('a') is a
+    cache['c'] = c
+
+    # b was used least recently
+    assert cache.keys() == ['a', 'c'] and cache.nbytes == 250
+
+    # The most recent value is kept even if too large
+    cache['d'] = np.zeros(1000, np.uint8)
+    assert cache.keys() == ['d']
+    assert cache.shrink(0) == 0
+
+    cache.put('d', (a, {'x': b}))
+    assert cache.nbytes == nbytes((a, b)) == 200
+    assert cache.pop('d') is not None and cache.nbytes == 0
@@ -0,0 +1,105 @@
+import os
+import numpy as np
+import pytest
+
+av = pytest.importorskip("av")
+import pipra.video as video
+from pipra.video import VideoStack, build_index, load_index
+
+FRAMES = 23
+
+
+@pytest.fixture(scope="module")
+def fn(tmp_path_factory):
+    """Video of frames with intensity 10 * frame, B-frames are stored out of presentation order"""
+    fn = str(tmp_path_factory.mktemp("video") / "video.mp4")
+
+    with av.open(fn, "w") as container:
+        stream = container.add_stream("mpeg4", rate=25)
+        stream.width, stream.height = 64, 48
+        stream.pix_fmt = "yuv420p"
+        stream.codec_context.gop_size = 5
+        stream.codec_context.max_b_frames = 2
+        stream.codec_context.bit_rate = 10**7
+        stream.codec_context.options = {"qscale": "1"}
+
+        for i in range(FRAMES):
+            frame = av.VideoFrame.from_ndarray(np.full((48, 64, 3), 10 * i, dtype=np.uint8), format="rgb24")
+            container.mux(stream.encode(frame))
+
+        container.mux(stream.encode())
+
+    return fn
+
+
+@pytest.fixture(scope="module")
+def frames(fn):
+    """All frames decoded in order"""
+    with av.open(fn) as container:
+        return [f.to_ndarray(format='rgb24') for f in container.decode(video=0)]
+
+
+def test_build_index(fn):
+    index = build_index(fn)
+
+    assert len(index['pts']) == FRAMES and np.all(np.diff(index['pts']) > 0)
+    assert index['keyframes'][0] == 0 and 1 < len(index['keyframes']) < FRAMES
+    np.testing.assert_array_equal(index['time_base'], [1, 12800])
+
+
+def test_load_index(fn, tmp_path, monkeypatch):
+    fn_index = str(tmp_path / "video.index")
+    index = load_index(fn, fn_index)
+
+    assert os.path.isfile(fn_index)
+
+    def fail(fn):
+        raise AssertionError("The stored index is used")
+
+    monkeypatch.setattr(video, 'build_index', fail)
+    np.testing.assert_array_equal(load_index(fn, fn_index)['pts'], index['pts'])
+
+    # The index of a changed video is built again
+    st = os.stat(fn)
+    os.utime(fn, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    try:
+        with pytest.raises(AssertionError):
+            load_index(fn, fn_index)
+
+    finally:
+        os.utime(fn, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+def test_random_access(fn, frames, tmp_path):
+    v = VideoStack(fn, str(tmp_path / "video.index"), cache_bytes=0)
+
+    assert v.shape == (FRAMES, 48, 64, 3) and len(v) == FRAMES and v.dtype == np.uint8
+    np.testing.assert_allclose(v.timestamps, np.arange(FRAMES) / 25)
+
+    # Frames differ by their intensity
+    assert len(frames) == FRAMES and np.all(np.diff([np.median(f) for f in frames]) > 0)
+
+    for i in [22, 3, 0, 1, 2, 15, 14, 7, 8, 21, -1] + list(range(FRAMES)):
+        np.testing.assert_array_equal(v[i], frames[i])
+
+    for i in range(FRAMES):
+        assert v.keyframe(i) <= i and v.keyframe(i) in v.keyframes
+
+    with pytest.raises(IndexError):
+        v[FRAMES]
+
+    v.close()
+
+
+def test_reader(fn, frames, tmp_path):
+    v = VideoStack(fn, str(tmp_path / "video.index"))
+    r = v.reader()
+
+    np.testing.assert_array_equal(r[17], frames[17])
+    np.testing.assert_array_equal(v[5], frames[5])
+    assert r.container is not v.container and 5 not in r.cache
+
+    r.close()
+    np.testing.assert_array_equal(v[6], frames[6])
+    v.close()